@@ -48,6 +48,10 @@ from bpy_extras.view3d_utils import location_3d_to_region_2d
 import blf
 import struct
 import zipfile
+import zlib
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree.ElementTree import Element, SubElement, ElementTree
 import nodeitems_utils
 import subprocess
@@ -61,6 +65,9 @@ import tempfile
 from gpu_extras.batch import batch_for_shader
 from math import cos, sin, pi
 import datetime
+import time
+import threading
+import functools
 import mathutils
 from contextlib import contextmanager
 import uuid
@@ -177,6 +184,7 @@ FILTERS = [
     (None),
     ('CUSTOM', 'Custom Filter', 'ShaderNodeGroup',"NODETREE", 0),
 ]
+FILTER_ITEMS = {item[0]: item for item in FILTERS if item}
 MASKITEMS = [
     ('AO', "ShaderNodeAmbientOcclusion", "Color", 'ao_expand'),
     ('Curvature', "ShaderNodeAmbientOcclusion", "Color", 'curv_expand'),
@@ -206,7 +214,7 @@ operator_running = False
 preview_icons = {}
 class UsedMaps(PropertyGroup):
     def update_shader(self, context):
-        UpdateShader()
+        request_shader_update(full = True)
     Diffuse: BoolProperty(name="Diffuse", default= True, update = update_shader)
     Metallic: BoolProperty(name="Metallic", default= True, update = update_shader)
     Roughness: BoolProperty(name="Roughness", default= True, update = update_shader)
@@ -253,17 +261,12 @@ class Brushes(PropertyGroup):
     )
 
 class LayerReference(PropertyGroup):
+    fingerprint_skip = {"index"}
 
-    id: StringProperty()
+    id: StringProperty(update=lambda self, context: clear_layer_index())
     index: IntProperty()
-    def get_layer(self):
-        part = get_material_collection()
-
-        for l in part.layers:
-            if l.id == self.id:
-                return l
-        
-        return None
+    def get_layer(self, part = None):
+        return get_layer_by_id(self.id, part)
  
 class SocketReference(PropertyGroup):
     def updatesocket(self, context):
@@ -315,6 +318,7 @@ class HistrogramReference(PropertyGroup):
     histogram: StringProperty()
     
 class LevelsProperty(PropertyGroup):
+    fingerprint_skip = {"expand", "expand_levels", "suppress_update"}
 
     def valupdate(self, context):
         if self.suppress_update:
@@ -399,15 +403,22 @@ class LevelsProperty(PropertyGroup):
     suppress_update: BoolProperty()
 
 class ResourceProperty(PropertyGroup):
+    fingerprint_skip = {"suppress_update", "expand", "expand_mapping", "histogram"}
     def update(self, context):
         if self.suppress_update:
             return
-        UpdateShader()
+        layer = owner_layer(self)
+        if layer:
+            request_shader_update(layer)
+        else:
+            request_shader_update(full = True)
     def MappingUpdate(self, context):
         if self.suppress_update:
             return
         mapping = self.mapping_node.get_node()
-        if mapping:
+        if mapping and mapping.get("has_shared"):
+            self.update(context)
+        elif mapping:
             set_default(mapping, "Location", (self.mapx,self.mapy,0.0))
             set_default(mapping, "Rotation", (0.0,0.0,self.maprot))
             set_default(mapping, "Scale", (self.mapscalex,self.mapscaley,1.0))
@@ -435,6 +446,9 @@ class ResourceProperty(PropertyGroup):
             self.suppress_update = False
         if self.default_color_socket.get_socket():
             self.default_color_socket.get_socket().default_value = self.default_color
+            layer = owner_layer(self)
+            if paint_focus_covers(layer):
+                request_shader_update(layer)
         else:
             UpdateShader()
     default_color: FloatVectorProperty(
@@ -546,6 +560,7 @@ class TextureMappedProperty(PropertyGroup):
     )
 
 class MaskGeneratorProperty(PropertyGroup):
+    fingerprint_skip = {"expand", "ao_expand", "curv_expand", "pos_expand", "objn_expand"}
     def get_item(self,item):
         if item == "AO":
             return self.ao_resource
@@ -567,6 +582,7 @@ class MaskGeneratorProperty(PropertyGroup):
     objn_expand: BoolProperty(name="Object Normal",default = False)
 
 class FilterProperty(PropertyGroup):
+    fingerprint_skip = {"edit", "editgrunge", "node_name", "mixnode", "layer_in", "suppress_update"}
     def resetinputs(self):
         self.socket_in = 0
         self.socket_out = 0
@@ -591,14 +607,14 @@ class FilterProperty(PropertyGroup):
                     self.resource.image = ims
                 else:
                     self.resource.image = newimage(texture_name)
-        UpdateShader()
+        request_shader_update(get_layer_by_id(self.layer_in))
 
         self.suppress_update = False
     def reset_filter(self, context):
         
         self.suppress_update = True
         self.resetinputs()
-        UpdateShader()
+        request_shader_update(get_layer_by_id(self.layer_in))
         self.suppress_update = False
     def reset_custom_filter(self, context):
         self.suppress_update = True
@@ -606,16 +622,16 @@ class FilterProperty(PropertyGroup):
         self.resetinputs()
         if self.custom_node_tree_p and self.custom_node_tree_p.name.startswith("."):
             self.custom_node_tree_p = None
-        UpdateShader()
+        request_shader_update(get_layer_by_id(self.layer_in))
         self.suppress_update = False
     def update_layer(self, context):
         if not self.suppress_update:
-            layer_filter(get_layer_by_id(self.layer_in), multi = True)
+            request_filter_update(get_layer_by_id(self.layer_in), multi = True)
 
     def valupdate(self, context):
         if self.suppress_update:
             return
-        layer_filter(get_layer_by_id(self.layer_in))
+        request_filter_update(get_layer_by_id(self.layer_in))
 
     id: StringProperty(
         name="ID",
@@ -684,6 +700,11 @@ class FilterProperty(PropertyGroup):
         sock = self.opacity_socket.get_socket()
         if sock:
             sock.default_value = self.opacity
+        layer = get_layer_by_id(self.layer_in)
+        if self.id in shader_state["folds"] and shader_state["folds"][self.id] != filter_fold_state(self):
+            request_shader_update(layer)
+        elif paint_focus_covers(layer):
+            request_shader_update(layer)
            
     opacity: FloatProperty(
         name="Opacity",
@@ -720,35 +741,33 @@ class FilterProperty(PropertyGroup):
     levels: PointerProperty(type=LevelsProperty)
     
 class LayerProperties(PropertyGroup):
+    # UI state and bookkeeping that never changes what a layer renders;
+    # hash_properties() leaves these out of export and cache keys.
+    fingerprint_skip = {"collapse_box", "expand_filters", "expand_sublayers", "lock", "node_name", "layer_name", "filter_show", "index", "sort_color", "renamebutton", "suppress_update"}
 
     def update_layer(self, context):
-        if self.layer_type =="PBR":
-            create_pbr_nodegroup(self)
-            return
-        elif self.layer_type =="FOLDER":
-            create_folder_nodegroup(self)
-            return
-        else:
-            name = getlayergroupname(self)
-            if name in bpy.data.node_groups:
-                create_layer_node(self)
-                return
-        UpdateShader()
+        request_layer_update(self)
 
     def update_opacity(self, context):
         sock = self.opacity_socket.get_socket()
         if sock:
             sock.default_value = self.opacity
+        if self.id in shader_state["folds"] and shader_state["folds"][self.id] != layer_fold_state(self):
+            request_shader_update(self)
+        elif paint_focus_covers(self):
+            request_shader_update(self)
 
     def update_color(self, context):
         sock = self.color_socket.get_socket()
         if sock:
             sock.default_value = self.default_color
+        if paint_focus_covers(self):
+            request_shader_update(self)
 
     def update_shader(self, context):
         if self.suppress_update:
             return
-        UpdateShader()
+        request_shader_update(self)
     
     def texturetypechanged(self, context):
         if self.suppress_update:
@@ -759,7 +778,7 @@ class LayerProperties(PropertyGroup):
             self.blend_mode = "ADD"
             suppress_update = False
         check_attach(self,context)
-        UpdateShader()
+        request_shader_update(self)
     
     def get_node_groups(self, context):
         prefixes_to_check = ['DIFFUSE_Group', 'METALLIC_Group', 'ROUGHNESS_Group', 'EMISSION_Group', 'ALPHA_Group', 'NORMAL_Group', 'HEIGHT_Group']
@@ -771,7 +790,8 @@ class LayerProperties(PropertyGroup):
 
     id: StringProperty(
         name="ID",
-        default="empty"
+        default="empty",
+        update=lambda self, context: clear_layer_index()
     )
     blend_mode: EnumProperty(
         name="Blend Mode",
@@ -860,6 +880,7 @@ class LayerProperties(PropertyGroup):
     suppress_update: BoolProperty()
 
 class TextureTypeProp(PropertyGroup):
+    fingerprint_skip = {"expand"}
     def get_texture_types(self, context):
         tt = [ts for ts in TEXTURE_TYPE]
         tt.append(("EMPTY", "Empty", ""))
@@ -922,7 +943,7 @@ class TextureTypeProp(PropertyGroup):
 class OtherProps(PropertyGroup):
 
     def update_layer(self, context):
-        UpdateShader()
+        request_shader_update()
 
     image: PointerProperty(
         name="Image",
@@ -990,6 +1011,9 @@ class OtherProps(PropertyGroup):
     expand_area_DefaultMaterial: BoolProperty(
         name="Default Material",
     )
+    expand_area_Profiling: BoolProperty(
+        name="Performance",
+    )
     bakemtl: PointerProperty(
         name="Bake Mtl",
         type=bpy.types.Material
@@ -1076,7 +1100,62 @@ class OtherProps(PropertyGroup):
     inbufferfilter: StringProperty()
     emptyprop: BoolProperty()
     exportprops: CollectionProperty(type=TextureTypeProp)
-    usedids: StringProperty()
+    export_background_write: BoolProperty(
+        name="Background Writing",
+        default=False,
+        description="Encode and write exported PNGs on worker threads while the next map renders. Uses the add-on's own 8 bit PNG encoder instead of Blender's image writer",
+    )
+    export_workers: IntProperty(
+        name="Writer Threads",
+        default=0,
+        min=0,
+        max=32,
+        description="Number of threads used to write textures, 0 picks one per core",
+    )
+    layer_page_size: IntProperty(
+        name="Layers Per Page",
+        default=50,
+        min=0,
+        max=1000,
+        description="Number of layer rows drawn at once in the panel, 0 draws all of them",
+    )
+    defer_updates: BoolProperty(
+        name="Defer Updates",
+        default=True,
+        description="Collect node rebuilds requested by property changes and run them once per redraw instead of on every change",
+    )
+    def update_compile_shader(self, context):
+        request_shader_update()
+    paint_focus: BoolProperty(
+        name="Paint Focus",
+        default=False,
+        description="Bake the layers under the selected layer into one texture per channel so the viewport only evaluates the selected layer and the layers above it",
+        update=update_compile_shader,
+    )
+    compile_shader: BoolProperty(
+        name="Compiled Shader",
+        default=False,
+        description="Drive the material from a single flattened node tree built from the layer groups, which compiles and renders faster in the viewport",
+        update=update_compile_shader,
+    )
+    export_tile_size: IntProperty(
+        name="Tile Size",
+        default=0,
+        min=0,
+        max=8192,
+        description="Render larger textures in tiles of this size and stream them to disk to keep memory low, 0 renders in one piece",
+    )
+    export_incremental: BoolProperty(
+        name="Skip Unchanged Maps",
+        default=True,
+        description="Keep a manifest next to the exported files and only re-export maps whose layers or settings changed",
+    )
+    export_single_pass: BoolProperty(
+        name="Single Pass Export",
+        default=False,
+        description="Render every exported channel once through AOV passes and pack the maps in memory",
+    )
+    usedids: StringProperty() # legacy id list, emptied by registered_ids()
     search: StringProperty()
 
 class DebugPlaneProps(PropertyGroup):
@@ -1128,6 +1207,7 @@ class BakeMapSettings(PropertyGroup):
     smsubd: BoolProperty(default = False)
   
 class ObjectsColProperty(PropertyGroup):
+    fingerprint_skip = {"suppress_update"}
     def Upd(self, context):
         part = get_material_collection()
         if not self.obj:
@@ -1176,6 +1256,7 @@ class ObjectsColProperty(PropertyGroup):
     obj: PointerProperty(type=bpy.types.Object, update = Upd)
 
 class BakingProperties(PropertyGroup):
+    fingerprint_skip = {"expand_hp", "expand_lp"}
     def hidehp(self, context):
         for ob in self.gethpobjects(context):
             ob.hide_set(not self.visible_hp)
@@ -1271,10 +1352,46 @@ class BakingProperties(PropertyGroup):
         min=1,
         max=8192
     )
+    preview_bake: BoolProperty(
+        name="Preview Bake",
+        default=False,
+        description="Bake a fast low resolution preview first and refine to the final settings in the background",
+    )
+    preview_divider: IntProperty(
+        name="Preview Divider",
+        default=4,
+        min=2,
+        max=16,
+        description="Resolution and samples of the preview are divided by this value",
+    )
+    parallel_bake: BoolProperty(
+        name="Parallel Bake",
+        default=False,
+        description="Bake every map in its own background Blender process",
+    )
+    bake_workers: IntProperty(
+        name="Workers",
+        default=0,
+        min=0,
+        max=64,
+        description="Number of bake processes running at the same time, 0 picks one per four cores",
+    )
+    bake_worker_threads: IntProperty(
+        name="Threads",
+        default=0,
+        min=0,
+        max=1024,
+        description="Render threads of each bake process, 0 splits the cores between the workers",
+    )
+    cache_geometry: BoolProperty(
+        name="Cache Geometry",
+        default=True,
+        description="Keep the joined high and low poly meshes between bakes and rebuild them only when the source objects change",
+    )
 
 class HASMaterialProperties(PropertyGroup):
     def update_layer(self, context):
-        UpdateShader()
+        request_shader_update(full = True)
     layers: CollectionProperty(type=LayerProperties)
     sublayers: CollectionProperty(type=LayerProperties)
     
@@ -1282,7 +1399,8 @@ class HASMaterialProperties(PropertyGroup):
 
     material: PointerProperty(
         name="Material",
-        type=bpy.types.Material
+        type=bpy.types.Material,
+        update=lambda self, context: clear_material_collection_cache()
     )
     name: StringProperty(
         default="Set",
@@ -1663,6 +1781,14 @@ class TEXTURE_PT_file_browser_panel(bpy.types.Panel):
         boxd = box.box()
         boxd.prop(other_props, "height_to_normal", text="Height to Normal")
         boxd.prop(other_props, "invert_green_n", text="Normal Invert G Channel")
+        boxd.prop(other_props, "export_single_pass", text="Single Pass Export")
+        boxd.prop(other_props, "export_incremental", text="Skip Unchanged Maps")
+        row = boxd.row(align=True)
+        row.prop(other_props, "export_background_write", text="Background Writing")
+        sub = row.row(align=True)
+        sub.active = other_props.export_background_write
+        sub.prop(other_props, "export_workers", text="Threads")
+        boxd.prop(other_props, "export_tile_size", text="Tile Size")
 
         boxd = box.box()
         boxd.label(text="Allowed properties: (obj), (mtl), (file), (set)")
@@ -1824,6 +1950,149 @@ class WM_OT_OpenWebsite(Operator):
         webbrowser.open(self.link)
         return {'FINISHED'}
 
+###
+### PROFILING
+###
+
+PROFILE_SAMPLES = 512
+PROFILE_TRACE_EVENTS = 200000
+
+# Call counts and wall times of the hot paths, recorded only while enabled.
+profile_state = {
+    "enabled": False,
+    "origin": 0.0,
+    "stats": {},
+    "trace": [],
+}
+# Export writer threads record too.
+profile_lock = threading.Lock()
+
+def record_profile(name, start, end):
+    duration = end - start
+    with profile_lock:
+        stats = profile_state["stats"].get(name)
+        if stats is None:
+            stats = profile_state["stats"][name] = {"count": 0, "total": 0.0, "samples": []}
+        samples = stats["samples"]
+        if len(samples) < PROFILE_SAMPLES:
+            samples.append(duration)
+        else:
+            samples[stats["count"] % PROFILE_SAMPLES] = duration
+        stats["count"] += 1
+        stats["total"] += duration
+        if len(profile_state["trace"]) < PROFILE_TRACE_EVENTS:
+            profile_state["trace"].append((name, start, duration, threading.get_ident()))
+
+def profiled(name):
+    # Disabled, the wrapper costs one dict lookup per call.
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profile_state["enabled"]:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_profile(name, start, time.perf_counter())
+        return wrapper
+    return decorate
+
+@contextmanager
+def profile_section(name):
+    if not profile_state["enabled"]:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_profile(name, start, time.perf_counter())
+
+def reset_profile():
+    with profile_lock:
+        profile_state["stats"].clear()
+        profile_state["trace"].clear()
+        profile_state["origin"] = time.perf_counter()
+
+def profile_summary():
+    # (name, calls, total, p95) sorted by total time, in seconds.
+    rows = []
+    with profile_lock:
+        stats_items = [(name, dict(stats, samples=list(stats["samples"]))) for name, stats in profile_state["stats"].items()]
+    for name, stats in stats_items:
+        samples = sorted(stats["samples"])
+        p95 = samples[int(0.95 * (len(samples) - 1))] if samples else 0.0
+        rows.append((name, stats["count"], stats["total"], p95))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows
+
+def profile_trace():
+    # Chrome trace event format, open in chrome://tracing or ui.perfetto.dev.
+    origin = profile_state["origin"]
+    pid = os.getpid()
+    threads = {}
+    events = []
+    with profile_lock:
+        trace = list(profile_state["trace"])
+    for name, start, duration, thread in trace:
+        events.append({
+            "name": name,
+            "cat": "HASPaintLayers",
+            "ph": "X",
+            "ts": round((start - origin) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": pid,
+            "tid": threads.setdefault(thread, len(threads)),
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+class ToggleProfiling(Operator):
+    """Record call counts and timings of shader building, baking and file writes"""
+    bl_idname = "haspaint.toggle_profiling"
+    bl_label = "Record Timings"
+
+    def execute(self, context):
+        profile_state["enabled"] = not profile_state["enabled"]
+        if profile_state["enabled"] and not profile_state["stats"]:
+            reset_profile()
+        return {'FINISHED'}
+
+class ResetProfiling(Operator):
+    """Clear the recorded timings"""
+    bl_idname = "haspaint.reset_profiling"
+    bl_label = "Reset Timings"
+
+    def execute(self, context):
+        reset_profile()
+        return {'FINISHED'}
+
+class ExportProfileTrace(Operator):
+    """Save the recorded timings as a Chrome trace"""
+    bl_idname = "haspaint.export_profile_trace"
+    bl_label = "Export Trace"
+
+    filepath: StringProperty(subtype="FILE_PATH")
+    filter_glob: StringProperty(
+        default="*.json",
+        options={'HIDDEN'}
+    )
+
+    def execute(self, context):
+        if not self.filepath:
+            self.report({'ERROR'}, "No file path specified.")
+            return {'CANCELLED'}
+        if not self.filepath.lower().endswith(".json"):
+            self.filepath += ".json"
+        trace = profile_trace()
+        write_summary(self.filepath, trace)
+        self.report({'INFO'}, f"Wrote {len(trace['traceEvents'])} events to {self.filepath}")
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
 ###
 ### Baking
 ###
@@ -1862,9 +2131,30 @@ class ExportTextures(Operator):
         default="*.png;*.jpg;*.jpeg;*.tiff;*.bmp;*.exr;*.hdr",
         options={'HIDDEN'}
     )
+    material_set: StringProperty(options={'HIDDEN', 'SKIP_SAVE'})
 
     def execute(self, context):
-        part = get_material_collection()
+        self._writer = None
+        try:
+            with paint_focus_suspended(), pooled_pixel_buffers():
+                return self.export(context)
+        finally:
+            # A failed export must not leave the writer threads running.
+            if self._writer:
+                self._writer.close()
+
+    def export(self, context):
+        global last_export
+        last_export = {"written": [], "skipped": [], "errors": []}
+        flush_updates()
+        if self.material_set:
+            part = find_material_collection(context.scene, self.material_set)
+            if part is None:
+                last_export["errors"].append("material set not found")
+                self.report({'ERROR'}, f"Material set not found: {self.material_set}")
+                return {'CANCELLED'}
+        else:
+            part = get_material_collection()
         if not part:
             return {'FINISHED'}
         elif not part.layers:
@@ -1875,16 +2165,41 @@ class ExportTextures(Operator):
         otps.save_path = directory
         otps.currentprefix = user_filename
 
-        basescene = bpy.context.window.scene
-        usedtypes = getusedtypes()
-
-        layers = get_layers(part.base_layers)
+        basescene = active_scene()
 
         mtlname = getmaterialgroupname(part)
-        obj_name = bpy.context.active_object.name
+        obj_name = material_object_name(part)
         file_name = os.path.basename(bpy.data.filepath) if bpy.data.filepath else "untitled"
         set_name = part.name
-        bake_scene, material, plane, output_node, colorfix, alphasocket, camera = setup_bake_scene(basescene)
+        if not otps.exportprops:
+
+            pr = otps.exportprops.add()
+            pr.type = 'RGB'
+            pr.RGB = 'DIFFUSE'
+            pr.save_name = '(mtl)_Color'
+
+        manifest = load_export_manifest(directory) if otps.export_incremental else None
+        fingerprints = {}
+        image_fingerprints = {}
+        skipped = []
+        todo = []
+        for textype in otps.exportprops:
+            image_name = generate_filename(textype.save_name, context, obj_name, mtlname, file_name, set_name)
+            file_path = os.path.join(directory, otps.currentprefix + image_name + ".png")
+            if manifest is not None:
+                fingerprint = export_fingerprint(part, otps, textype, image_fingerprints)
+                if export_is_current(manifest, file_path, fingerprint):
+                    skipped.append(image_name)
+                    continue
+                fingerprints[file_path] = fingerprint
+            todo.append((textype, image_name, file_path))
+        last_export["skipped"] = skipped
+        if skipped:
+            self.report({'INFO'}, f"Skipped {len(skipped)} unchanged maps: {', '.join(skipped)}")
+        if not todo:
+            return {'FINISHED'}
+
+        bake_scene, material, plane, output_node, colorfix, alphasocket, camera = setup_bake_scene(basescene, part)
         if part.uvs:
             old_uv = plane.data.uv_layers[0]
             new_uv = plane.data.uv_layers.new(name=part.uvs)
@@ -1894,15 +2209,21 @@ class ExportTextures(Operator):
             node_group = bpy.data.node_groups[mtlname]
         has_mtl = tree.nodes.new('ShaderNodeGroup')
         has_mtl.node_tree = node_group
-        props = otps.exportprops
-        if not otps.exportprops:
-
-            pr = otps.exportprops.add()
-            pr.type = 'RGB'
-            pr.RGB = 'DIFFUSE'
-            pr.save_name = '(mtl)_Color'
-        if otps.exportprops:
-            for textype in otps.exportprops:
+        writer = self._writer = TextureWriter(otps.export_workers) if otps.export_background_write else None
+        written = []
+        tile_size = otps.export_tile_size
+        if max(part.texture_sizeX, part.texture_sizeY) <= tile_size:
+            tile_size = 0
+        if otps.export_single_pass and not tile_size:
+            written, exported, missing = self.export_single_pass(bake_scene, material, has_mtl, part, otps, todo, writer)
+            for image_name, labels in missing:
+                self.report({'WARNING'}, f"{image_name}: no {', '.join(labels)} channel in the material, written as black")
+            if exported:
+                self.report({'INFO'}, f"Exported {exported} of {len(todo)} maps from a single render")
+            else:
+                self.report({'WARNING'}, "Nothing to export from a single render")
+        else:
+            for textype, image_name, file_path in todo:
                 if textype.A:
                     alpha_name = gettexturelabel(textype.A)
                 clear_socket_links(colorfix, 0)
@@ -1920,40 +2241,12 @@ class ExportTextures(Operator):
                     #has_mtl.inputs["Normal"].default_value = (0.0,0.0,0.0,0.0)
 
                     if type_name == 'Normal':
-                        invnrmnode = create_node(tree,'ShaderNodeGroup', -200,-200, "cus", InvertNormalNode().name) if otps.invert_green_n else None
-
-                        gamma = create_node(tree,'ShaderNodeGamma', -200,0, "", '')
-                        set_default(gamma,1, 2.4)
-                        tree.links.new(has_mtl.outputs[f'RawNormal'], gamma.inputs[0])
-                        tree.links.new(gamma.outputs[0], colorfix.inputs[1])
-                        if invnrmnode:
-                            tree.links.new(gamma.outputs[0], invnrmnode.inputs['Normal'])
-                            tree.links.new(invnrmnode.outputs['Normal'], colorfix.inputs[1])
-                        #seprgb = create_node(tree,'ShaderNodeSeparateRGB', -600,0, "", "")
-                        #nrmlznd = create_node(tree,'ShaderNodeVectorMath', -600,0, "op", "NORMALIZE")
-                        if otps.height_to_normal:
-                            subt = create_node(tree,'ShaderNodeMixRGB', -600,0, "mix", "SUBTRACT")
-                            set_default(subt, 0, 1.0)
-                            bump = create_node(tree,'ShaderNodeBump', -600,0, "", "")
-                            set_default(bump, 0, part.height_intensity)
-                            nrmnd = create_node(tree,'ShaderNodeNormalMap', -600,0, "", "")
-
-                            scre = create_node(tree,'ShaderNodeMixRGB', -600,0, "mix", "SCREEN")
-                            set_default(scre, 0, 1.0)
-
-                            tree.links.new(has_mtl.outputs["Height"], bump.inputs[2])
-                            tree.links.new(bump.outputs[0], subt.inputs[1])
-                            tree.links.new(nrmnd.outputs[0], subt.inputs[2])
-                            tree.links.new(subt.outputs[0], scre.inputs[1])
-                            #tree.links.new(has_mtl.outputs[f'RawNormal'], scre.inputs[2])
-                            tree.links.new(has_mtl.outputs[f'RawNormal'], gamma.inputs[0])
-                            tree.links.new(gamma.outputs[0], scre.inputs[2])
-                            if invnrmnode:
-                                tree.links.new(gamma.outputs[0], invnrmnode.inputs['Normal'])
-                                tree.links.new(invnrmnode.outputs['Normal'], scre.inputs[2])
-                            emis = get_node_by_name(tree,"Emission")
+                        normal_socket, height_socket = export_normal_socket(tree, has_mtl, part, otps)
+                        tree.links.new(normal_socket, colorfix.inputs[1])
+                        if height_socket:
+                            emis = get_node_by_name(tree,"fs_Emission")
                             if emis:
-                                tree.links.new(scre.outputs[0], emis.inputs[0])
+                                tree.links.new(height_socket, emis.inputs[0])
 
                 elif textype.type == "RGBA":
                     type_name = gettexturelabel(textype.RGBA)
@@ -2004,7 +2297,10 @@ class ExportTextures(Operator):
                     set_default(colorfix, 2, (1.0,1.0,1.0,1.0))
                     alphasocket.default_value = 1.0
                     alphabake = True
-                image_name = generate_filename(textype.save_name, context, obj_name, mtlname, file_name, set_name)
+                if tile_size:
+                    self.export_tiled(bake_scene, camera, file_path, tile_size, colorfix, alphasocket, alphafrom if alphabake else None)
+                    written.append(file_path)
+                    continue
                 albake_image = None
                 if alphabake and alphafrom:
                     saved_links = get_links(colorfix, 1)
@@ -2015,22 +2311,46 @@ class ExportTextures(Operator):
                     clear_socket_links(alphasocket.node, 0)
                 bake_image = bpy.data.images.new(image_name, part.texture_sizeX, part.texture_sizeY, alpha=True)
                 render_image(bake_scene, bake_image, alpha_bake = albake_image)    
-                file_path = os.path.join(directory, bake_image.name + ".png")
-                bake_image.filepath_raw = os.path.join(directory, basescene.other_props.currentprefix + bake_image.name + ".png")
-                
-                bake_image.save()
+                if writer:
+                    writer.submit_image(file_path, bake_image)
+                else:
+                    bake_image.filepath_raw = file_path
+                    with profile_section("image save"):
+                        bake_image.save()
+                    written.append(file_path)
 
                 bpy.data.images.remove(bake_image)
                 if albake_image:
                     bpy.data.images.remove(albake_image)
 
-        #cleanup_bake_scene( bake_scene, material, plane)
+        cleanup_bake_scene( bake_scene, material, plane)
 
-        bpy.context.window.scene = basescene
+        set_active_scene(basescene)
+        self.report({'INFO'}, bake_context_report())
+
+        errors = []
+        if writer:
+            # Tiled maps are streamed straight to disk and already listed.
+            pooled, errors = writer.finish()
+            written += pooled
+        last_export["written"] = written
+        last_export["errors"] = [f"{filepath}: {error}" for filepath, error in errors]
+        if manifest is not None:
+            for file_path in written:
+                record_export(manifest, file_path, fingerprints[file_path])
+            save_export_manifest(directory, manifest)
+        if errors:
+            for filepath, error in errors:
+                print(f"HAS export failed for {filepath}: {error}")
+            self.report({'ERROR'}, f"Failed to write {len(errors)} of {len(written) + len(errors)} textures: {errors[0][0]}: {errors[0][1]}")
+            return {'CANCELLED'}
+        if writer:
+            self.report({'INFO'}, writer.report())
 
-        for area in context.screen.areas:
-            if area.type == 'FILE_BROWSER':
-                area.tag_redraw()
+        if context.screen:
+            for area in context.screen.areas:
+                if area.type == 'FILE_BROWSER':
+                    area.tag_redraw()
         
         return {'FINISHED'}
     
@@ -2038,6 +2358,546 @@ class ExportTextures(Operator):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
 
+    def export_tiled(self, bake_scene, camera, file_path, tile_size, colorfix, alphasocket, alphafrom = None):
+        # Renders the plane tile by tile with the ortho camera shifted over it
+        # and streams every finished row of tiles into the PNG, so only one
+        # strip is held in memory whatever the texture size.
+        tree = colorfix.id_data
+        render = bake_scene.render
+        cam = camera.data
+        width, height = render.resolution_x, render.resolution_y
+        pixel = cam.ortho_scale / max(width, height)
+        saved = (cam.ortho_scale, cam.shift_x, cam.shift_y)
+        tile_image = bpy.data.images.new(".HAS_Tile", tile_size, tile_size, alpha=True)
+        alpha_image = bpy.data.images.new(".HAS_TileAlpha", tile_size, tile_size, alpha=True) if alphafrom else None
+        png = PngStreamWriter(file_path, width, height)
+        try:
+            for top in range(0, height, tile_size):
+                strip_height = min(tile_size, height - top)
+                bottom = height - top - strip_height
+                strip = np.empty((strip_height, width, 4), dtype=np.uint8)
+                for left in range(0, width, tile_size):
+                    tile_width = min(tile_size, width - left)
+                    span = max(tile_width, strip_height)
+                    render.resolution_x = tile_width
+                    render.resolution_y = strip_height
+                    cam.ortho_scale = pixel * span
+                    cam.shift_x = (left + tile_width / 2 - width / 2) / span
+                    cam.shift_y = (bottom + strip_height / 2 - height / 2) / span
+                    if alpha_image:
+                        saved_links = get_links(colorfix, 1)
+                        tree.links.new(alphafrom, colorfix.inputs[1])
+                        render_image(bake_scene, alpha_image)
+                        set_links(saved_links, colorfix.inputs[1])
+                        clear_socket_links(alphasocket.node, 0)
+                    render_image(bake_scene, tile_image, alpha_bake = alpha_image)
+                    pixels = read_pixels(tile_image, key = "tile").reshape((strip_height, tile_width, 4))
+                    strip[:, left:left + tile_width] = quantize_pixels(pixels)
+                png.write_rows(strip)
+            png.close()
+        finally:
+            png.abort()
+            render.resolution_x, render.resolution_y = width, height
+            cam.ortho_scale, cam.shift_x, cam.shift_y = saved
+            bpy.data.images.remove(tile_image)
+            if alpha_image:
+                bpy.data.images.remove(alpha_image)
+
+    def export_single_pass(self, bake_scene, material, has_mtl, part, otps, todo, writer = None):
+        # Every channel is written to its own AOV so the plane is rendered
+        # once, then the passes are packed into the requested maps.
+        tree = material.node_tree
+        sources = {}
+        unresolved = []
+
+        def add_source(label, normal_chain = False):
+            if not label:
+                return None
+            if normal_chain:
+                key = "has_NormalExport"
+                if key not in sources:
+                    normal_socket, height_socket = export_normal_socket(tree, has_mtl, part, otps)
+                    sources[key] = height_socket if height_socket else normal_socket
+                return key
+            if label not in has_mtl.outputs:
+                unresolved.append(label)
+                return None
+            key = "has_" + re.sub(r'[^A-Za-z0-9]', '', label)
+            sources.setdefault(key, has_mtl.outputs[label])
+            return key
+
+        plans = []
+        missing = []
+        for textype, image_name, file_path in todo:
+            plan = {}
+            unresolved.clear()
+            if textype.type == "RGB":
+                type_name = gettexturelabel(textype.RGB)
+                plan["rgb"] = add_source(type_name, normal_chain = type_name == 'Normal')
+            elif textype.type == "RGBA":
+                type_name = gettexturelabel(textype.RGBA)
+                plan["rgb"] = add_source(type_name)
+                plan["alpha"] = add_source(f'{type_name}Alpha')
+            elif textype.type == "RGB_A":
+                plan["rgb"] = add_source(gettexturelabel(textype.RGB))
+                plan["mask"] = add_source(gettexturelabel(textype.A))
+            elif textype.type == "R_G_B_A":
+                plan["r"] = add_source(gettexturelabel(textype.R))
+                plan["g"] = add_source(gettexturelabel(textype.G))
+                plan["b"] = add_source(gettexturelabel(textype.B))
+                plan["mask"] = add_source(gettexturelabel(textype.A))
+            elif textype.type == "R":
+                plan["gray"] = add_source(gettexturelabel(textype.R))
+            if unresolved:
+                # Packed as black; the caller warns about them.
+                missing.append((image_name, list(unresolved)))
+            plans.append((file_path, plan))
+
+        if not sources:
+            return [], 0, missing
+
+        material.blend_method = 'OPAQUE'
+        view_layer = bake_scene.view_layers[0]
+        for key, socket in sources.items():
+            aov = view_layer.aovs.add()
+            aov.name = key
+            aov.type = 'COLOR'
+            aov_node = tree.nodes.new('ShaderNodeOutputAOV')
+            if is_4_0_or_newer:
+                aov_node.aov_name = key
+            else:
+                aov_node.name = key
+            tree.links.new(socket, aov_node.inputs['Color'])
+
+        pass_dir = tempfile.mkdtemp(prefix="has_export_")
+        bake_scene.use_nodes = True
+        bake_scene.render.use_compositing = True
+        comp_tree = bake_scene.node_tree
+        comp_tree.nodes.clear()
+        render_layers = comp_tree.nodes.new('CompositorNodeRLayers')
+        file_output = comp_tree.nodes.new('CompositorNodeOutputFile')
+        file_output.base_path = pass_dir
+        file_output.format.file_format = 'OPEN_EXR'
+        file_output.format.color_depth = '32'
+        file_output.file_slots.clear()
+        for key in sources:
+            file_output.file_slots.new(f"{key}_")
+            comp_tree.links.new(render_layers.outputs[key], file_output.inputs[-1])
+
+        set_active_scene(bake_scene)
+        bpy.ops.render.render(scene=bake_scene.name)
+
+        passes = {}
+        loaded = []
+        written = []
+        exported = 0
+        try:
+            for key in sources:
+                pass_path = os.path.join(pass_dir, f"{key}_{bake_scene.frame_current:04d}.exr")
+                pass_image = bpy.data.images.load(pass_path)
+                loaded.append(pass_image)
+                width, height = pass_image.size
+                passes[key] = read_pixels(pass_image, key = f"pass_{key}").reshape((height, width, pass_image.channels))
+
+            for file_path, plan in plans:
+                out = pixel_buffer(width * height * 4, key = "pack").reshape((height, width, 4))
+                pack_export_channels(plan, passes, out)
+                if writer:
+                    writer.submit_pixels(file_path, out)
+                else:
+                    bake_image = bpy.data.images.new(os.path.basename(file_path), width, height, alpha=True)
+                    write_pixels(bake_image, out)
+                    bake_image.filepath_raw = file_path
+                    with profile_section("image save"):
+                        bake_image.save()
+                    bpy.data.images.remove(bake_image)
+                    written.append(file_path)
+                exported += 1
+        finally:
+            for pass_image in loaded:
+                bpy.data.images.remove(pass_image)
+            shutil.rmtree(pass_dir, ignore_errors=True)
+
+        return written, exported, missing
+
+EXPORT_MANIFEST_NAME = ".has_export_manifest.json"
+EXPORT_MANIFEST_VERSION = 1
+def load_export_manifest(directory):
+    try:
+        with open(os.path.join(directory, EXPORT_MANIFEST_NAME), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("version") == EXPORT_MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": EXPORT_MANIFEST_VERSION, "outputs": {}}
+
+def save_export_manifest(directory, manifest):
+    try:
+        with open(os.path.join(directory, EXPORT_MANIFEST_NAME), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+    except OSError as e:
+        print(f"HAS could not write export manifest: {e}")
+
+def export_is_current(manifest, file_path, fingerprint):
+    entry = manifest["outputs"].get(os.path.basename(file_path))
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns
+
+def record_export(manifest, file_path, fingerprint):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return
+    manifest["outputs"][os.path.basename(file_path)] = {"fingerprint": fingerprint, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+def image_fingerprint(image, cache):
+    if image is None:
+        return "none"
+    if image.name in cache:
+        return cache[image.name]
+    settings = f"{image.size[0]}x{image.size[1]}:{image.channels}:{image.colorspace_settings.name}:{image.alpha_mode}"
+    path = bpy.path.abspath(image.filepath) if image.filepath else ""
+    if not image.is_dirty and not image.packed_file and path and os.path.exists(path):
+        stat = os.stat(path)
+        result = f"file:{path}:{stat.st_mtime_ns}:{stat.st_size}:{settings}"
+    else:
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(read_pixels(image, key = "fingerprint"))
+        result = f"data:{hasher.hexdigest()}:{settings}"
+    cache[image.name] = result
+    return result
+
+def hash_properties(hasher, item, cache):
+    skip = getattr(item, "fingerprint_skip", ())
+    for prop in item.bl_rna.properties:
+        key = prop.identifier
+        if key == "rna_type" or key in skip:
+            continue
+        value = getattr(item, key)
+        if prop.type == 'POINTER':
+            if prop.fixed_type.identifier in {"SocketReference", "NodeReference"}:
+                continue
+            if isinstance(value, bpy.types.Image):
+                hasher.update(f"{key}={image_fingerprint(value, cache)};".encode())
+            elif isinstance(value, bpy.types.ID):
+                hasher.update(f"{key}={value.name if value else ''};".encode())
+            elif value is not None:
+                hasher.update(f"{key}{{".encode())
+                hash_properties(hasher, value, cache)
+                hasher.update(b"}")
+        elif prop.type == 'COLLECTION':
+            if key == "sub_layers":
+                continue
+            hasher.update(f"{key}[".encode())
+            for sub in value:
+                hash_properties(hasher, sub, cache)
+            hasher.update(b"]")
+        elif getattr(prop, "is_array", False):
+            hasher.update(f"{key}={tuple(round(v, 6) if isinstance(v, float) else v for v in value)};".encode())
+        elif isinstance(value, float):
+            hasher.update(f"{key}={round(value, 6)};".encode())
+        else:
+            hasher.update(f"{key}={value};".encode())
+
+def export_channel_types(textype, otps):
+    if textype.type == "RGB":
+        types = {textype.RGB}
+        if textype.RGB == "NORMAL" and otps.height_to_normal:
+            types.add("HEIGHT")
+    elif textype.type == "RGBA":
+        types = {textype.RGBA}
+    elif textype.type == "RGB_A":
+        types = {textype.RGB, textype.A}
+    elif textype.type == "R_G_B_A":
+        types = {textype.R, textype.G, textype.B, textype.A}
+    else:
+        types = {textype.R}
+    return types
+
+def export_fingerprint(part, otps, textype, cache):
+    # Hashes only what feeds this output: the layers of its channel types in
+    # stack order, the material settings the graph reads and the export
+    # settings. UI state and node bookkeeping are ignored.
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"v{EXPORT_MANIFEST_VERSION};".encode())
+    hash_properties(hasher, textype, cache)
+    hasher.update(f"h2n={otps.height_to_normal};ig={otps.invert_green_n};sp={otps.export_single_pass};".encode())
+    for key in ["shader_type", "uvs", "height_intensity", "texture_sizeX", "texture_sizeY", "opacity_mode", "diffusealpha", "InvertG", "texture_filtering", "colorfix"]:
+        hasher.update(f"{key}={getattr(part, key)};".encode())
+    hash_properties(hasher, part.used_maps, cache)
+
+    types = export_channel_types(textype, otps)
+    for layer in get_layers(part.base_layers, part):
+        if not layer:
+            continue
+        if layer.layer_type in {"FOLDER", "PBR"}:
+            sub_layers = [sub for sub in get_layers(layer.sub_layers, part) if sub and sub.texture_type in types]
+            if not sub_layers:
+                continue
+            hasher.update(f"folder:{layer.id}(".encode())
+            hash_properties(hasher, layer, cache)
+            for sub in sub_layers:
+                hasher.update(f"layer:{sub.id}(".encode())
+                hash_properties(hasher, sub, cache)
+                hasher.update(b")")
+            hasher.update(b")")
+        elif layer.texture_type in types:
+            hasher.update(f"layer:{layer.id}(".encode())
+            hash_properties(hasher, layer, cache)
+            hasher.update(b")")
+    return hasher.hexdigest()
+
+def export_normal_socket(tree, has_mtl, part, otps):
+    invnrmnode = create_node(tree,'ShaderNodeGroup', -200,-200, "cus", InvertNormalNode().name) if otps.invert_green_n else None
+
+    gamma = create_node(tree,'ShaderNodeGamma', -200,0, "", '')
+    set_default(gamma,1, 2.4)
+    tree.links.new(has_mtl.outputs[f'RawNormal'], gamma.inputs[0])
+    normal_socket = gamma.outputs[0]
+    if invnrmnode:
+        tree.links.new(gamma.outputs[0], invnrmnode.inputs['Normal'])
+        normal_socket = invnrmnode.outputs['Normal']
+    if not otps.height_to_normal:
+        return normal_socket, None
+
+    subt = create_node(tree,'ShaderNodeMixRGB', -600,0, "mix", "SUBTRACT")
+    set_default(subt, 0, 1.0)
+    bump = create_node(tree,'ShaderNodeBump', -600,0, "", "")
+    set_default(bump, 0, part.height_intensity)
+    nrmnd = create_node(tree,'ShaderNodeNormalMap', -600,0, "", "")
+
+    scre = create_node(tree,'ShaderNodeMixRGB', -600,0, "mix", "SCREEN")
+    set_default(scre, 0, 1.0)
+
+    tree.links.new(has_mtl.outputs["Height"], bump.inputs[2])
+    tree.links.new(bump.outputs[0], subt.inputs[1])
+    tree.links.new(nrmnd.outputs[0], subt.inputs[2])
+    tree.links.new(subt.outputs[0], scre.inputs[1])
+    tree.links.new(normal_socket, scre.inputs[2])
+    return normal_socket, scre.outputs[0]
+
+def pack_export_channels(plan, passes, out):
+    # Mirrors the per-map render path: colour is divided by its alpha like the
+    # colorfix node, and everything but coverage alpha is sRGB encoded.
+    out[...] = 0.0
+    out[..., 3] = 1.0
+    if plan.get("rgb"):
+        rgb = passes[plan["rgb"]][..., :3]
+        if plan.get("alpha"):
+            alpha = passes[plan["alpha"]][..., 0]
+            rgb = np.divide(rgb, alpha[..., None], out=rgb.copy(), where=alpha[..., None] != 0)
+            out[..., 3] = alpha
+        out[..., :3] = linear_to_srgb(rgb)
+    for index, channel in enumerate(("r", "g", "b")):
+        if plan.get(channel):
+            out[..., index] = linear_to_srgb(pixel_luma(passes[plan[channel]]))
+    if plan.get("gray"):
+        out[..., :3] = linear_to_srgb(pixel_luma(passes[plan["gray"]]))[..., None]
+    if plan.get("mask"):
+        out[..., 3] = linear_to_srgb(pixel_luma(passes[plan["mask"]]))
+
+# Headless export.
+#
+# Inside a background session:
+#   blender -b asset.blend --python-expr "import HASPaintLayers as has; has.run_cli()" -- --output D:/out --sets Body Head --preset PBR
+# Fan a list of files out across background processes:
+#   blender -b --python-expr "import HASPaintLayers as has; has.run_cli()" -- --output D:/out --blend-files a.blend b.blend --processes 4 --summary D:/out/summary.json
+# The same is available as export_material_sets() and batch_export().
+
+last_export = {"written": [], "skipped": [], "errors": []}
+
+def resolve_preset(preset):
+    if not preset:
+        return ""
+    if os.path.isfile(preset):
+        return preset
+    path = os.path.join(preset_folder, preset if preset.endswith(".py") else preset + ".py")
+    if os.path.isfile(path):
+        return path
+    raise FileNotFoundError(f"HAS export preset not found: {preset}")
+
+def export_material_sets(directory, material_sets = None, preset = "", prefix = ""):
+    scene = bpy.context.scene
+    os.makedirs(directory, exist_ok=True)
+    preset_path = resolve_preset(preset)
+    if preset_path:
+        bpy.ops.haspaint.execute_preset_has(filepath=preset_path)
+    if not material_sets:
+        material_sets = [prop.name for prop in scene.material_props if prop.layers]
+
+    results = []
+    for name in material_sets:
+        start = time.perf_counter()
+        result = {"set": name, "written": [], "skipped": [], "errors": []}
+        if not find_material_collection(scene, name):
+            result["errors"].append("material set not found")
+        else:
+            try:
+                bpy.ops.haspaint.export_textures(filepath=os.path.join(directory, prefix), material_set=name)
+                result.update(last_export)
+            except Exception as e:
+                result["errors"].append(repr(e))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        results.append(result)
+    return {
+        "file": bpy.data.filepath,
+        "output": directory,
+        "preset": preset,
+        "sets": results,
+        "ok": not any(result["errors"] for result in results),
+    }
+
+def batch_export(blend_files, directory, material_sets = None, preset = "", prefix = "", processes = 0, blender = "", summary_path = ""):
+    # Every file is exported by its own background Blender into a sub folder
+    # named after it; at most `processes` run at the same time.
+    blender = blender or bpy.app.binary_path
+    processes = processes or max(1, (os.cpu_count() or 2) // 2)
+    job_dir = tempfile.mkdtemp(prefix="has_batch_")
+    expr = f"import addon_utils, importlib; addon_utils.enable({__name__!r}, default_set=False); importlib.import_module({__name__!r}).run_cli()"
+
+    def run(job):
+        index, blend_file = job
+        output = os.path.join(directory, Path(blend_file).stem)
+        job_summary = os.path.join(job_dir, f"{index}.json")
+        command = [blender, "-b", blend_file, "--python-exit-code", "1", "--python-expr", expr, "--",
+                   "--output", output, "--summary", job_summary, "--prefix", prefix]
+        if material_sets:
+            command += ["--sets", *material_sets]
+        if preset:
+            command += ["--preset", preset]
+        start = time.perf_counter()
+        process = subprocess.run(command, capture_output=True, text=True)
+        result = {"file": blend_file, "output": output, "sets": [], "ok": False}
+        try:
+            with open(job_summary, "r", encoding="utf-8") as file:
+                result.update(json.load(file))
+        except (OSError, ValueError):
+            pass
+        result["returncode"] = process.returncode
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        if process.returncode != 0:
+            result["ok"] = False
+            result["log"] = (process.stdout + process.stderr)[-4000:]
+        return result
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=processes) as pool:
+            files = list(pool.map(run, enumerate(blend_files)))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    summary = {
+        "output": directory,
+        "processes": processes,
+        "seconds": round(time.perf_counter() - start, 3),
+        "files": files,
+        "written": sum(len(result["written"]) for job in files for result in job["sets"]),
+        "skipped": sum(len(result["skipped"]) for job in files for result in job["sets"]),
+        "failed": [job["file"] for job in files if not job["ok"]],
+    }
+    if summary_path:
+        write_summary(summary_path, summary)
+    return summary
+
+def write_summary(path, summary):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+
+def run_cli(argv = None):
+    import argparse
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="HASPaintLayers export", description="Export HAS Paint Layers material sets without the UI.")
+    parser.add_argument("--output", required=True, help="Directory the textures are written to")
+    parser.add_argument("--sets", nargs="*", default=None, help="Material set or material names, all sets when omitted")
+    parser.add_argument("--preset", default="", help="Export preset name or path to a preset file")
+    parser.add_argument("--prefix", default="", help="Prefix added to every file name")
+    parser.add_argument("--blend-files", nargs="*", default=None, help="Export these files in separate background processes")
+    parser.add_argument("--processes", type=int, default=0, help="Number of parallel processes for --blend-files, 0 for auto")
+    parser.add_argument("--blender", default="", help="Blender executable for --blend-files")
+    parser.add_argument("--summary", default="", help="Write a JSON summary to this path")
+    args = parser.parse_args(argv)
+
+    if args.blend_files:
+        summary = batch_export(args.blend_files, args.output, args.sets, args.preset, args.prefix, args.processes, args.blender, args.summary)
+        ok = not summary["failed"]
+    else:
+        summary = export_material_sets(args.output, args.sets, args.preset, args.prefix)
+        if args.summary:
+            write_summary(args.summary, summary)
+        ok = summary["ok"]
+    print(json.dumps(summary, indent=2))
+    if not ok:
+        sys.exit(1)
+    return summary
+
+class CompareCompiledShader(Operator):
+    bl_idname = "haspaint.compare_compiled_shader"
+    bl_label = "Compare Compiled Shader"
+    bl_description = "Render every used channel with the layered and the compiled material group and compare shader compile time and node count"
+
+    def timed_render(self, scene):
+        start = time.perf_counter()
+        bpy.ops.render.render(scene=scene.name)
+        return time.perf_counter() - start
+
+    def execute(self, context):
+        flush_updates()
+        part = get_material_collection()
+        if not part or not part.material:
+            self.report({'ERROR'}, "No material set selected.")
+            return {'CANCELLED'}
+        layered = bpy.data.node_groups.get(getmaterialgroupname(part)) or hasmatnode()
+        compiled = compile_material_group(part, layered)
+        stats = dict(compile_stats)
+
+        basescene = active_scene()
+        bake_scene, material, plane, output_node, colorfix, alphasocket, camera = setup_bake_scene(basescene, part)
+        bake_scene.render.resolution_x = 128
+        bake_scene.render.resolution_y = 128
+        tree = material.node_tree
+        channels = [type[1] for type in getusedmaps() if type[1]]
+        compile_report.clear()
+        try:
+            for label, node_group in (("layered", layered), ("compiled", compiled)):
+                group_node = tree.nodes.new('ShaderNodeGroup')
+                group_node.node_tree = node_group
+                compile_time = 0.0
+                render_time = 0.0
+                for channel in channels:
+                    if channel not in group_node.outputs:
+                        continue
+                    tree.links.new(group_node.outputs[channel], colorfix.inputs[1])
+                    # The first render after relinking compiles the shader, the
+                    # second one reuses it.
+                    first = self.timed_render(bake_scene)
+                    second = self.timed_render(bake_scene)
+                    compile_time += max(0.0, first - second)
+                    render_time += second
+                tree.nodes.remove(group_node)
+                if label == "layered":
+                    counts = {"nodes": stats["source_nodes"], "samples": stats["source_samples"], "groups": stats["groups"], "depth": stats["depth"]}
+                else:
+                    counts = {"nodes": stats["nodes"], "samples": stats["samples"], "groups": 1, "depth": 0}
+                compile_report[label] = dict(counts, compile = compile_time, render = render_time)
+        finally:
+            set_active_scene(basescene)
+
+        layered, compiled = compile_report["layered"], compile_report["compiled"]
+        self.report({'INFO'}, f"Layered: {layered['nodes']} nodes, {layered['samples']} textures in {layered['groups']} groups, {layered['compile']*1000:.0f} ms compile. "
+                              f"Compiled: {compiled['nodes']} nodes, {compiled['samples']} textures, {compiled['compile']*1000:.0f} ms compile, "
+                              f"{stats['folded']} folded, {stats['shared']} shared")
+        return {'FINISHED'}
+
 class CollapseLayer(Operator):
     bl_idname = "haspaint.collapse_layer"
     bl_label = "Collapse layer"
@@ -2166,6 +3026,10 @@ class CombineAllLayersOperator(Operator):
         layout.label(text="Warning: This operation cannot be undone.", icon='ERROR')
 
     def execute(self, context):
+        with paint_focus_suspended():
+            return self.combine(context)
+
+    def combine(self, context):
         bsmtl = hasmatnode()
         usdtypes = getusedtypes()
         basescene = bpy.context.window.scene
@@ -2282,6 +3146,7 @@ def BakeLayerToImage(self,context, layer):
 
     return bake_image
 
+@profiled("bake_layer")
 def bake_layer(context, layer, basescene, bake_image):
 
     FoundLayer = layer
@@ -2305,79 +3170,167 @@ def bake_layer(context, layer, basescene, bake_image):
     else:
         return False, None
 
-def setup_bake_scene(basescene):
-    part = get_material_collection()
+BAKE_SCENE_NAME = ".HAS_BakeScene"
+BAKE_MATERIAL_NAME = ".HAS_BakeMtl"
+BAKE_PLANE_NAME = ".HAS_BakePlane"
+BAKE_CAMERA_NAME = ".HAS_BakeCamera"
+BAKE_TEXT_NAME = ".HAS_BakeNote"
 
-    new_scene = bpy.data.scenes.new("BakeScene")
-    bpy.context.window.scene = new_scene
-    material = bpy.data.materials.new(name="HASBakeMtlTemp")
+bake_context_stats = {"builds": 0, "reuses": 0, "build_time": 0.0, "last_reset": 0.0, "saved": 0.0}
 
-    new_scene.render.resolution_y = part.texture_sizeX
-    new_scene.render.resolution_x = part.texture_sizeY
+def get_bake_context():
+    scene = bpy.data.scenes.get(BAKE_SCENE_NAME)
+    material = bpy.data.materials.get(BAKE_MATERIAL_NAME)
+    plane = bpy.data.objects.get(BAKE_PLANE_NAME)
+    camera = bpy.data.objects.get(BAKE_CAMERA_NAME)
+    if not scene or not material or not plane or not camera:
+        return None
+    if not material.node_tree:
+        return None
+    tree = material.node_tree
+    for name in ["fs_Output", "fs_MixShader", "fs_ColorFix", "fs_Transparent", "fs_Emission"]:
+        if not tree.nodes.get(name):
+            return None
+    if plane.name not in scene.collection.objects or camera.name not in scene.collection.objects:
+        return None
+    return scene, material, plane, camera
 
-    if material.use_nodes is False:
-        material.use_nodes = True
+def build_bake_context():
+    release_bake_context()
 
-    tree = material.node_tree
+    scene = bpy.data.scenes.new(BAKE_SCENE_NAME)
+    material = bpy.data.materials.new(name=BAKE_MATERIAL_NAME)
+    material.use_nodes = True
     material.blend_method = 'BLEND'
-    new_scene.render.film_transparent = True
-    new_scene.view_layers["ViewLayer"].use_pass_combined = False
-    new_scene.view_layers["ViewLayer"].use_pass_emit = True
-    new_scene.view_settings.view_transform = 'Standard'
-    new_scene.render.image_settings.color_mode = 'RGBA'
-    new_scene.render.image_settings.color_depth = '16'
-    new_scene.render.image_settings.compression = 0
-    
-    new_scene.render.engine = 'BLENDER_EEVEE_NEXT' if is_4_2_or_newer else 'BLENDER_EEVEE'
-    new_scene.render.dither_intensity = 0
-    new_scene.render.filter_size = 0
 
-    for node in tree.nodes:
-        if node.type == 'OUTPUT_MATERIAL':
-            output_node = node
-        else:
-            tree.nodes.remove(node)
+    scene.render.film_transparent = True
+    scene.view_layers[0].use_pass_combined = False
+    scene.view_layers[0].use_pass_emit = True
+    scene.view_settings.view_transform = 'Standard'
+    scene.render.image_settings.color_mode = 'RGBA'
+    scene.render.image_settings.color_depth = '16'
+    scene.render.image_settings.compression = 0
 
-    if 'output_node' not in locals():
-        output_node = tree.nodes.new('ShaderNodeOutputMaterial')
-        output_node.location = (200, 0)
+    scene.render.engine = 'BLENDER_EEVEE_NEXT' if is_4_2_or_newer else 'BLENDER_EEVEE'
+    scene.render.dither_intensity = 0
+    scene.render.filter_size = 0
 
+    tree = material.node_tree
+    tree.nodes.clear()
+    output_node = tree.nodes.new('ShaderNodeOutputMaterial')
+    output_node.location = (400, 0)
+    output_node.name = "fs_Output"
     MixShader = tree.nodes.new('ShaderNodeMixShader')
     MixShader.location = (200, 0)
+    MixShader.name = "fs_MixShader"
     MixRGB = create_node(tree,'ShaderNodeMixRGB', -200,0, "mix", 'DIVIDE')
-
-    set_default(MixRGB, 0, 1.0)
+    MixRGB.name = "fs_ColorFix"
     Transparent = tree.nodes.new('ShaderNodeBsdfTransparent')
-    Transparent.location = (200, 0)
+    Transparent.location = (0, 100)
+    Transparent.name = "fs_Transparent"
     Emission = tree.nodes.new('ShaderNodeEmission')
-    Emission.location = (200, 0)
+    Emission.location = (0, -100)
+    Emission.name = "fs_Emission"
+
+    note = bpy.data.curves.new(BAKE_TEXT_NAME, type='FONT')
+    note.body = "Scene for offscreen operations. Just delete this scene if you stuck here"
+    note_obj = bpy.data.objects.new(BAKE_TEXT_NAME, note)
+    note_obj.hide_render = True
+    scene.collection.objects.link(note_obj)
+
+    cam_data = bpy.data.cameras.new(BAKE_CAMERA_NAME)
+    cam_data.type = 'ORTHO'
+    cam_data.ortho_scale = 2
+    camera = bpy.data.objects.new(BAKE_CAMERA_NAME, cam_data)
+    camera.location = (0, 0, 2)
+    scene.collection.objects.link(camera)
+    scene.camera = camera
+
+    mesh = bpy.data.meshes.new(BAKE_PLANE_NAME)
+    mesh.from_pydata([(-1.0, -1.0, 0.0), (1.0, -1.0, 0.0), (1.0, 1.0, 0.0), (-1.0, 1.0, 0.0)], [], [(0, 1, 2, 3)])
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", (0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 1.0))
+    mesh.materials.append(material)
+    plane = bpy.data.objects.new(BAKE_PLANE_NAME, mesh)
+    scene.collection.objects.link(plane)
+
+    return scene, material, plane, camera
+
+def reset_bake_context(scene, material, plane, camera, part = None):
+    part = part or get_material_collection()
+    tree = material.node_tree
+
+    clear_nodes_ignoring(tree)
+
+    output_node = tree.nodes["fs_Output"]
+    MixShader = tree.nodes["fs_MixShader"]
+    MixRGB = tree.nodes["fs_ColorFix"]
+    Transparent = tree.nodes["fs_Transparent"]
+    Emission = tree.nodes["fs_Emission"]
+
+    for node in (MixRGB, MixShader, Emission):
+        clear_node_socket_connections(node)
+    MixRGB.blend_type = 'DIVIDE'
+    set_default(MixRGB, 0, 1.0)
+    set_default(MixRGB, 2, (1.0,1.0,1.0,1.0))
+    MixShader.inputs[0].default_value = 1.0
 
     tree.links.new(MixRGB.outputs[0], Emission.inputs[0])
     tree.links.new(Transparent.outputs[0], MixShader.inputs[1])
     tree.links.new(Emission.outputs[0], MixShader.inputs[2])
     tree.links.new(MixShader.outputs[0], output_node.inputs[0])
 
-    sftext = bpy.ops.object.text_add(enter_editmode=False, align='WORLD', location=(0, 0, 0), scale=(1, 1, 1))
-    sftext = bpy.context.object
-    sftext.data.body = "Scene for offscreen operations. Just delete this scene if you stuck here"
-    sftext.hide_render = True
-
-    bpy.ops.object.camera_add(location=(0, 0, 2), rotation=(0, 0, 0))
-    camera = bpy.context.object
-    camera.data.type = 'ORTHO'
-    camera.data.ortho_scale = 2  
-    camera.location = (0, 0, 2)
-
-    new_scene.camera = camera
-    bpy.ops.mesh.primitive_plane_add(size=2)
-    plane = bpy.context.active_object
-    plane.name = "BakePlane"
-    plane.data.materials.append(material)
+    material.blend_method = 'BLEND'
+    view_layer = scene.view_layers[0]
+    for aov in list(view_layer.aovs):
+        view_layer.aovs.remove(aov)
+
+    uv_layers = plane.data.uv_layers
+    while len(uv_layers) > 1:
+        uv_layers.remove(uv_layers[-1])
+
+    scene.render.resolution_y = part.texture_sizeX
+    scene.render.resolution_x = part.texture_sizeY
+    scene.render.resolution_percentage = 100
+    scene.camera = camera
+    camera.data.ortho_scale = 2
+    camera.data.shift_x = 0.0
+    camera.data.shift_y = 0.0
 
     plane.scale.y = part.texture_sizeX / max(part.texture_sizeX, part.texture_sizeY)
     plane.scale.x = part.texture_sizeY / max(part.texture_sizeX, part.texture_sizeY)
 
-    return new_scene, material, plane, output_node, MixRGB, MixShader.inputs[0], camera
+    return output_node, MixRGB, MixShader.inputs[0]
+
+@profiled("setup_bake_scene")
+def setup_bake_scene(basescene, part = None):
+    flush_updates()
+    start = time.perf_counter()
+    bake_context = get_bake_context()
+    rebuilt = bake_context is None
+    if rebuilt:
+        bake_context = build_bake_context()
+    scene, material, plane, camera = bake_context
+
+    output_node, colorfix, alphasocket = reset_bake_context(scene, material, plane, camera, part)
+    set_active_scene(scene)
+
+    elapsed = time.perf_counter() - start
+    if rebuilt:
+        bake_context_stats["builds"] += 1
+        bake_context_stats["build_time"] = elapsed
+    else:
+        bake_context_stats["reuses"] += 1
+        bake_context_stats["last_reset"] = elapsed
+        bake_context_stats["saved"] += max(0.0, bake_context_stats["build_time"] - elapsed)
+
+    return scene, material, plane, output_node, colorfix, alphasocket, camera
+
+def bake_context_report():
+    stats = bake_context_stats
+    return (f"Bake scene: built {stats['builds']}x ({stats['build_time']*1000:.1f} ms), "
+            f"reused {stats['reuses']}x (last reset {stats['last_reset']*1000:.1f} ms, "
+            f"saved ~{stats['saved']*1000:.0f} ms total)")
 
 def Add_layer(mat, output_node, layer):
 
@@ -2403,9 +3356,10 @@ def create_bake_image(texture_sizeX,texture_sizeY, layer, suffix=""):
 
     return bake_image
 
-def render_image(scene, bake_image, filter = "", filter_value = 0.0, alpha_bake = None):
+@profiled("render_image")
+def render_image(scene, bake_image, filter = "", filter_value = 0.0, alpha_bake = None, linear = False):
     
-    bpy.context.window.scene = scene
+    set_active_scene(scene)
     
     scene.use_nodes = True
     tree = scene.node_tree
@@ -2446,10 +3400,14 @@ def render_image(scene, bake_image, filter = "", filter_value = 0.0, alpha_bake
 
     viewer_node = tree.nodes.new(type='CompositorNodeViewer')
     viewer_node.location = (400, -200)
-    links = bpy.context.scene.node_tree.links
+    links = tree.links
     
     links.new(render_layers.outputs[0], alpha_convert.inputs[0])
-    links.new(alpha_convert.outputs[0], colorspace.inputs[0])
+    if linear:
+        # Float data images take the render values as they are.
+        colorspace = alpha_convert
+    else:
+        links.new(alpha_convert.outputs[0], colorspace.inputs[0])
     if alpha_bake:
         links.new(colorspace.outputs[0], viewer_node.inputs[0])
         links.new(alphaimage.outputs[0], viewer_node.inputs[1])
@@ -2460,18 +3418,47 @@ def render_image(scene, bake_image, filter = "", filter_value = 0.0, alpha_bake
         links.new(colorspace.outputs[0], filternode.inputs['Image'])
         links.new(filternode.outputs['Image'], viewer_node.inputs[0])
 
-    bpy.ops.render.render()
+    bpy.ops.render.render(scene=scene.name)
 
     render_result = bpy.data.images.get("Viewer Node")
     if render_result:
         bake_image.scale(render_result.size[0], render_result.size[1])
-        
-        bake_image.pixels = list(render_result.pixels)
+
+        write_pixels(bake_image, read_pixels(render_result, key = "render"))
 
 def cleanup_bake_scene( new_scene, mat, plane):
-    bpy.data.materials.remove(mat)
-    bpy.data.objects.remove(plane)
-    bpy.data.scenes.remove(new_scene)
+    # The bake scene is kept for the next job; only drop the job's nodes so
+    # layer groups are not held by the bake material.
+    if get_bake_context():
+        clear_nodes_ignoring(mat.node_tree)
+
+def release_bake_context():
+    scene = bpy.data.scenes.get(BAKE_SCENE_NAME)
+    if scene:
+        # A failed bake can leave the window on the bake scene; step off it so
+        # the stale scene is removed instead of the rebuild getting a ".001".
+        if active_scene() == scene:
+            fallback = next((other for other in bpy.data.scenes if other != scene), None)
+            if not fallback:
+                return
+            set_active_scene(fallback)
+        bpy.data.scenes.remove(scene)
+    for name in [BAKE_PLANE_NAME, BAKE_CAMERA_NAME, BAKE_TEXT_NAME]:
+        obj = bpy.data.objects.get(name)
+        if obj:
+            bpy.data.objects.remove(obj)
+    mesh = bpy.data.meshes.get(BAKE_PLANE_NAME)
+    if mesh:
+        bpy.data.meshes.remove(mesh)
+    cam = bpy.data.cameras.get(BAKE_CAMERA_NAME)
+    if cam:
+        bpy.data.cameras.remove(cam)
+    note = bpy.data.curves.get(BAKE_TEXT_NAME)
+    if note:
+        bpy.data.curves.remove(note)
+    material = bpy.data.materials.get(BAKE_MATERIAL_NAME)
+    if material:
+        bpy.data.materials.remove(material)
 
 class ResizeTexturePopup(Operator):
     """Resize the selected texture"""
@@ -2566,7 +3553,7 @@ class BAKING_OT_BakeTextures(Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        
+        flush_updates()
         original_scene = context.scene
         low_poly = bpy.context.active_object
         high_poly = None
@@ -2580,24 +3567,40 @@ class BAKING_OT_BakeTextures(Operator):
             baking_scene = bpy.data.scenes["Baking_Scene"]
         sel=[]
         baking_props = part.baking_props
+        hp_objects = baking_props.gethpobjects(context)
+        lp_objects = baking_props.getlpobjects(context) or [low_poly]
+        use_cache = baking_props.cache_geometry
+        preview = baking_props.preview_bake
+        if preview:
+            cancel_preview_refine()
+            refine_key = bake_settings_key(part, hp_objects + lp_objects)
+        if use_cache:
+            # Evaluated meshes are read from the scene the sources live in.
+            hp_key = bake_geometry_key(hp_objects) if hp_objects else None
+            lp_key = bake_geometry_key(lp_objects)
         bpy.context.window.scene = baking_scene
         if baking_props.use_cage and baking_props.cage:
             bpy.context.scene.render.bake.cage_object = baking_props.cage
             baking_props.cage.hide_select = False
             baking_props.cage.hide_render = False
-        if baking_props.gethpobjects(context):
-            high_poly = combine_objects(baking_props.gethpobjects(context), apply_modifiers=True)
-            high_poly.name = "HP"
+        if hp_objects:
+            if use_cache:
+                high_poly = get_bake_geometry(part, "HP", hp_objects, hp_key)
+            else:
+                high_poly = combine_objects(hp_objects, apply_modifiers=True)
+                high_poly.name = "HP"
             if high_poly:
                 sel.append(high_poly)
-        if baking_props.getlpobjects(context):
-            low_poly = combine_objects(baking_props.getlpobjects(context), apply_modifiers=True)
+        if use_cache:
+            low_poly = get_bake_geometry(part, "LP", lp_objects, lp_key)
         else:
-            low_poly = combine_objects([low_poly], apply_modifiers=True)
+            low_poly = combine_objects(lp_objects, apply_modifiers=True)
         
         if low_poly:
-            low_poly.name = "LP"
+            if not use_cache:
+                low_poly.name = "LP"
             sel.append(low_poly)
+        cached_materials = {obj: list(obj.data.materials) for obj in sel} if use_cache else {}
 
         if baking_scene.render.bake.cage_object:
             bpy.data.scenes["Baking_Scene"].collection.objects.link(baking_scene.render.bake.cage_object)
@@ -2640,6 +3643,11 @@ class BAKING_OT_BakeTextures(Operator):
             lpmtl = tmp_material
         links = tmp_material.node_tree.links
         gnr = None
+        bake_jobs = ParallelBake(baking_props) if baking_props.parallel_bake and not preview else None
+        if preview:
+            refine = ParallelBake(baking_props)
+            preview_size = max(16, baking_props.bake_image_sizeY // baking_props.preview_divider)
+            preview_samples = max(1, baking_props.samples // baking_props.preview_divider)
         
         for bake_map in part.bake_maps:
             defaultbake = False
@@ -2808,18 +3816,41 @@ class BAKING_OT_BakeTextures(Operator):
                     baking_scene.render.bake.use_clear = True
                     baking_scene.cycles.bake_type = 'EMIT'
                     defaultbake = False
-                try:
-                    if not defaultbake:
-                        bpy.ops.object.bake(type='EMIT')
-                    else:
-                        if bake_map.type == "DIFFUSE":
-                            baking_scene.render.bake.use_pass_direct = False
-                            baking_scene.render.bake.use_pass_indirect = False
-                            baking_scene.cycles.bake_type = 'DIFFUSE'
-                        bpy.ops.object.bake(type=bake_map.type, use_clear=True, margin=4, save_mode='INTERNAL')
-                except RuntimeError as e:
-                    self.report({'ERROR'}, f"Bake failed: {e}")
+                if not defaultbake:
+                    bake_args = {"type": 'EMIT'}
+                else:
+                    if bake_map.type == "DIFFUSE":
+                        baking_scene.render.bake.use_pass_direct = False
+                        baking_scene.render.bake.use_pass_indirect = False
+                        baking_scene.cycles.bake_type = 'DIFFUSE'
+                    bake_args = {"type": bake_map.type, "use_clear": True, "margin": 4, "save_mode": 'INTERNAL'}
+                if preview and refine.can_run(baking_scene, bake_map):
+                    # The final bake is queued from the same scene state, then
+                    # the preview is baked small and scaled up for display.
+                    refine.add(baking_scene, bake_map, bake_args)
+                    bake_map.image.scale(preview_size, preview_size)
+                    baking_scene.cycles.samples = preview_samples
+                    try:
+                        bpy.ops.object.bake(**bake_args)
+                    except RuntimeError as e:
+                        self.report({'ERROR'}, f"Bake failed: {e}")
+                    baking_scene.cycles.samples = baking_props.samples
+                    bake_map.image.scale(baking_props.bake_image_sizeY, baking_props.bake_image_sizeY)
+                elif bake_jobs and bake_jobs.can_run(baking_scene, bake_map):
+                    bake_jobs.add(baking_scene, bake_map, bake_args)
+                else:
+                    try:
+                        bpy.ops.object.bake(**bake_args)
+                    except RuntimeError as e:
+                        self.report({'ERROR'}, f"Bake failed: {e}")
                 bpy.ops.object.modifier_remove(modifier="HASTempSubdivision")
+        if bake_jobs:
+            for error in bake_jobs.run():
+                self.report({'ERROR'}, f"Bake failed: {error}")
+        if preview:
+            start_preview_refine(refine, part, hp_objects + lp_objects, refine_key)
+        for obj, materials in cached_materials.items():
+            restore_bake_geometry(obj, materials)
         if tmp_material == lpmtl and tmp_material.users == 0:
             bpy.data.materials.remove(tmp_material)
         else:
@@ -2833,8 +3864,11 @@ class BAKING_OT_BakeTextures(Operator):
         if gnr and gnr.users == 0:
             bpy.data.node_groups.remove(gnr)
             
-        remove_object(high_poly)
-        remove_object(low_poly)
+        if use_cache:
+            self.report({'INFO'}, bake_geometry_report())
+        else:
+            remove_object(high_poly)
+            remove_object(low_poly)
 
         bpy.data.scenes.remove(baking_scene)
         if baking_props.cage:
@@ -2858,7 +3892,7 @@ class BAKING_OT_BakeTextures(Operator):
 
             bpy.data.images[bake_image.name].scale( baking_props.bake_image_sizeY, baking_props.bake_image_sizeY )
 
-            bake_image.pixels = [0.0] * (bake_image.size[0] * bake_image.size[1] * bake_image.channels)
+            fill_pixels(bake_image, 0.0)
             bake_image.pack()
 
         mtl.use_nodes = True
@@ -2923,6 +3957,282 @@ def combine_objects(objects, apply_modifiers=False):
 
     return bpy.context.object
 
+BAKE_WORKER_SCRIPT = """
+import bpy, json, sys
+import numpy as np
+job = json.loads(sys.argv[sys.argv.index("--") + 1])
+if job["device"]:
+    prefs = bpy.context.preferences.addons["cycles"].preferences
+    prefs.compute_device_type = job["device"]["type"]
+    getattr(prefs, "refresh_devices", prefs.get_devices)()
+    for device in prefs.devices:
+        device.use = device.id in job["device"]["devices"]
+view_layer = bpy.context.view_layer
+for obj in view_layer.objects:
+    obj.select_set(obj.name in job["selected"])
+view_layer.objects.active = bpy.data.objects[job["active"]]
+bpy.ops.object.bake(**job["bake"])
+image = bpy.data.images[job["image"]]
+pixels = np.empty(len(image.pixels), dtype=np.float32)
+image.pixels.foreach_get(pixels)
+pixels.tofile(job["output"])
+"""
+
+def cycles_device_settings():
+    # Workers run with --factory-startup, so they only use the GPUs picked
+    # in the user's preferences when these are passed along.
+    addon = bpy.context.preferences.addons.get("cycles")
+    if not addon:
+        return None
+    prefs = addon.preferences
+    return {"type": prefs.compute_device_type, "devices": [device.id for device in prefs.devices if device.use]}
+
+def bake_source_images(scene, target):
+    # Images read by the materials of the objects a bake samples.
+    view_layer = scene.view_layers[0]
+    images = set()
+    for obj in view_layer.objects:
+        if not obj.select_get(view_layer=view_layer):
+            continue
+        for slot in obj.material_slots:
+            if slot.material and slot.material.node_tree:
+                images.update(node.image for node in get_image_nodes_recursive(slot.material.node_tree))
+    images.discard(target)
+    return images
+
+class ParallelBake:
+    # Every map is set up in the bake scene as usual, then the scene is
+    # written to a .blend and baked by a background Blender. Pixels come back
+    # as raw float32 so no colour conversion happens on the way.
+    def __init__(self, baking_props):
+        cores = os.cpu_count() or 4
+        self.workers = baking_props.bake_workers or max(1, cores // 4)
+        self.threads = baking_props.bake_worker_threads or max(1, cores // self.workers)
+        self.job_dir = tempfile.mkdtemp(prefix="has_bake_")
+        self.jobs = []
+        self.futures = []
+        self.processes = []
+        self.cancelled = False
+        self.device = cycles_device_settings()
+
+    def can_run(self, scene, bake_map):
+        # Workers only see saved pixels, so maps reading the painted material
+        # stay local while one of its images has unsaved changes.
+        if bake_map.type in {"DIFFUSE", "EMISSION"}:
+            return not any(image.is_dirty for image in bake_source_images(scene, bake_map.image))
+        return True
+
+    def add(self, scene, bake_map, bake_args):
+        index = len(self.jobs)
+        blend_path = os.path.join(self.job_dir, f"bake_{index}.blend")
+        bpy.data.libraries.write(blend_path, {scene}, path_remap='ABSOLUTE', fake_user=True, compress=False)
+        job = {
+            "selected": [obj.name for obj in scene.view_layers[0].objects if obj.select_get(view_layer=scene.view_layers[0])],
+            "active": scene.view_layers[0].objects.active.name,
+            "bake": bake_args,
+            "image": bake_map.image.name,
+            "output": os.path.join(self.job_dir, f"bake_{index}.raw"),
+            "device": self.device,
+        }
+        self.jobs.append((blend_path, job, bake_map.image))
+
+    def bake(self, entry):
+        blend_path, job, image = entry
+        command = [bpy.app.binary_path, "-b", blend_path, "--factory-startup", "-t", str(self.threads),
+                   "--python-exit-code", "1", "--python-expr", BAKE_WORKER_SCRIPT, "--", json.dumps(job)]
+        if self.cancelled:
+            return "cancelled"
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        self.processes.append(process)
+        if self.cancelled:
+            process.kill()
+        output = process.communicate()[0]
+        if process.returncode != 0 or not os.path.exists(job["output"]):
+            lines = output.strip().splitlines()
+            return f"{image.name}: {lines[-1] if lines else process.returncode}"
+        return None
+
+    def start(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.futures = [self.pool.submit(self.bake, entry) for entry in self.jobs]
+        self.pool.shutdown(wait=False)
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def cancel(self):
+        self.cancelled = True
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+        for future in self.futures:
+            future.cancel()
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+    def run(self):
+        self.start()
+        return self.finish()
+
+    def finish(self):
+        errors = []
+        try:
+            results = [future.result() for future in self.futures]
+            for (blend_path, job, image), error in zip(self.jobs, results):
+                if error:
+                    errors.append(error)
+                    continue
+                pixels = np.fromfile(job["output"], dtype=np.float32)
+                if pixels.size != len(image.pixels):
+                    errors.append(f"{image.name}: size mismatch")
+                    continue
+                write_pixels(image, pixels)
+        finally:
+            shutil.rmtree(self.job_dir, ignore_errors=True)
+        return errors
+
+preview_refine = None
+
+def bake_settings_key(part, objects):
+    # Everything a refined bake depends on; bake images are left out since
+    # the preview itself changes them.
+    hasher = hashlib.blake2b(digest_size=16)
+    cache = {bake_map.image.name: "bake" for bake_map in part.bake_maps if bake_map.image}
+    hash_properties(hasher, part.baking_props, cache)
+    for bake_map in part.bake_maps:
+        hash_properties(hasher, bake_map, cache)
+    hasher.update(bake_geometry_key(objects).encode())
+    return hasher.hexdigest()
+
+def start_preview_refine(refine, part, objects, key):
+    global preview_refine
+    if not refine.jobs:
+        refine.cancel()
+        return
+    refine.part_name = part.name
+    refine.objects = [obj.name for obj in objects]
+    refine.key = key
+    refine.start()
+    preview_refine = refine
+    if not bpy.app.timers.is_registered(poll_preview_refine):
+        bpy.app.timers.register(poll_preview_refine, first_interval=0.5)
+
+@persistent
+def cancel_preview_refine(*args):
+    global preview_refine
+    if preview_refine:
+        preview_refine.cancel()
+        preview_refine = None
+
+def poll_preview_refine():
+    global preview_refine
+    refine = preview_refine
+    if not refine:
+        return None
+    if not refine.done():
+        return 0.5
+    # Timers also fire while a file loads or a render or bake runs; wait
+    # until the result can be written into the images safely.
+    if not bpy.context.window_manager or not bpy.context.scene:
+        return 0.5
+    if hasattr(bpy.app, "is_job_running") and (bpy.app.is_job_running('RENDER') or bpy.app.is_job_running('OBJECT_BAKE')):
+        return 0.5
+    preview_refine = None
+    part = find_material_collection(bpy.context.scene, refine.part_name)
+    objects = [bpy.data.objects.get(name) for name in refine.objects]
+    if part is None or None in objects or bake_settings_key(part, objects) != refine.key:
+        # Settings changed while refining, the result no longer matches.
+        refine.cancel()
+        return None
+    for error in refine.finish():
+        print(f"HAS preview refine failed: {error}")
+    for window in bpy.context.window_manager.windows:
+        if not window.screen:
+            continue
+        for area in window.screen.areas:
+            area.tag_redraw()
+    return None
+
+BAKE_GEOMETRY_COLLECTION = ".HAS_BakeGeometry"
+
+bake_geometry_stats = {
+    "hits": 0,
+    "builds": 0,
+    "build_time": {},
+    "saved": 0.0,
+}
+
+# Bumped per object whenever the depsgraph reports new geometry or a new
+# transform for it. Keys only hold within a session, hence the token.
+bake_geometry_versions = {}
+bake_geometry_session = uuid.uuid4().hex
+
+@persistent
+def watch_bake_geometry(scene, depsgraph):
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and (update.is_updated_geometry or update.is_updated_transform):
+            pointer = update.id.original.as_pointer()
+            bake_geometry_versions[pointer] = bake_geometry_versions.get(pointer, 0) + 1
+
+def bake_geometry_key(objects):
+    # What combine_objects() would produce only changes when the depsgraph
+    # updates one of the sources, so their update counts stand in for it.
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(bake_geometry_session.encode())
+    for obj in objects:
+        pointer = obj.as_pointer()
+        hasher.update(f"{pointer}:{obj.name}:{bake_geometry_versions.get(pointer, 0)};".encode())
+    return hasher.hexdigest()
+
+def bake_geometry_collection():
+    collection = bpy.data.collections.get(BAKE_GEOMETRY_COLLECTION)
+    if not collection:
+        collection = bpy.data.collections.new(BAKE_GEOMETRY_COLLECTION)
+    return collection
+
+def get_bake_geometry(part, role, objects, key):
+    # Returns the joined mesh for a material set, linked into the current
+    # scene. It is rebuilt only when the key of its sources changed.
+    collection = bake_geometry_collection()
+    name = f".HAS_{role}_{part.name}"
+    obj = collection.objects.get(name)
+    if obj and obj.get("has_bake_key") == key:
+        bpy.context.scene.collection.objects.link(obj)
+        bake_geometry_stats["hits"] += 1
+        bake_geometry_stats["saved"] += bake_geometry_stats["build_time"].get(name, 0.0)
+        return obj
+    remove_object(obj)
+
+    start = time.perf_counter()
+    obj = combine_objects(objects, apply_modifiers=True)
+    if obj:
+        obj.name = name
+        obj["has_bake_key"] = key
+        collection.objects.link(obj)
+        bake_geometry_stats["builds"] += 1
+        bake_geometry_stats["build_time"][name] = time.perf_counter() - start
+    return obj
+
+def restore_bake_geometry(obj, materials):
+    # Undo what a bake run changes on a cached mesh.
+    obj.modifiers.clear()
+    obj.data.materials.clear()
+    for material in materials:
+        obj.data.materials.append(material)
+
+def bake_geometry_report():
+    stats = bake_geometry_stats
+    return f"Bake geometry: reused {stats['hits']}x, built {stats['builds']}x, saved ~{stats['saved']:.2f}s"
+
+@persistent
+def release_bake_geometry(dummy = None):
+    collection = bpy.data.collections.get(BAKE_GEOMETRY_COLLECTION)
+    if collection:
+        for obj in list(collection.objects):
+            remove_object(obj)
+        bpy.data.collections.remove(collection)
+    bake_geometry_stats["build_time"].clear()
+    bake_geometry_versions.clear()
+
 def set_smooth_cage(cage, smooth):
     if cage:
         
@@ -3222,7 +4532,9 @@ class CreatePBRLayer(Operator):
         base_layer_item.resource.image = new_image
         base_layer_item.layer_name = layer_name
         base_layer_item.layer_type = "PBR"
-        base_layer_item.id = shortid()
+        usedmaps = getusedmaps()
+        ids = shortids(len(usedmaps) + 1)
+        base_layer_item.id = ids.pop()
         part.base_layers.add().id = base_layer_item.id
         base_layer_item.suppress_update = False
         base_layer_item.resource.suppress_update = False
@@ -3237,7 +4549,7 @@ class CreatePBRLayer(Operator):
             'AO': ((1.0,1.0,1.0,1.0)),
             'CUSTOM': ((0.0,0.0,0.0,1.0)),
         }
-        for type in getusedmaps():
+        for type in usedmaps:
             layer_item = part.layers.add()
             layer_item.suppress_update = True
             layer_item.resource.suppress_update = True
@@ -3247,7 +4559,7 @@ class CreatePBRLayer(Operator):
             layer_item.resource.default_color = defcolor.get(type[0], ((0.0,0.0,0.0,1.0)))
             layer_item.resource.default_value = defcolor.get(type[0], ((0.0,0.0,0.0,1.0)))[0]
             layer_item.texture_type = type[0]
-            layer_item.id = shortid()
+            layer_item.id = ids.pop()
             base_layer_item.sub_layers.add().id = layer_item.id
             layer_item.suppress_update = False
             layer_item.resource.suppress_update = False
@@ -3378,7 +4690,10 @@ class MoveLayerOperator(Operator):
 
         if 0 <= new_index < len(layers):
             layers.move(index, new_index)
-            UpdateShader()
+            if alt:
+                UpdateLayers(part.base_layers[self.parent].get_layer())
+            else:
+                UpdateShader(full = False)
         return {'FINISHED'}
 
 class MoveFilterOperator(Operator):
@@ -3397,7 +4712,7 @@ class MoveFilterOperator(Operator):
         new_index = ind + 1 if self.direction == 'UP' else ind - 1
         if 0 <= new_index < len(layer.filters):
             layer.filters.move(ind, new_index)
-            UpdateShader()
+            UpdateLayers(layer)
         return {'FINISHED'}
 
 class SelectTextureOperator(Operator):
@@ -4156,7 +5471,8 @@ class SaveImageOperator(bpy.types.Operator):
         try:
             image = bpy.data.images.get(self.image_name)
             if image:
-                image.pack()
+                with profile_section("image save"):
+                    image.pack()
         except Exception as e:
             self.report({'ERROR'}, f"Failed to save image: {e}")
             return {'CANCELLED'}
@@ -4472,6 +5788,18 @@ class HAS_PT_LayersPanel(bpy.types.Panel):
                     row1 = rowd.row()
                     row1.label(text= "Invert G in Normal")
                     row1.prop(part, "InvertG", text="")
+                    row1 = rowd.row()
+                    row1.label(text= "Defer Updates")
+                    row1.prop(context.scene.other_props, "defer_updates", text="")
+                    row1 = rowd.row()
+                    row1.label(text= "Compiled Shader")
+                    row1.prop(context.scene.other_props, "compile_shader", text="")
+                    row1.operator("haspaint.compare_compiled_shader", text="", icon='TIME')
+                    row1 = rowd.row()
+                    row1.label(text= "Paint Focus")
+                    row1.prop(context.scene.other_props, "paint_focus", text="")
+                    for label, result in compile_report.items():
+                        rowd.label(text=f"{label.title()}: {result['nodes']} nodes, {result['samples']} textures, {result['groups']} groups, {result['compile']*1000:.0f} ms compile")
                     # row1 = rowd.row()
                     # row1.label(text= "Fix")
                     # row1.prop(part, "colorfix", text="")
@@ -4498,6 +5826,21 @@ class HAS_PT_LayersPanel(bpy.types.Panel):
                                 if input_socket.type == "RGBA":
                                     colsqrow.label(text = input_socket.name)
                                     colsqrow.prop(input_socket, "default_value", text="")
+
+                box = boxw.box()
+                box.prop(context.scene.other_props, "expand_area_Profiling", text="Performance", icon="TIME", emboss = False)
+                if context.scene.other_props.expand_area_Profiling:
+                    row = box.row(align=True)
+                    row.operator("haspaint.toggle_profiling", text="Recording" if profile_state["enabled"] else "Record Timings", icon="REC", depress=profile_state["enabled"])
+                    row.operator("haspaint.reset_profiling", text="", icon="TRASH")
+                    row.operator("haspaint.export_profile_trace", text="", icon="EXPORT")
+                    colp = box.column(align=True)
+                    for name, count, total, p95 in profile_summary():
+                        rowp = colp.row(align=True)
+                        rowp.label(text=name)
+                        rowp.label(text=f"{count}x")
+                        rowp.label(text=f"{total*1000:.0f} ms")
+                        rowp.label(text=f"p95 {p95*1000:.1f} ms")
             
             if context.scene.other_props.expand_area_buttools:
                 box = boxw.box()
@@ -4643,6 +5986,20 @@ class HAS_PT_LayersPanel(bpy.types.Panel):
                         rowt = boxs.row(align=False)
                         rowt.label(text="Settings")
                         rowt.prop(baking_props, "samples", text="Samples")
+                        rowt.prop(baking_props, "cache_geometry", text="Cache Geometry")
+                        rowt = boxs.row(align=True)
+                        rowt.prop(baking_props, "preview_bake", text="Preview")
+                        sub = rowt.row(align=True)
+                        sub.active = baking_props.preview_bake
+                        sub.prop(baking_props, "preview_divider", text="Divider")
+                        if preview_refine:
+                            rowt.label(text="Refining...", icon="TIME")
+                        rowt = boxs.row(align=True)
+                        rowt.prop(baking_props, "parallel_bake", text="Parallel")
+                        sub = rowt.row(align=True)
+                        sub.active = baking_props.parallel_bake
+                        sub.prop(baking_props, "bake_workers", text="Workers")
+                        sub.prop(baking_props, "bake_worker_threads", text="Threads")
 
                         rowt = boxs.row(align=False)
                         rowt.label(text="Maps")
@@ -4711,42 +6068,174 @@ class HAS_PT_LayersPanel(bpy.types.Panel):
                     rowqs.operator("haspaint.setupscene", text="Setup Scene", icon='SCENE_DATA')
                     rowqs.scale_y = 2.0
                 rowqs = layout.row()
-                
-                for templayer in reversed(part.base_layers):
-                    rowl = layout.row()
-                    layer = templayer.get_layer()
-                    if layer:
-                        layerbox(self, context, rowl, part.base_layers, masks, templayer.index, None)
+                draw_layer_rows(self, context, layout, part, masks)
 
-def layerbox(self, context, layout, layers, masks, index, parent):
-    part = get_material_collection()
+# Rows of the layer list with everything draw() needs besides the layout
+# itself. Hover redraws reuse them, data changes (depsgraph updates, undo,
+# file loads) and selection changes rebuild them. Only one page of rows is
+# drawn; the page follows the selected layer.
+panel_view = {"key": None, "rows": [], "pages": {}}
 
-    layer = layers[index].get_layer()
-    alt = True
-    if layer.layer_type == "FOLDER":
-        row, fold = folderbox(self, context, layout, layer, masks, layer.index)
-        if not fold:
-            for subl in reversed(layer.sub_layers):
-                layerbox(self, context, row, layer.sub_layers, masks, subl.index, layer)
-        return
-    if layer.collapse_box:
-        compactlinelayerbox(self, context, layout, layers, masks, index)
-        return
+@persistent
+def clear_panel_view(*args):
+    panel_view["key"] = None
+
+@persistent
+def watch_panel_view(scene, depsgraph):
+    # Layer settings live on the scene; painting only updates images.
+    if any(isinstance(update.id, bpy.types.Scene) for update in depsgraph.updates):
+        panel_view["key"] = None
+
+def layer_row(layer, ref, parent, parent_row, depth, labels, folder_ids, selected_texture, part):
+    selected, selectedalpha, selnm, sameimg = is_selected(layer)
+    row = {
+        "id": layer.id,
+        "layer": get_layer_position(part, layer.id),
+        "index": ref.index,
+        "parent_index": parent.index if parent else -1,
+        "parent_row": parent_row,
+        "depth": depth,
+        "kind": "FOLDER" if layer.layer_type == "FOLDER" else "LINE" if layer.collapse_box else "LAYER",
+        "selected": selected,
+        "selectedalpha": selectedalpha,
+        "selnm": selnm,
+        "sameimg": sameimg,
+        "in_folder": layer.id in folder_ids if folder_ids is not None and can_be_added_to(layer) else None,
+        "type_label": labels.get(layer.texture_type, ""),
+        "sub_layers": [],
+        "pbr_layers": [],
+        "filters": [],
+    }
+    if row["kind"] == "LINE":
+        # The collapsed line selects by image rather than by layer.
+        if layer.resource.image and not selectedalpha:
+            row["selected"] = selected_texture == layer.resource.image.name
+        return row
+    subs = get_layers(layer.sub_layers)
+    if layer.layer_type == "PBR":
+        row["sub_layers"] = [(sub.index, labels.get(sub.texture_type, ""), sub.use_layer) for sub in subs]
+        if layer.expand_sublayers and selected:
+            row["pbr_layers"] = [get_layer_position(part, sub.id) for sub in subs if sub.use_layer]
+    if layer.expand_filters and not (row["kind"] == "FOLDER" and layer.collapse_box):
+        connection = 'ALPHA' if selectedalpha else 'COLOR'
+        sel = any(f.resource.image and f.resource.image.name == selected_texture for f in layer.filters)
+        if selected or sel:
+            row["filters"] = [findex for findex in reversed(range(len(layer.filters))) if layer.filters[findex].connection_type == connection]
+    return row
+
+def build_panel_rows(part, scene):
+    labels = {item[0]: item[1] for item in getusedmaps()}
+    folder = get_layer_by_id(part.addtofolder) if part.addtofolder else None
+    folder_ids = {ref.id for ref in folder.sub_layers} if folder else None
+    rows = []
+    def add_rows(refs, parent, parent_row, depth):
+        for ref in reversed(refs):
+            layer = ref.get_layer()
+            if not layer:
+                continue
+            rows.append(layer_row(layer, ref, parent, parent_row, depth, labels, folder_ids, scene.selected_texture, part))
+            if layer.layer_type == "FOLDER" and not layer.collapse_box:
+                add_rows(layer.sub_layers, layer, len(rows) - 1, depth + 1)
+    add_rows(part.base_layers, None, -1, 0)
+    return rows
+
+def get_panel_rows(part, scene):
+    key = (part.as_pointer(), len(part.layers), len(part.base_layers), part.selected_layer, part.selected_alpha, part.addtofolder, scene.selected_texture)
+    if key != panel_view["key"]:
+        panel_view["rows"] = build_panel_rows(part, scene)
+        panel_view["key"] = key
+    return panel_view["rows"]
+
+def panel_page(part):
+    # Every material set keeps its own page.
+    return panel_view["pages"].setdefault(part.name, {"page": 0, "selected": ""})
+
+def layer_page(part, rows, size):
+    # Range of rows on the current page, moving to the selected layer's page
+    # when the selection changes.
+    if not size or len(rows) <= size:
+        return 0, len(rows)
+    view = panel_page(part)
+    if part.selected_layer != view["selected"]:
+        view["selected"] = part.selected_layer
+        position = next((i for i, row in enumerate(rows) if row["id"] == part.selected_layer), -1)
+        if position != -1:
+            view["page"] = position // size
+    view["page"] = min(max(0, view["page"]), (len(rows) - 1) // size)
+    start = view["page"] * size
+    return start, min(len(rows), start + size)
+
+def page_window(rows, start, end):
+    # Folders holding the first rows of the page are drawn again on top.
+    window = []
+    parent_row = rows[start]["parent_row"] if start < end else -1
+    while parent_row != -1:
+        window.insert(0, rows[parent_row])
+        parent_row = rows[parent_row]["parent_row"]
+    window.extend(rows[start:end])
+    return window
+
+def draw_layer_rows(self, context, layout, part, masks):
+    size = context.scene.other_props.layer_page_size
+    rows = get_panel_rows(part, context.scene)
+    start, end = layer_page(part, rows, size)
+    window = page_window(rows, start, end)
+    # Only the rows on screen are checked against the layers they point at.
+    if any(row["layer"] < 0 or row["layer"] >= len(part.layers) or part.layers[row["layer"]].id != row["id"] for row in window):
+        clear_panel_view()
+        rows = get_panel_rows(part, context.scene)
+        start, end = layer_page(part, rows, size)
+        window = page_window(rows, start, end)
+    if end - start < len(rows):
+        row = layout.row(align=True)
+        row.operator("haspaint.layer_list_page", text="", icon='TRIA_LEFT').step = -1
+        row.label(text=f"Layers {start + 1}-{end} of {len(rows)}")
+        row.operator("haspaint.layer_list_page", text="", icon='TRIA_RIGHT').step = 1
+        row.prop(context.scene.other_props, "layer_page_size", text="")
+    containers = {}
+    for row in window:
+        layer = part.layers[row["layer"]]
+        container = layout.row() if row["depth"] == 0 else containers[row["depth"]]
+        if row["kind"] == "FOLDER":
+            containers[row["depth"] + 1], fold = folderbox(self, context, container, layer, masks, layer.index, row)
+        elif row["kind"] == "LINE":
+            compactlinelayerbox(self, context, container, layer, row)
+        else:
+            layerbox(self, context, container, layer, masks, row)
+
+class LayerListPage(Operator):
+    """Show the previous or next page of layers"""
+    bl_idname = "haspaint.layer_list_page"
+    bl_label = "Layer Page"
+
+    step: IntProperty()
+
+    def execute(self, context):
+        part = get_material_collection()
+        if not part:
+            return {'CANCELLED'}
+        view = panel_page(part)
+        view["page"] = max(0, view["page"] + self.step)
+        if context.area:
+            context.area.tag_redraw()
+        return {'FINISHED'}
+
+def layerbox(self, context, layout, layer, masks, view):
+    part = get_material_collection()
+
+    index = view["index"]
+    alt = True
         
     box = layout.box()
     
-    selected, selectedalpha, selnm, sameimg = is_selected(layer)
+    selected, selectedalpha, selnm, sameimg = view["selected"], view["selectedalpha"], view["selnm"], view["sameimg"]
 
-    if can_be_added_to(layer):
-        lrfld = getbyid(part.addtofolder)
-        if lrfld:
-            split = box.split(factor=0.06)
-        
-            conts = layer in get_layers(getbyid(part.addtofolder).sub_layers)
+    if view["in_folder"] is not None:
+        split = box.split(factor=0.06)
 
-            adf = split.operator("haspaint.layer_to_folder", text="", icon='PANEL_CLOSE'if conts else "ADD")
-            adf.layer_index = layer.index
-            box = split
+        adf = split.operator("haspaint.layer_to_folder", text="", icon='PANEL_CLOSE'if view["in_folder"] else "ADD")
+        adf.layer_index = layer.index
+        box = split
 
     if selected and not selectedalpha:
         ics = 'SNAP_FACE'
@@ -4827,10 +6316,9 @@ def layerbox(self, context, layout, layers, masks, index, parent):
                 rowfe = row.row()
                 rowfe.enabled = selected
                 rowfe.prop(layer, "expand_filters", text="", icon = "SHADERFX")
-            for foundsubl in get_layers(layer.sub_layers):
-                if foundsubl:
-                    select_op = row.operator("haspaint.uncheck_layer", text=f"{getlabel(foundsubl.texture_type)}", emboss = foundsubl.use_layer)
-                    select_op.layer_index = foundsubl.index
+            for subindex, label, use_layer in view["sub_layers"]:
+                select_op = row.operator("haspaint.uncheck_layer", text=f"{label}", emboss = use_layer)
+                select_op.layer_index = subindex
 
         move_up = row.operator("haspaint.move_layer", text="", icon='TRIA_UP', emboss = not alt)
         move_up.layer_index = index
@@ -4860,7 +6348,7 @@ def layerbox(self, context, layout, layers, masks, index, parent):
                     rowfe = row.row()
                     rowfe.enabled = selected
                     rowfe.prop(layer, "expand_filters", text="", icon = "SHADERFX")
-                typeselect = row.operator("haspaint.type_select", text=getlabel(layer.texture_type), emboss = False)
+                typeselect = row.operator("haspaint.type_select", text=view["type_label"], emboss = False)
                 typeselect.layer_index = layer.index
                 typeselect.current = layer.texture_type
                 
@@ -4871,7 +6359,7 @@ def layerbox(self, context, layout, layers, masks, index, parent):
 
         move_up = row.operator("haspaint.move_layer", text="", icon='TRIA_UP', emboss = not alt)
         move_up.layer_index = index
-        move_up.parent = parent.index if parent else -1
+        move_up.parent = view["parent_index"]
         move_up.direction = 'UP'
         if not alt:
             row = right_column.row(align=True)
@@ -4890,65 +6378,26 @@ def layerbox(self, context, layout, layers, masks, index, parent):
 
     move_down = row.operator("haspaint.move_layer", text="", icon='TRIA_DOWN', emboss = not alt)
     move_down.layer_index = index
-    move_up.parent = parent.index if parent else -1
+    move_up.parent = view["parent_index"]
     move_down.direction = 'DOWN'
 
-    if layer.expand_sublayers:
-        if layer.layer_type== "PBR": 
-            if selected:
-                for foundsubl in get_layers(layer.sub_layers):
-                    if foundsubl.use_layer:
-                        rowbox = right_column.box()
-                        compactlayerbox(self, context, rowbox, foundsubl, None,selected, layer)
-
-    sel = False
-    contalpha = False
-    contcol = False
-    if layer.expand_filters:
-        for f in layer.filters:
-            if f.resource.image:
-                if f.resource.image.name == context.scene.selected_texture:
-                    sel = True
-            if f.connection_type == 'ALPHA':
-                contalpha = True
-            elif f.connection_type == 'COLOR':
-                contcol = True
-        if selectedalpha:        
-            if not contalpha:
-                return right_column
-        else:        
-            if not contcol:
-                return right_column
-        if layer.filters:
-            if selected or sel:
-                rowbox = right_column.column(align = True)
-                for findex, filter in enumerate(reversed(layer.filters)):
+    for position in view["pbr_layers"]:
+        rowbox = right_column.box()
+        compactlayerbox(self, context, rowbox, part.layers[position], None,selected, layer)
 
-                    if selectedalpha:
-                        if not filter.connection_type == 'ALPHA':
-                            continue
-                    else:
-                        if not filter.connection_type == 'COLOR':
-                            continue
-                    findex = len(layer.filters) - 1 - findex
-                    uifilter(self, context, layer, filter, findex,rowbox,layer.index)
+    if view["filters"]:
+        rowbox = right_column.column(align = True)
+        for findex in view["filters"]:
+            uifilter(self, context, layer, layer.filters[findex], findex,rowbox,layer.index)
 
     return right_column
 
-def compactlinelayerbox(self, context, layout, layers, masks, index):
-    part = get_material_collection()
-    layer = layers[index].get_layer()
+def compactlinelayerbox(self, context, layout, layer, view):
     alt = True
 
-    selnm= ""
-    selected = layer.id == part.selected_layer
-    selectedalpha = False
-    if selected:
-        selectedalpha = part.selected_alpha
-    if layer.resource.image:
-        selnm = layer.resource.image.name
-        if not selectedalpha:
-            selected = context.scene.selected_texture == layer.resource.image.name
+    selnm = view["selnm"]
+    selected = view["selected"]
+    selectedalpha = view["selectedalpha"]
             
     row = layout.box().row(align= True)
     if selected and not selectedalpha:
@@ -4991,7 +6440,7 @@ def compactlinelayerbox(self, context, layout, layers, masks, index):
     move_down.direction = 'DOWN'
     row.prop(layer, "collapse_box", text="", icon = 'RADIOBUT_OFF' if layer.sort_color == "PANEL_CLOSE" else layer.sort_color, emboss = False)
 
-def folderbox(self, context, layout, layer, masks, index):
+def folderbox(self, context, layout, layer, masks, index, view):
     part = get_material_collection()
     if layer.lock:
         layout.prop(layer, "lock", text="", icon = "DECORATE_UNLOCKED", emboss = False)
@@ -4999,7 +6448,7 @@ def folderbox(self, context, layout, layer, masks, index):
     box.enabled = not layer.lock
     row = box.row(align = True)
 
-    selected, selectedalpha, selnm, sameimg= is_selected(layer)
+    selected, selectedalpha, selnm, sameimg = view["selected"], view["selectedalpha"], view["selnm"], view["sameimg"]
     select_op = row.operator("haspaint.select_texture", text="", icon="SNAP_FACE" if selected else "SHADING_BBOX", depress = selected)
     select_op.texture_name = selnm
     select_op.id = layer.id
@@ -5042,36 +6491,10 @@ def folderbox(self, context, layout, layer, masks, index):
     move_down.layer_index = index
     move_down.direction = 'DOWN'
     right_column = box
-    sel = False
-    contalpha = False
-    contcol = False
-    if layer.expand_filters and not layer.collapse_box:
-        for f in layer.filters:
-            if f.resource.image:
-                if f.resource.image.name == context.scene.selected_texture:
-                    sel = True
-            if f.connection_type == 'ALPHA':
-                contalpha = True
-            elif f.connection_type == 'COLOR':
-                contcol = True
-        if selectedalpha:        
-            if not contalpha:
-                return box, layer.collapse_box
-        else:        
-            if not contcol:
-                return box, layer.collapse_box
-        if layer.filters:
-            if selected or sel:
-                rowbox = right_column.column(align = True)
-                for findex, filter in enumerate(reversed(layer.filters)):
-                    if selectedalpha:
-                        if not filter.connection_type == 'ALPHA':
-                            continue
-                    else:
-                        if not filter.connection_type == 'COLOR':
-                            continue
-                    findex = len(layer.filters) - 1 - findex
-                    uifilter(self, context, layer, filter, findex,rowbox,layer.index)
+    if view["filters"]:
+        rowbox = right_column.column(align = True)
+        for findex in view["filters"]:
+            uifilter(self, context, layer, layer.filters[findex], findex,rowbox,layer.index)
 
     return box, layer.collapse_box
 
@@ -5139,7 +6562,7 @@ def uifilter(self, context, layer, filter, index, rowbox, lindex):
 
     row.prop(filter, "edit", text="", icon="TRIA_DOWN" if filter.edit else "TRIA_RIGHT", emboss=False)
 
-    filter_value = next((item for item in FILTERS if item and item[0] == filter.name), None)
+    filter_value = FILTER_ITEMS.get(filter.name)
     if filter_value:
         op = row.operator("haspaint.filter_select", text=filter_value[1], icon=filter_value[3], emboss=False)
     else:
@@ -5474,7 +6897,7 @@ def drawlevels(levels, rowbox, histogram_source = "", skipexpand = False, compac
                 name = ".HAS_SceneProperties"
                 if name in bpy.data.node_groups:
                     node_group = bpy.data.node_groups[name]
-                    histnode = get_node_by_name(node_group, histogram_source)
+                    histnode = node_group.nodes.get(histogram_source)
                     if histnode:
                         wr = xsb.column(align = True)
                         wr.scale_y =0.3
@@ -5561,24 +6984,45 @@ class OpacityControlOperatorPOPUP(Operator):
 ### NODES
 ###
 
-def get_layers(base_layers):
+def get_layers(base_layers, part = None):
     layers = []
     for bl in base_layers:
-        l = bl.get_layer()
+        l = bl.get_layer(part)
         if l:
-            layers.append(bl.get_layer())
+            layers.append(l)
 
     return layers
 
-def create_normal_blend_group():
-    name = ".HAS_BlendNormals"
-    if name in bpy.data.node_groups:
-        node_group = bpy.data.node_groups[name]
+# Shared helper groups that never depend on layer data. Bump a version when
+# the builder changes so existing files pick up the new layout once.
+STATIC_GROUP_VERSION = "has_group_version"
+static_group_versions = {
+    ".HAS_BlendNormals": 1,
+    ".HAS_TypeSwitch": 1,
+    ".HAS_Mapping": 1,
+    ".HAS_InvertNormal": 1,
+    "HAS_Unlit": 1,
+}
 
-        node_group.nodes.clear()
+def static_node_group(name, build, variant=""):
+    stamp = str(static_group_versions[name])
+    if variant:
+        stamp += f":{variant}"
+    node_group = bpy.data.node_groups.get(name)
+    if node_group and node_group.get(STATIC_GROUP_VERSION) == stamp and len(node_group.nodes):
+        return node_group
+    if node_group:
+        simple_clear_node(node_group)
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
-    
+    build(node_group)
+    node_group[STATIC_GROUP_VERSION] = stamp
+    return node_group
+
+def create_normal_blend_group():
+    return static_node_group(".HAS_BlendNormals", build_normal_blend_group)
+
+def build_normal_blend_group(node_group):
     create_socket(node_group, "Fac", 'float', True)
     create_socket(node_group, "Color1", 'color', True)
     create_socket(node_group, "Color2", 'color', True)
@@ -5608,8 +7052,6 @@ def create_normal_blend_group():
     node_group.links.new(math_nodeA.outputs[0], math_nodeN.inputs[0])
     node_group.links.new(math_nodeN.outputs[0], output_node.inputs[0])
 
-    return node_group
-
 def mask_by_color_node(filter, layer):
     node_group = None
     name = f".HAS_SelectColor"
@@ -5789,141 +7231,126 @@ def getfiltergroupname(filter):
 def getmaterialgroupname(part):
     return f"HAS_{part.material.name}_Material"
 
+@profiled("create_layer_node")
 def create_layer_node(layer, pbr = False):
     part = get_material_collection()
     name = getlayergroupname(layer)
     if name in bpy.data.node_groups:
         node_group = bpy.data.node_groups[name]
-        clear_nodes(node_group, layer.filters)
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
     pth = layer.blend_mode== "PASS"
 
-    active_filters = any_active_filter(layer.filters)
+    active_filters = any_contributing_filter(layer.filters)
 
-    create_socket(node_group, "Color", 'color', True)
-    create_socket(node_group, "Alpha", 'float', True)
-    create_socket(node_group, "Color", 'color', False)
-    create_socket(node_group, "Alpha", 'float', False)
+    graph = NodeGraph()
+    graph.socket("Color", 'color', True)
+    graph.socket("Alpha", 'float', True)
+    graph.socket("Color", 'color', False)
+    graph.socket("Alpha", 'float', False)
 
-    Note(node_group)
+    graph.note()
 
     img = layer.resource.image
-    links = node_group.links
 
-    input_node = node_group.nodes.new(type='NodeGroupInput')
-    input_node.location = (-500, 0)
-    output_node = node_group.nodes.new(type='NodeGroupOutput')
-    output_node.location = (500, 0)
+    graph.node("Group Input", 'NodeGroupInput', (-500, 0))
+    graph.node("Group Output", 'NodeGroupOutput', (500, 0))
 
     lastconnection = None
     lastclipmaskconnection = None
 
     if img:
-        image_node = create_image_node(node_group, img, resource = layer.resource)
-        lastconnection = image_node.outputs[0]
+        image_node = graph_image_node(graph, img, resource = layer.resource)
+        lastconnection = (image_node, 0)
         if layer.texture_type == "NORMAL" and layer.resource.image.colorspace_settings.name == "sRGB":
-            gamma = create_node(node_group,'ShaderNodeGamma', -200,0, "", '')
-            set_default(gamma,1, 0.454)
-            lastconnection = gamma.outputs[0]
-            links.new(image_node.outputs[0], gamma.inputs[0])
-    math_node = create_node(node_group,'ShaderNodeMath', -200,0, "op", 'MULTIPLY')
+            graph.node("Gamma", 'ShaderNodeGamma', (-200, 0))
+            graph.default("Gamma", 1, 0.454)
+            lastconnection = ("Gamma", 0)
+            graph.link(image_node, 0, "Gamma", 0)
+    graph.node("Opacity", 'ShaderNodeMath', (-200, 0), operation='MULTIPLY')
 
     initialmask = None
     if layer.mask:
-        initialmask = create_node(node_group,'ShaderNodeMath', -200,0, "op", 'MULTIPLY')
-        initialmask.name = "InitialMask"
-        initialmask.inputs[0].name = "MaskValue"
-        set_default(initialmask, 0, 1.0 if layer.mask_value else 0.0)
-        set_default(initialmask, 1, 1.0)
-        #layer.mask_value.set_socket_reference(initialmask.inputs[1])
-    #else:
-        #layer.mask_value.set_socket_reference(math_node.inputs[0])
-
-    set_default(math_node, 0, 1.0)    
-    set_default(math_node, 1, layer.opacity)
-    math_node.inputs[1].name = 'OpSock'
-    layer.opacity_socket.set_socket_reference(math_node.inputs[1])
+        initialmask = graph.node("InitialMask", 'ShaderNodeMath', (-200, 0), operation='MULTIPLY')
+        graph.rename(initialmask, 0, "MaskValue")
+        graph.default(initialmask, 0, 1.0 if layer.mask_value else 0.0)
+        graph.default(initialmask, 1, 1.0)
+
+    graph.default("Opacity", 0, 1.0)
+    graph.default("Opacity", 1, layer.opacity)
+    graph.rename("Opacity", 1, 'OpSock')
+    graph.after(lambda tree: layer.opacity_socket.set_socket_reference(tree.nodes["Opacity"].inputs[1]))
     
     if layer.blend_mode == "COMBNRM":
-        mix_node = create_node(node_group, 'ShaderNodeGroup' , -600,0, "cus", ".HAS_BlendNormals")
+        graph.node("Mix", 'ShaderNodeGroup', (-600, 0), node_tree=create_normal_blend_group().name)
     else:
-        if not pth:
-            mix_node= create_node(node_group,'ShaderNodeMixRGB', 0,0, "mix", layer.blend_mode)
-        else:
-            mix_node= create_node(node_group,'ShaderNodeMixRGB', 0,0, "mix", "MIX")
-
-        mix_node.use_clamp = True
+        graph.node("Mix", 'ShaderNodeMixRGB', (0, 0), blend_type="MIX" if pth else layer.blend_mode, use_clamp=True)
     
-    mix_node.inputs[2].name = "ColSock"
-    layer.resource.default_color_socket.set_socket_reference(mix_node.inputs["ColSock"])
+    graph.rename("Mix", 2, "ColSock")
+    color_socket = ("Mix", 2)
     height_remap = None
 
-    # if img:
-    #     lastconnection = image_node.outputs[1]
-    #     lastclipmaskconnection = image_node.outputs[0]
-
     if not img:
-        set_default(mix_node, 'ColSock', layer.resource.default_color)
+        graph.default("Mix", 2, layer.resource.default_color)
 
     if layer.texture_type == "HEIGHT" and img and layer.blend_mode == 'ADD':
-        height_remap= create_node(node_group,'ShaderNodeMapRange', 0,0, "", "")
-        height_remap.clamp = False
-        set_default(height_remap, 3, -0.5)
-        set_default(height_remap, 4, 0.5)
+        height_remap = graph.node("HeightRemap", 'ShaderNodeMapRange', (0, 0), clamp=False)
+        graph.default(height_remap, 3, -0.5)
+        graph.default(height_remap, 4, 0.5)
         
     if pth:
-        lastconnection = input_node.outputs["Color"]
-        lastclipmaskconnection = input_node.outputs["Alpha"]
+        lastconnection = ("Group Input", "Color")
+        lastclipmaskconnection = ("Group Input", "Alpha")
     else:
         if img:
             if height_remap:
-                links.new(image_node.outputs[0], height_remap.inputs[0])
-                lastconnection = height_remap.outputs[0]
+                graph.link(image_node, 0, height_remap, 0)
+                lastconnection = (height_remap, 0)
             else:
                 if not lastconnection:
-                    lastconnection = image_node.outputs[0]
-            lastclipmaskconnection = image_node.outputs[1]
+                    lastconnection = (image_node, 0)
+            lastclipmaskconnection = (image_node, 1)
     if layer.mask:
         if initialmask and lastclipmaskconnection:
-            links.new(lastclipmaskconnection, initialmask.inputs[1])
+            graph.link(*lastclipmaskconnection, initialmask, 1)
         if initialmask:
-            lastclipmaskconnection = initialmask.outputs[0]
+            lastclipmaskconnection = (initialmask, 0)
     if active_filters:
-        filnode = create_node(node_group,'ShaderNodeGroup', -200,-200, "cus", layer_filter(layer).name)
-        set_default(filnode, 'Color', layer.resource.default_color)
-        set_default(filnode, 'Alpha', 1.0)
+        graph.node("Filters", 'ShaderNodeGroup', (-200, -200), node_tree=layer_filter(layer).name)
+        graph.default("Filters", 'Color', layer.resource.default_color)
+        graph.default("Filters", 'Alpha', 1.0)
         if lastconnection:
-            links.new(lastconnection, filnode.inputs['Color'])
+            graph.link(*lastconnection, "Filters", 'Color')
         if lastclipmaskconnection:
-            links.new(lastclipmaskconnection, filnode.inputs['Alpha']) 
-        lastconnection = filnode.outputs["Color"]
-        lastclipmaskconnection = filnode.outputs["Alpha"]
-        layer.resource.default_color_socket.set_socket_reference(filnode.inputs["Color"])
+            graph.link(*lastclipmaskconnection, "Filters", 'Alpha')
+        lastconnection = ("Filters", "Color")
+        lastclipmaskconnection = ("Filters", "Alpha")
+        color_socket = ("Filters", "Color")
 
     if not lastclipmaskconnection:
         if img:
-            lastclipmaskconnection = image_node.outputs[1]
+            lastclipmaskconnection = (image_node, 1)
 
-    links.new(input_node.outputs['Color'], mix_node.inputs[1])
-    links.new(mix_node.outputs[0], output_node.inputs['Color'])
+    graph.link("Group Input", 'Color', "Mix", 1)
+    graph.link("Mix", 0, "Group Output", 'Color')
     if lastconnection:
-        links.new(lastconnection, mix_node.inputs[2])
+        graph.link(*lastconnection, "Mix", 2)
     if lastclipmaskconnection:
+        graph.link(*lastclipmaskconnection, "Opacity", 0)
 
-        links.new(lastclipmaskconnection, math_node.inputs[0])
-
-    alphablend= create_node(node_group,'ShaderNodeMixRGB', 0,0, "mix", "SCREEN")
-    set_default(alphablend,0,1.0)
-    if lastconnection:
-        links.new(lastconnection, mix_node.inputs[2])
+    graph.node("AlphaBlend", 'ShaderNodeMixRGB', (0, 0), blend_type="SCREEN")
+    graph.default("AlphaBlend", 0, 1.0)
     
-    links.new(math_node.outputs[0], mix_node.inputs['Fac'])
+    graph.link("Opacity", 0, "Mix", 'Fac')
 
-    links.new(math_node.outputs[0], alphablend.inputs[1])
-    links.new(input_node.outputs["Alpha"], alphablend.inputs[2])
+    graph.link("Opacity", 0, "AlphaBlend", 1)
+    graph.link("Group Input", "Alpha", "AlphaBlend", 2)
 
-    links.new(alphablend.outputs[0], output_node.inputs["Alpha"])
+    graph.link("AlphaBlend", 0, "Group Output", "Alpha")
+
+    graph.after(lambda tree: layer.resource.default_color_socket.set_socket_reference(tree.nodes[color_socket[0]].inputs[color_socket[1]]))
+    keep = {filter.node_name for filter in layer.filters if filter.node_name}
+    reconcile_tree(node_group, graph, keep)
 
     return node_group
 
@@ -5963,7 +7390,7 @@ def simple_layer(name, image, opacity, blend_mode, default_color, mixmode = Fals
     math_node.inputs[1].name = 'OpSock'
 
     if blend_mode == "COMBNRM":
-        mix_node = create_node(node_group, 'ShaderNodeGroup' , -600,0, "cus", ".HAS_BlendNormals")
+        mix_node = create_node(node_group, 'ShaderNodeGroup' , -600,0, "cus", create_normal_blend_group().name)
     else:
         if not pth:
             mix_node= create_node(node_group,'ShaderNodeMixRGB', 0,0, "mix", blend_mode)
@@ -6008,7 +7435,11 @@ def simple_layer(name, image, opacity, blend_mode, default_color, mixmode = Fals
 
     return node_group
 
+@profiled("layer_filter")
 def layer_filter(layer, multi = False):
+    # Still cleared and rebuilt in place, like mask_gen_node() and
+    # light_node(): their filter nodes keep user edits between builds
+    # (levels, custom group inputs) that a NodeGraph does not describe yet.
     if not layer:
         return None
     part = get_material_collection()
@@ -6066,7 +7497,8 @@ def layer_filter(layer, multi = False):
             assignalpha = False
             templast = None
             filter.layer_in = layer.id
-            if filter.in_use:
+            shader_state["folds"][filter.id] = filter_fold_state(filter)
+            if filter.in_use and not shader_state["folds"][filter.id]:
                 count = count+1
                 filternodename = None
                 filternode = None
@@ -6258,29 +7690,24 @@ def create_folder_nodegroup(folder_layer, pbr = False):
     name = f"{getlayergroupname(folder_layer)}"
     if name in bpy.data.node_groups:
         node_group = bpy.data.node_groups[name]
-        clear_nodes(node_group, folder_layer.filters)
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
 
-    create_socket(node_group, "Color", 'color', True)
-    create_socket(node_group, "Color", 'color', False)
-    create_socket(node_group, "Alpha", 'float', True)
-    create_socket(node_group, "Alpha", 'float', False)
-    create_socket(node_group, "Type", 'float', True)
+    graph = NodeGraph()
+    graph.socket("Color", 'color', True)
+    graph.socket("Color", 'color', False)
+    graph.socket("Alpha", 'float', True)
+    graph.socket("Alpha", 'float', False)
+    graph.socket("Type", 'float', True)
 
-    Note(node_group)
-    group_input = node_group.nodes.new(type='NodeGroupInput')
-    group_input.location = (-500, 0)
-    group_output = node_group.nodes.new(type='NodeGroupOutput')
-    group_output.location = (500, 0)
-    
-    links = node_group.links
-    count = -1
+    graph.note()
+    graph.node("Group Input", 'NodeGroupInput', (-500, 0))
+    graph.node("Group Output", 'NodeGroupOutput', (500, 0))
 
-    lastconnection = group_input.outputs['Color']
+    count = -1
 
     prevnodes = []
-    alsockets = []
+    prev_node = None
     lrs = get_layers(folder_layer.sub_layers)
     
     for type in getusedtypes():
@@ -6292,71 +7719,61 @@ def create_folder_nodegroup(folder_layer, pbr = False):
                 
                 count = count+1
                 
-                l_group = create_layer_node(layer)
-                layer_node = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", l_group.name)
+                layer_node = graph.node(f"Layer_{layer.id}", 'ShaderNodeGroup', (-200, count*-200), node_tree=layer_node_group(layer).name)
 
                 if prev_node:
-                    links.new(prev_node.outputs['Color'], layer_node.inputs['Color'])
-                    links.new(prev_node.outputs['Alpha'], layer_node.inputs['Alpha'])
-                if "Type" in layer_node.inputs:
-                    links.new(group_input.outputs['Type'], layer_node.inputs['Type'])
+                    graph.link(prev_node, 'Color', layer_node, 'Color')
+                    graph.link(prev_node, 'Alpha', layer_node, 'Alpha')
+                graph.link("Group Input", 'Type', layer_node, 'Type')
                 prev_node = layer_node
         
         if prev_node:
             prevnodes.append(prev_node)
     if prev_node:    
-        links.new(prev_node.outputs['Color'], group_output.inputs['Color'])
-        links.new(prev_node.outputs['Alpha'], group_output.inputs['Alpha'])
+        graph.link(prev_node, 'Color', "Group Output", 'Color')
+        graph.link(prev_node, 'Alpha', "Group Output", 'Alpha')
     else:
-        links.new(group_input.outputs['Color'], group_output.inputs['Color'])
-        links.new(group_input.outputs['Alpha'], group_output.inputs['Alpha'])
+        graph.link("Group Input", 'Color', "Group Output", 'Color')
+        graph.link("Group Input", 'Alpha', "Group Output", 'Alpha')
     prsef = None
-    count = -1
-    type_switch_node = None
     lastcol = None
     lastcolal = None
-    for pren in prevnodes:
-        count = count+1
-        type_switch_node = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", type_switch().name)
-        links.new(group_input.outputs["Type"], type_switch_node.inputs['Type'])
-        set_default(type_switch_node, "Compare", float(count))
-        links.new(pren.outputs["Color"], type_switch_node.inputs['Color'])
-        links.new(pren.outputs["Alpha"], type_switch_node.inputs['Alpha'])
+    for count, pren in enumerate(prevnodes):
+        type_switch_node = graph.node(f"TypeSwitch{count}", 'ShaderNodeGroup', (-200, count*-200), node_tree=type_switch().name)
+        graph.link("Group Input", "Type", type_switch_node, 'Type')
+        graph.default(type_switch_node, "Compare", float(count))
+        graph.link(pren, "Color", type_switch_node, 'Color')
+        graph.link(pren, "Alpha", type_switch_node, 'Alpha')
         if prsef:
-            links.new(prsef.outputs["Color"], type_switch_node.inputs['PrevColor'])
-            links.new(prsef.outputs["Alpha"], type_switch_node.inputs['PrevAlpha'])
+            graph.link(prsef, "Color", type_switch_node, 'PrevColor')
+            graph.link(prsef, "Alpha", type_switch_node, 'PrevAlpha')
         prsef = type_switch_node
-    if type_switch_node:
-
-        lastcol = type_switch_node.outputs["Color"]
-        lastcolal = type_switch_node.outputs["Alpha"]
-        folder_layerfinm = layer_filter(folder_layer, multi = True).name
-        if folder_layerfinm:
-            folder_layerfilnodegroup = create_node(node_group,'ShaderNodeGroup', -200,-200, "cus", folder_layerfinm)
-            links.new(lastcol, folder_layerfilnodegroup.inputs['Color'])
-            links.new(lastcolal, folder_layerfilnodegroup.inputs['Alpha'])
-            links.new(group_input.outputs['Type'], folder_layerfilnodegroup.inputs['Type'])
-            lastcol = folder_layerfilnodegroup.outputs["Color"]
-            lastcolal = folder_layerfilnodegroup.outputs["Alpha"]
-
-    mix = create_node(node_group,'ShaderNodeMixRGB', -200,-200, "mix", folder_layer.blend_mode)
-    blenda = create_node(node_group,'ShaderNodeMixRGB', -200,-200, "mix", "SCREEN")
-    set_default(blenda, 'Fac', 1.0)
-    set_default(mix, 'Fac', folder_layer.opacity)
-    folder_layer.opacity_socket.set_socket_reference(mix.inputs['Fac'])
+    if prsef:
+        graph.node("Filters", 'ShaderNodeGroup', (-200, -200), node_tree=layer_filter(folder_layer, multi = True).name)
+        graph.link(prsef, "Color", "Filters", 'Color')
+        graph.link(prsef, "Alpha", "Filters", 'Alpha')
+        graph.link("Group Input", 'Type', "Filters", 'Type')
+        lastcol = ("Filters", "Color")
+        lastcolal = ("Filters", "Alpha")
+
+    graph.node("Mix", 'ShaderNodeMixRGB', (-200, -200), blend_type=folder_layer.blend_mode)
+    graph.node("AlphaBlend", 'ShaderNodeMixRGB', (-200, -200), blend_type="SCREEN")
+    graph.default("AlphaBlend", 'Fac', 1.0)
+    graph.default("Mix", 'Fac', folder_layer.opacity)
+    graph.after(lambda tree: folder_layer.opacity_socket.set_socket_reference(tree.nodes["Mix"].inputs['Fac']))
     if lastcol:
-        links.new(group_input.outputs['Color'], mix.inputs[1])
-        links.new(lastcol, mix.inputs[2])
-        links.new(group_input.outputs['Alpha'], blenda.inputs[1])
-        links.new(lastcolal, blenda.inputs[2])
+        graph.link("Group Input", 'Color', "Mix", 1)
+        graph.link(*lastcol, "Mix", 2)
+        graph.link("Group Input", 'Alpha', "AlphaBlend", 1)
+        graph.link(*lastcolal, "AlphaBlend", 2)
 
-        links.new(lastcolal, mix.inputs[0])
+        graph.link(*lastcolal, "Mix", 0)
 
-        lastcol = mix.outputs[0]
-        lastcolal = blenda.outputs[0]
-        links.new(lastcol, group_output.inputs['Color'])
-        links.new(lastcolal, group_output.inputs['Alpha'])
+        graph.link("Mix", 0, "Group Output", 'Color')
+        graph.link("AlphaBlend", 0, "Group Output", 'Alpha')
 
+    keep = {filter.node_name for filter in folder_layer.filters if filter.node_name}
+    reconcile_tree(node_group, graph, keep)
     return node_group
 
 def create_pbr_nodegroup(folder_layer):
@@ -6364,110 +7781,97 @@ def create_pbr_nodegroup(folder_layer):
     name = f"{getlayergroupname(folder_layer)}"
     if name in bpy.data.node_groups:
         node_group = bpy.data.node_groups[name]
-        clear_nodes(node_group, folder_layer.filters)
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
 
-    create_socket(node_group, "Color", 'color', True)
-    create_socket(node_group, "Color", 'color', False)
-    create_socket(node_group, "Alpha", 'float', True)
-    create_socket(node_group, "Alpha", 'float', False)
-    create_socket(node_group, "Type", 'float', True)
+    graph = NodeGraph()
+    graph.socket("Color", 'color', True)
+    graph.socket("Color", 'color', False)
+    graph.socket("Alpha", 'float', True)
+    graph.socket("Alpha", 'float', False)
+    graph.socket("Type", 'float', True)
 
-    Note(node_group)
-    group_input = node_group.nodes.new(type='NodeGroupInput')
-    group_input.location = (-500, 0)
-    group_output = node_group.nodes.new(type='NodeGroupOutput')
-    group_output.location = (500, 0)
-    
-    links = node_group.links
-    
-    lastconnection = group_input.outputs['Color']
+    graph.note()
+    graph.node("Group Input", 'NodeGroupInput', (-500, 0))
+    graph.node("Group Output", 'NodeGroupOutput', (500, 0))
 
     count = -1
     sockets = []
-    alsockets = []
     lrs = get_layers(folder_layer.sub_layers)
-    sourceimg = create_image_node(node_group, folder_layer.resource.image, resource = folder_layer.resource)
-    mpng = get_node_by_name(node_group, "Mapping")
-    srinm = sourceimg.outputs[1]
+    sourceimg = graph_image_node(graph, folder_layer.resource.image, resource = folder_layer.resource, prefix = "Source")
     folder_layerfinm = layer_filter(folder_layer, multi = True).name
-    if folder_layerfinm:
-        folder_layerfilnodegroup = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", folder_layerfinm)
-        links.new(group_input.outputs["Type"], folder_layerfilnodegroup.inputs["Type"])
-        links.new(sourceimg.outputs[1], folder_layerfilnodegroup.inputs["Alpha"])
-        srinm = folder_layerfilnodegroup.outputs["Alpha"]
+    graph.node("Filters", 'ShaderNodeGroup', (-200, count*-200), node_tree=folder_layerfinm)
+    graph.link("Group Input", "Type", "Filters", "Type")
+    graph.link(sourceimg, 1, "Filters", "Alpha")
+    srinm = ("Filters", "Alpha")
+    prev_node = None
     for type in getusedtypes():
         prev_node = None
 
         for index, layer in enumerate(lrs):
             filnodegroup = None
             if layer.use_layer and type==layer.texture_type:
-                layer_node = None
                 count = count+1
 
                 if layer.filters:
-                    finm = layer_filter(layer, multi = True).name
-                    if finm:
-                        filnodegroup = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", finm)
+                    filnodegroup = graph.node(f"Filters_{layer.id}", 'ShaderNodeGroup', (-200, count*-200), node_tree=layer_filter(layer, multi = True).name)
                 image = None
-                mixrgb = create_node(node_group,'ShaderNodeMixRGB', -200,count*-200, "mix", layer.blend_mode)
-                opacitynode = create_node(node_group,'ShaderNodeMath', -200,count*-200, "op", "MULTIPLY")
-                opacitynode.inputs[1].name = "OpSock"
+                mixrgb = graph.node(f"Mix_{layer.id}", 'ShaderNodeMixRGB', (-200, count*-200), blend_type=layer.blend_mode)
+                opacitynode = graph.node(f"Opacity_{layer.id}", 'ShaderNodeMath', (-200, count*-200), operation='MULTIPLY')
+                graph.rename(opacitynode, 1, "OpSock")
                 if layer.resource.image:
-                    image = create_image_node(node_group, layer.resource.image, resource = layer.resource)         
+                    image = graph_image_node(graph, layer.resource.image, resource = layer.resource, prefix = f"{layer.id}_")
 
-                    links.new(image.outputs[0], mixrgb.inputs[2])
+                    graph.link(image, 0, mixrgb, 2)
 
-                set_default(mixrgb,2,layer.resource.default_color)
-                set_default(mixrgb,0,1.0)
-                set_default(opacitynode,1,layer.opacity)
+                graph.default(mixrgb, 2, layer.resource.default_color)
+                graph.default(mixrgb, 0, 1.0)
+                graph.default(opacitynode, 1, layer.opacity)
 
-                layer.resource.default_color_socket.set_socket_reference(mixrgb.inputs[2])
-                layer.opacity_socket.set_socket_reference(opacitynode.inputs[1])
-                
-                layer_node = mixrgb
+                color_socket = (mixrgb, 2)
 
                 if filnodegroup:
                     if image:
-                        links.new(image.outputs['Color'], filnodegroup.inputs["Color"])
+                        graph.link(image, 'Color', filnodegroup, "Color")
                     else:
-                        set_default(filnodegroup,"Color", layer.resource.default_color)
-                        set_default(filnodegroup,"Alpha", 1.0)
-                        layer.resource.default_color_socket.set_socket_reference(filnodegroup.inputs["Color"])
-                    links.new(filnodegroup.outputs['Color'], mixrgb.inputs[2])
-
-                if layer_node:
-                    links.new(prev_node.outputs['Color'] if prev_node else group_input.outputs['Color'], layer_node.inputs[1])
-                    links.new(srinm if srinm else group_input.outputs['Alpha'], opacitynode.inputs[0])
-                    links.new(opacitynode.outputs[0], mixrgb.inputs[0])
-                    prev_node = layer_node
+                        graph.default(filnodegroup, "Color", layer.resource.default_color)
+                        graph.default(filnodegroup, "Alpha", 1.0)
+                        color_socket = (filnodegroup, "Color")
+                    graph.link(filnodegroup, 'Color', mixrgb, 2)
+
+                graph.after(lambda tree, layer = layer, socket = color_socket: layer.resource.default_color_socket.set_socket_reference(tree.nodes[socket[0]].inputs[socket[1]]))
+                graph.after(lambda tree, layer = layer, node = opacitynode: layer.opacity_socket.set_socket_reference(tree.nodes[node].inputs[1]))
+
+                graph.link(prev_node if prev_node else "Group Input", 'Color', mixrgb, 1)
+                graph.link(*srinm, opacitynode, 0)
+                graph.link(opacitynode, 0, mixrgb, 0)
+                prev_node = mixrgb
         if prev_node:
-            sockets.append(prev_node.outputs['Color'])
+            sockets.append((prev_node, 'Color'))
     if prev_node:  
-        links.new(prev_node.outputs['Color'], group_output.inputs['Color'])
+        graph.link(prev_node, 'Color', "Group Output", 'Color')
     else:
-        links.new(group_input.outputs['Color'], group_output.inputs['Color'])
-
-    lastcol = blendin(node_group, sockets, group_input.outputs["Type"])
-    lastcolal = blendin(node_group, alsockets, group_input.outputs["Type"])
-    if folder_layerfinm:
-        lastcolal =  folder_layerfilnodegroup.outputs["Alpha"]
-        colfilt = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", folder_layerfinm)
-        links.new(group_input.outputs["Type"], colfilt.inputs["Type"])
+        graph.link("Group Input", 'Color', "Group Output", 'Color')
+
+    lastcol = blendin(graph, sockets, ("Group Input", "Type"))
+    lastcolal = srinm
+    graph.node("ColorFilters", 'ShaderNodeGroup', (-200, count*-200), node_tree=folder_layerfinm)
+    graph.link("Group Input", "Type", "ColorFilters", "Type")
     if lastcol:
-        if colfilt:
-            links.new(lastcol, colfilt.inputs["Color"])
-            lastcol = colfilt.outputs["Color"]
-        links.new(lastcol, group_output.inputs['Color'])
-        links.new(lastcolal, group_output.inputs['Alpha'])
+        graph.link(*lastcol, "ColorFilters", "Color")
+        lastcol = ("ColorFilters", "Color")
+        graph.link(*lastcol, "Group Output", 'Color')
+        graph.link(*lastcolal, "Group Output", 'Alpha')
 
-    alphablend= create_node(node_group,'ShaderNodeMixRGB', 0,0, "mix", "SCREEN")
-    set_default(alphablend,0,1.0)
+    graph.node("AlphaBlend", 'ShaderNodeMixRGB', (0, 0), blend_type="SCREEN")
+    graph.default("AlphaBlend", 0, 1.0)
+
+    graph.link(*lastcolal, "AlphaBlend", 2)
+    graph.link("Group Input", "Alpha", "AlphaBlend", 1)
+    graph.link("AlphaBlend", 0, "Group Output", 'Alpha')
 
-    links.new(lastcolal, alphablend.inputs[2])
-    links.new(group_input.outputs["Alpha"], alphablend.inputs[1])
-    links.new(alphablend.outputs[0], group_output.inputs['Alpha'])
+    keep = {filter.node_name for filter in folder_layer.filters if filter.node_name}
+    reconcile_tree(node_group, graph, keep)
     return node_group
 
 def clear_node_socket_connections(node):
@@ -6627,6 +8031,188 @@ def set_minmax(node_group, name, min, max):
         except (KeyError, IndexError):
             pass
 
+class NodeGraph:
+    # Plain description of a node tree. Builders fill it in and
+    # reconcile_tree() applies it, touching only what differs from the tree.
+    def __init__(self):
+        self.sockets = []
+        self.nodes = {}
+        self.links = []
+        self.interface_defaults = {}
+        self.callbacks = []
+
+    def socket(self, name, socket_type_key, input):
+        self.sockets.append((name, socket_type_key, input))
+
+    def sockets_from_string(self, input_sockets_string, output_sockets_string):
+        for sockets_string, input in ((input_sockets_string, True), (output_sockets_string, False)):
+            for socket_pair in sockets_string.split(','):
+                name = socket_pair.split('(')[0].strip('<> ').strip()
+                socket_type_key = socket_pair.split('(')[1].split(')')[0].strip().lower()
+                self.socket(name, socket_type_key, input)
+
+    def node(self, name, bl_idname, location = (0, 0), **props):
+        self.nodes[name] = {"type": bl_idname, "location": location, "props": props, "inputs": {}, "renames": {}}
+        return name
+
+    def note(self):
+        return self.node("HAS_Note", 'NodeFrame', (-200, 400), label="This node group is created and used by HAS Paint Layers", width=600)
+
+    def default(self, node, socket, value):
+        self.nodes[node]["inputs"][socket] = value
+
+    def rename(self, node, index, name):
+        self.nodes[node]["renames"][index] = name
+
+    def link(self, from_node, from_socket, to_node, to_socket):
+        self.links.append((from_node, from_socket, to_node, to_socket))
+
+    def is_linked(self, node, socket):
+        return any(link[0] == node and link[1] == socket for link in self.links)
+
+    def interface_default(self, name, value):
+        self.interface_defaults[name] = value
+
+    def after(self, callback):
+        # Runs with the reconciled tree, for references to the real nodes.
+        self.callbacks.append(callback)
+
+reconcile_stats = {
+    "trees": 0,
+    "unchanged": 0,
+    "changes": 0,
+}
+
+def node_value_matches(current, wanted):
+    if isinstance(current, bpy.types.ID) or current is None:
+        if isinstance(wanted, str):
+            return current is not None and current.name == wanted
+        return current == wanted
+    if isinstance(current, str) or isinstance(wanted, str):
+        return current == wanted
+    if hasattr(current, "__len__"):
+        wanted = tuple(wanted) if hasattr(wanted, "__len__") else (wanted,) * len(current)
+        return len(current) == len(wanted) and all(abs(a - b) < 1e-6 for a, b in zip(current, wanted))
+    if isinstance(current, float):
+        return abs(current - wanted) < 1e-6
+    return current == wanted
+
+def set_node_value(owner, key, value):
+    if key == "node_tree" and isinstance(value, str):
+        value = bpy.data.node_groups.get(value)
+    if key == "image" and isinstance(value, str):
+        value = bpy.data.images.get(value)
+    setattr(owner, key, value)
+
+def group_socket_count(node_group):
+    if is_4_0_or_newer:
+        return len(node_group.interface.items_tree)
+    return len(node_group.inputs) + len(node_group.outputs)
+
+def group_interface_inputs(node_group):
+    if is_4_0_or_newer:
+        return {item.name: item for item in node_group.interface.items_tree if item.item_type == 'SOCKET' and item.in_out == 'INPUT'}
+    return {socket.name: socket for socket in node_group.inputs}
+
+def remove_unused_sockets(node_group, sockets):
+    wanted = {(name, input) for name, socket_type_key, input in sockets}
+    removed = 0
+    if is_4_0_or_newer:
+        for item in list(node_group.interface.items_tree):
+            if item.item_type == 'SOCKET' and (item.name, item.in_out == 'INPUT') not in wanted:
+                node_group.interface.remove(item)
+                removed += 1
+    else:
+        for group_sockets, input in ((node_group.inputs, True), (node_group.outputs, False)):
+            for socket in list(group_sockets):
+                if (socket.name, input) not in wanted:
+                    group_sockets.remove(socket)
+                    removed += 1
+    return removed
+
+def reconcile_tree(node_group, graph, keep = ()):
+    # Diffs the description against the tree and applies the minimal set of
+    # node, value and link changes. An unchanged description is a no-op, so
+    # the material is not recompiled.
+    changes = remove_unused_sockets(node_group, graph.sockets)
+    nodes = node_group.nodes
+    for name, socket_type_key, input in graph.sockets:
+        before = group_socket_count(node_group)
+        create_socket(node_group, name, socket_type_key, input)
+        changes += group_socket_count(node_group) - before
+
+    for node in list(nodes):
+        spec = graph.nodes.get(node.name)
+        if node.name in keep:
+            continue
+        if not spec or node.bl_idname != spec["type"]:
+            nodes.remove(node)
+            changes += 1
+
+    for name, spec in graph.nodes.items():
+        node = nodes.get(name)
+        if not node:
+            node = nodes.new(spec["type"])
+            node.name = name
+            changes += 1
+        for key, value in spec["props"].items():
+            if not node_value_matches(getattr(node, key), value):
+                set_node_value(node, key, value)
+                changes += 1
+        if not node_value_matches(node.location, spec["location"]):
+            node.location = spec["location"]
+        for index, socket_name in spec["renames"].items():
+            if node.inputs[index].name != socket_name:
+                node.inputs[index].name = socket_name
+                changes += 1
+        for socket, value in spec["inputs"].items():
+            try:
+                target = node.inputs[socket]
+            except (KeyError, IndexError):
+                continue
+            if hasattr(target, "default_value") and not node_value_matches(target.default_value, value):
+                target.default_value = value
+                changes += 1
+
+    wanted = {}
+    for from_node, from_socket, to_node, to_socket in graph.links:
+        try:
+            output = nodes[from_node].outputs[from_socket]
+            input = nodes[to_node].inputs[to_socket]
+        except (KeyError, IndexError):
+            continue
+        # A later link to the same input replaces the earlier one, like links.new().
+        wanted[(to_node, input.identifier)] = (output, input)
+    existing = {}
+    for link in list(node_group.links):
+        key = (link.to_node.name, link.to_socket.identifier)
+        output, input = wanted.get(key, (None, None))
+        if output and link.from_node == output.node and link.from_socket.identifier == output.identifier and key not in existing:
+            existing[key] = link
+        elif link.to_node.name not in keep and link.from_node.name not in keep:
+            node_group.links.remove(link)
+            changes += 1
+    for key, (output, input) in wanted.items():
+        if key not in existing:
+            node_group.links.new(output, input)
+            changes += 1
+
+    interface = group_interface_inputs(node_group)
+    for name, value in graph.interface_defaults.items():
+        item = interface.get(name)
+        if item and not node_value_matches(item.default_value, value):
+            item.default_value = value
+            changes += 1
+
+    for callback in graph.callbacks:
+        callback(node_group)
+
+    reconcile_stats["trees"] += 1
+    reconcile_stats["changes"] += changes
+    if not changes:
+        reconcile_stats["unchanged"] += 1
+    return changes
+
 def create_node(node_group, nodename, locx, locy, mode, operation):
     if not nodename or nodename == "None":
         return
@@ -6654,13 +8240,10 @@ def Note(node_group):
 
 def UnlitNode():
     part = get_material_collection()
-    name = "HAS_Unlit"
-    if name in bpy.data.node_groups:
-        node_group = bpy.data.node_groups[name]
-        clear_nodes_ignoring(node_group)
-    else:
-        node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
+    colorfix = bool(part and part.colorfix)
+    return static_node_group("HAS_Unlit", lambda node_group: build_unlit_group(node_group, colorfix), "colorfix" if colorfix else "")
 
+def build_unlit_group(node_group, colorfix):
     create_node_sockets_from_string(node_group, "<Color>(color), <Alpha>(float)","<Shader>(shader)")
     
     input_node = node_group.nodes.new(type='NodeGroupInput')
@@ -6684,7 +8267,7 @@ def UnlitNode():
     addshader.location = (50, 300)
 
     tree_links = node_group.links
-    if part.colorfix:
+    if colorfix:
         tree_links.new(input_node.outputs["Color"], emission.inputs[0])
     else:
         tree_links.new(input_node.outputs["Color"], fixtransp.inputs[1])
@@ -6697,7 +8280,6 @@ def UnlitNode():
     tree_links.new(emission.outputs[0], addshader.inputs[0])
     tree_links.new(transparent.outputs[0], addshader.inputs[1]) 
     tree_links.new(addshader.outputs[0], output_node.inputs[0])
-    return node_group
 
 def SetupMtl(material,part):
     if material.use_nodes is False:
@@ -6731,11 +8313,275 @@ def SetupMtl(material,part):
 
     return tree, shader_node, output_node
 
-def UpdateShader():
+shader_state = {
+    "full": True,
+    "dirty": set(),
+    "built": set(),
+    "folds": {},
+}
+
+def layer_fold_state(layer):
+    # How a layer can be left out of its channel chain: a "noop" layer changes
+    # neither color nor alpha, a "cover" layer is a plain opaque fill that
+    # overwrites everything below it.
+    if layer.layer_type in {"FOLDER", "PBR"} or not layer.use_layer:
+        return ""
+    if layer.opacity <= 0.0 and layer.blend_mode != "COMBNRM":
+        return "noop"
+    if (layer.opacity >= 1.0 and layer.blend_mode == "MIX" and not layer.resource.image
+            and not layer.mask and not any_contributing_filter(layer.filters)):
+        return "cover"
+    return ""
+
+def filter_fold_state(filter):
+    # Filters blended in at zero opacity are identities. Mapping has no
+    # blend, blur and snapshot replace the alpha regardless of opacity.
+    if filter.in_use and filter.opacity <= 0.0 and filter.name not in {"MAPPING", "BLUR", "SNAPSHOT"}:
+        return "noop"
+    return ""
+
+def any_contributing_filter(filters):
+    return any(filter.in_use and not filter_fold_state(filter) for filter in filters)
+
+@persistent
+def reset_fold_states(*args):
+    # Fold states mirror the node trees. After a load, undo or redo the trees
+    # are the ones stored with the properties, so derive the states again
+    # instead of keeping those of the trees that were replaced.
+    folds = shader_state["folds"]
+    folds.clear()
+    for part in getattr(bpy.context.scene, "material_props", ()):
+        for layer in get_layers(part.base_layers, part):
+            folds[layer.id] = layer_fold_state(layer)
+        for layer in part.layers:
+            for filter in layer.filters:
+                folds[filter.id] = filter_fold_state(filter)
+
+# Property callbacks queue their rebuilds here. Requests are deduplicated and
+# run once from a timer on the next idle tick; flush_updates() runs them
+# right away and is called before anything reads the node trees. Everything
+# pending belongs to one material set, the one active when it was queued.
+pending_updates = {
+    "set": None,
+    "layers": set(),
+    "filters": set(),
+    "shader": False,
+    "full": False,
+    "dirty": set(),
+    "compile": False,
+}
+
+def has_pending_updates():
+    return bool(pending_updates["layers"] or pending_updates["filters"] or pending_updates["dirty"] or pending_updates["shader"] or pending_updates["compile"])
+
+def claim_pending_updates():
+    # Work queued for another set is run against that set before queuing more.
+    part = get_material_collection()
+    name = part.name if part else None
+    if name != pending_updates["set"]:
+        if has_pending_updates():
+            flush_updates()
+        pending_updates["set"] = name
+
+@contextmanager
+def material_set_activated(part):
+    # The node builders work on the active set; make part the active one.
+    view_layer = bpy.context.scene.view_layers[0]
+    active = view_layer.objects.active
+    if active and part.material and active.active_material == part.material:
+        yield True
+        return
+    obj = bpy.data.objects.get(material_object_name(part))
+    slot = -1
+    if obj and part.material:
+        slot = next((index for index, item in enumerate(obj.material_slots) if item.material == part.material), -1)
+    if slot == -1:
+        yield False
+        return
+    index = obj.active_material_index
+    view_layer.objects.active = obj
+    obj.active_material_index = slot
+    try:
+        yield True
+    finally:
+        obj.active_material_index = index
+        view_layer.objects.active = active
+
+def request_layer_update(layer):
+    if layer:
+        claim_pending_updates()
+        pending_updates["layers"].add(layer.id)
+        schedule_updates()
+
+def request_filter_update(layer, multi = False):
+    if paint_focus_covers(layer):
+        # The filter is baked into the focus caches; rebake through the shader update.
+        request_shader_update(layer)
+    elif layer:
+        claim_pending_updates()
+        pending_updates["filters"].add((layer.id, multi))
+        schedule_updates()
+
+def request_shader_update(*layers, full = False):
+    claim_pending_updates()
+    pending_updates["shader"] = True
+    pending_updates["full"] = pending_updates["full"] or full
+    for layer in layers:
+        if layer:
+            pending_updates["dirty"].add(layer.id)
+    schedule_updates()
+
+# Slider drags touch the editable groups on every tick; the flat compiled
+# tree is rebuilt once they have been still this long.
+COMPILE_DEBOUNCE = 0.3
+
+def schedule_updates(delay = 0.0):
+    if not delay and not bpy.context.scene.other_props.defer_updates:
+        flush_updates()
+        return
+    if delay and (pending_updates["layers"] or pending_updates["filters"] or pending_updates["shader"]):
+        # Rebuilds already waiting go on the next tick and compile with them.
+        delay = 0.0
+    if bpy.app.timers.is_registered(flush_updates):
+        bpy.app.timers.unregister(flush_updates)
+    bpy.app.timers.register(flush_updates, first_interval=delay)
+
+def flush_updates():
+    if bpy.app.timers.is_registered(flush_updates):
+        bpy.app.timers.unregister(flush_updates)
+    layers = set(pending_updates["layers"])
+    filters = set(pending_updates["filters"])
+    shader = pending_updates["shader"]
+    full = pending_updates["full"]
+    dirty = set(pending_updates["dirty"])
+    recompile = pending_updates["compile"]
+    for key in ("layers", "filters", "dirty"):
+        pending_updates[key].clear()
+    pending_updates["shader"] = False
+    pending_updates["full"] = False
+    pending_updates["compile"] = False
+    if not (layers or filters or shader or dirty or recompile):
+        return None
+    part = find_material_collection(bpy.context.scene, pending_updates["set"]) if pending_updates["set"] else None
+    if part is None:
+        return None
+    with material_set_activated(part) as active:
+        if active:
+            run_updates(layers, filters, shader, full, dirty, recompile)
+    return None
+
+@persistent
+def flush_before_undo(*args):
+    flush_updates()
+
+def flushing_execute(execute):
+    # Undoable operators run the rebuilds they queued before Blender pushes
+    # the undo step, so the step holds node trees matching the properties.
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        result = execute(self, context)
+        flush_updates()
+        return result
+    wrapper.flushes_updates = True
+    return wrapper
+
+def run_updates(layers, filters, shader, full, dirty, recompile):
+    # Groups the shader update rebuilds anyway are not built twice.
+    if full:
+        layers.clear()
+        filters.clear()
+    layers -= dirty
+    filters = {(layer_id, multi) for layer_id, multi in filters if layer_id not in dirty and layer_id not in layers}
+    for layer_id, multi in filters:
+        layer_filter(get_layer_by_id(layer_id), multi = multi)
+    for layer_id in layers:
+        layer = get_layer_by_id(layer_id)
+        if layer and not rebuild_layer_group(layer):
+            shader = True
+            dirty.add(layer_id)
+    # A layer that starts or stops folding away changes its channel chain.
+    for layer_id in layers | {layer_id for layer_id, multi in filters}:
+        layer = get_layer_by_id(layer_id)
+        if layer and layer_id in shader_state["folds"] and shader_state["folds"][layer_id] != layer_fold_state(layer):
+            shader = True
+            dirty.add(layer_id)
+    if full:
+        UpdateShader()
+    elif shader:
+        UpdateLayers(*[get_layer_by_id(layer_id) for layer_id in dirty])
+    elif (recompile or layers or filters) and bpy.context.scene.other_props.compile_shader:
+        compile_active_material()
+
+def rebuild_layer_group(layer):
+    if layer.layer_type =="PBR":
+        create_pbr_nodegroup(layer)
+        return True
+    elif layer.layer_type =="FOLDER":
+        create_folder_nodegroup(layer)
+        return True
+    elif getlayergroupname(layer) in bpy.data.node_groups:
+        create_layer_node(layer)
+        return True
+    return False
+
+def UpdateLayers(*layers):
+    # Incremental UpdateShader(): only the groups of these layers (and the
+    # folders holding them) are rebuilt, every other layer group is reused
+    # and just relinked into the channel chains.
+    for layer in layers:
+        if layer:
+            shader_state["dirty"].add(layer.id)
+    UpdateShader(full = False)
+
+@profiled("UpdateShader")
+def UpdateShader(full = True):
+    shader_state["full"] = full
+    shader_state["built"].clear()
+    try:
+        update_shader_nodes()
+    finally:
+        shader_state["full"] = True
+        shader_state["dirty"].clear()
+        shader_state["built"].clear()
+
+def layer_is_dirty(layer):
+    return shader_state["full"] or layer.id in shader_state["dirty"]
+
+def layer_node_group(layer):
+    node_group = bpy.data.node_groups.get(getlayergroupname(layer))
+    if node_group and (layer.id in shader_state["built"] or not layer_is_dirty(layer)):
+        return node_group
+    shader_state["built"].add(layer.id)
+    return create_layer_node(layer)
+
+def folder_node_group(folder_layer):
+    node_group = bpy.data.node_groups.get(getlayergroupname(folder_layer))
+    if node_group and folder_layer.id in shader_state["built"]:
+        return node_group
+    if node_group and not layer_is_dirty(folder_layer):
+        if not any(layer_is_dirty(layer) for layer in get_layers(folder_layer.sub_layers)):
+            return node_group
+    shader_state["built"].add(folder_layer.id)
+    if folder_layer.layer_type == "PBR":
+        return create_pbr_nodegroup(folder_layer)
+    return create_folder_nodegroup(folder_layer)
+
+def owner_layer(prop):
+    path = prop.path_from_id()
+    while "." in path:
+        path = path.rsplit(".", 1)[0]
+        owner = prop.id_data.path_resolve(path)
+        if isinstance(owner, LayerProperties):
+            return owner
+    return None
+
+def update_shader_nodes():
     CheckForEmpty()
     fixorder()
     update_layer_index()
     create_normal_blend_group()
+    refresh_paint_focus(get_material_collection())
+    changes = reconcile_stats["changes"]
     matnode = hasmatnode()
 
     bpy.context.scene.other_props.layercombineactive = False
@@ -6749,6 +8595,17 @@ def UpdateShader():
         return
     mtl_n = material.name
 
+    otps = bpy.context.scene.other_props
+    shader_group = compile_material_group(part, matnode) if otps.compile_shader else matnode
+
+    # Nothing in the graph changed and the material wiring inputs are the
+    # same: relinking would only trigger a recompile.
+    material_key = (mtl_n, shader_group.name, otps.preview_mode, part.shader_type, part.opacity_mode, part.diffusealpha, tuple(getusedmaps()), typeexist("ALPHA"))
+    if (not shader_state["full"] and reconcile_stats["changes"] == changes
+            and shader_state.get("material_key") == material_key and get_node_by_name(material.node_tree, "HAS_Material_OO")):
+        return
+    shader_state["material_key"] = material_key
+
     tree, shader_node, output_node = SetupMtl(material, part)
     material.blend_method = part.opacity_mode
     tree_links = material.node_tree.links
@@ -6757,9 +8614,10 @@ def UpdateShader():
     if not group_node:
         group_node = tree.nodes.new('ShaderNodeGroup')
         group_node.location = shader_node.location - mathutils.Vector((300, 0))
-        group_node.node_tree = matnode
         group_node.name = "HAS_Material_OO"
         group_node.label = "HAS_Material"
+    if group_node.node_tree != shader_group:
+        group_node.node_tree = shader_group
     part.node = group_node.name
 
     for input in group_node.inputs:
@@ -6813,179 +8671,717 @@ def getsublayer(index):
     part = get_material_collection()
     return part.sublayers[index]
 
-def layersgroup(tex_type, name):
+def layersgroup(tex_type, name, below = False):
     
     part = get_material_collection()
     layers = get_layers(part.base_layers)
     group_name = getgroupname(tex_type[0], name)
+    # Paint focus: the "below" group holds only the layers under the focus
+    # layer and is what gets baked; the live group starts from that bake.
+    cache = None
+    if below:
+        group_name = f"{group_name}_Below"
+        layers = layers[:paint_focus["index"]]
+    elif tex_type[0] in paint_focus["caches"]:
+        cache = bpy.data.images.get(paint_focus["caches"][tex_type[0]])
     if group_name in bpy.data.node_groups:
         node_group = bpy.data.node_groups[group_name]
-        for nodei in  node_group.nodes:
-            node_group.nodes.remove(nodei)    
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=group_name)
 
-    Note(node_group)
-    group_output = node_group.nodes.new("NodeGroupOutput")
-    group_output.location = (500, 0)
-    group_input = node_group.nodes.new("NodeGroupInput")
-    group_input.location = (-500, 0)
+    graph = NodeGraph()
+    graph.note()
+    graph.node("Group Output", 'NodeGroupOutput', (500, 0))
+    graph.node("Group Input", 'NodeGroupInput', (-500, 0))
 
-    create_node_sockets_from_string(node_group, "<Color>(color), <Alpha>(float)","<Color>(color), <Alpha>(float)")
+    graph.sockets_from_string("<Color>(color), <Alpha>(float)","<Color>(color), <Alpha>(float)")
 
     count = -1
-
-    links = node_group.links
-    for link in links:
-        links.remove(link)
         
     prev_node = None
 
+    # Layers under the topmost opaque fill of this channel are never visible.
+    start = 0
+    for index, layer in enumerate(layers):
+        if tex_type[0] == layer.texture_type:
+            shader_state["folds"][layer.id] = layer_fold_state(layer)
+            if shader_state["folds"][layer.id] == "cover":
+                start = index
+    if cache and start <= paint_focus["index"]:
+        start = paint_focus["index"]
+        prev_node = graph_image_node(graph, cache, prefix = "Focus")
+
     for index, layer in enumerate(layers):
+        if index < start:
+            continue
         fldrlrs = getusedtypesinlayers(get_layers(layer.sub_layers))
 
         if layer.layer_type =="FOLDER" or layer.layer_type =="PBR":
             if layer.use_layer and tex_type[0] in fldrlrs:
                 count = count+1
 
-                l_group = get_folder_nodegroup(layer, pbr = layer.layer_type =="PBR")
+                l_group = folder_node_group(layer)
 
-                layer_node = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", l_group.name)
+                layer_node = graph.node(f"Layer_{layer.id}", 'ShaderNodeGroup', (-200, count*-200), node_tree=l_group.name)
 
-                if prev_node:
-                    links.new(prev_node.outputs['Color'], layer_node.inputs['Color'])
-                    links.new(prev_node.outputs['Alpha'], layer_node.inputs['Alpha'])
-                else:
-                    links.new(group_input.outputs['Color'], layer_node.inputs['Color'])
-                    links.new(group_input.outputs['Alpha'], layer_node.inputs['Alpha'])
+                graph.link(prev_node or "Group Input", 'Color', layer_node, 'Color')
+                graph.link(prev_node or "Group Input", 'Alpha', layer_node, 'Alpha')
                 
-                set_default(layer_node, "Type", fldrlrs.index(tex_type[0]))
+                graph.default(layer_node, "Type", fldrlrs.index(tex_type[0]))
                 prev_node = layer_node
         
         else:
-            if layer.use_layer and tex_type[0]==layer.texture_type:
+            if layer.use_layer and tex_type[0]==layer.texture_type and shader_state["folds"][layer.id] != "noop":
 
                 count = count+1
                 
-                l_group = create_layer_node(layer)
-                layer_node = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", l_group.name)
+                l_group = layer_node_group(layer)
+                layer_node = graph.node(f"Layer_{layer.id}", 'ShaderNodeGroup', (-200, count*-200), node_tree=l_group.name)
 
-                if prev_node:
-                    links.new(prev_node.outputs['Color'], layer_node.inputs['Color'])
-                    links.new(prev_node.outputs['Alpha'], layer_node.inputs['Alpha'])
-                else:
-                    links.new(group_input.outputs['Color'], layer_node.inputs['Color'])
-                    links.new(group_input.outputs['Alpha'], layer_node.inputs['Alpha'])
+                graph.link(prev_node or "Group Input", 'Color', layer_node, 'Color')
+                graph.link(prev_node or "Group Input", 'Alpha', layer_node, 'Alpha')
                 prev_node = layer_node
 
     if prev_node:
-        links.new(prev_node.outputs['Color'], group_output.inputs['Color'])
-        links.new(prev_node.outputs['Alpha'], group_output.inputs['Alpha'])
-        if part.InvertG:
+        graph.link(prev_node, 'Color', "Group Output", 'Color')
+        graph.link(prev_node, 'Alpha', "Group Output", 'Alpha')
+        if part.InvertG and not below:
             if tex_type[0] == "NORMAL":
-                invnrmnode = create_node(node_group,'ShaderNodeGroup', -200,count*-200, "cus", InvertNormalNode().name)
-                if invnrmnode:
-                    links.new(prev_node.outputs['Color'], invnrmnode.inputs['Normal'])
-                    links.new(invnrmnode.outputs['Normal'], group_output.inputs['Color'])
-        if part.colorfix and tex_type[0] == "DIFFUSE" and part.diffusealpha and not part.shader_type == "UNLIT":
-            Colfix = create_node(node_group,'ShaderNodeMixRGB', -200,0, "mix", 'DIVIDE')
-            set_default(Colfix, 0, 1.0)
-            links.new(prev_node.outputs['Color'], Colfix.inputs[1])
-            links.new(prev_node.outputs['Alpha'], Colfix.inputs[2])
-            links.new(Colfix.outputs[0], group_output.inputs['Color'])
+                invnrmnode = graph.node("InvertNormal", 'ShaderNodeGroup', (-200, count*-200), node_tree=InvertNormalNode().name)
+                graph.link(prev_node, 'Color', invnrmnode, 'Normal')
+                graph.link(invnrmnode, 'Normal', "Group Output", 'Color')
+        if part.colorfix and tex_type[0] == "DIFFUSE" and part.diffusealpha and not part.shader_type == "UNLIT" and not below:
+            Colfix = graph.node("ColorFix", 'ShaderNodeMixRGB', (-200, 0), blend_type='DIVIDE')
+            graph.default(Colfix, 0, 1.0)
+            graph.link(prev_node, 'Color', Colfix, 1)
+            graph.link(prev_node, 'Alpha', Colfix, 2)
+            graph.link(Colfix, 0, "Group Output", 'Color')
     else:
-        links.new(group_input.outputs['Color'], group_output.inputs['Color'])
-        links.new(group_input.outputs['Alpha'], group_output.inputs['Alpha'])
+        graph.link("Group Input", 'Color', "Group Output", 'Color')
+        graph.link("Group Input", 'Alpha', "Group Output", 'Alpha')
 
+    reconcile_tree(node_group, graph)
 
     return node_group
 
+@profiled("hasmatnode")
 def hasmatnode():
     part = get_material_collection()
     name = getmaterialgroupname(part)
     if name in bpy.data.node_groups:
         node_group = bpy.data.node_groups[name]
-        node_group.nodes.clear()
     else:
         node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
 
-    links = node_group.links
+    graph = NodeGraph()
 
     usedtypes = getusedtypes()
-    Note(node_group)
-    input_node = node_group.nodes.new(type='NodeGroupInput')
-    input_node.location = (-500, 0)
-    output_node = node_group.nodes.new(type='NodeGroupOutput')
-    output_node.location = (500, 0)
+    graph.note()
+    input_node = graph.node("Group Input", 'NodeGroupInput', (-500, 0))
+    output_node = graph.node("Group Output", 'NodeGroupOutput', (500, 0))
     hsocketout = None
     nrmsocketout = None
     for layer in part.layers:
-        if layer.layer_type =="FOLDER":
-            create_folder_nodegroup(layer)
-        elif layer.layer_type =="PBR":
-            create_pbr_nodegroup(layer)
+        if layer.layer_type in {"FOLDER", "PBR"}:
+            folder_node_group(layer)
+
+    # Channels the material does not use keep their sockets but get no
+    # layer chain, their defaults pass straight through.
+    active = {type[0] for type in getusedmaps()}
+    if typeexist("ALPHA"):
+        active.add("ALPHA")
 
     for indexgr, tex_type in enumerate(TEXTURE_TYPE):
 
-        lgroup = layersgroup(tex_type, name)
-        
-        group_node = node_group.nodes.new('ShaderNodeGroup')
-        group_node.node_tree = lgroup
-        group_node.location = (0,-200*indexgr)
         type = tex_type[0]
         nm = tex_type[1]
         anm = f'{nm}Alpha'
-        create_node_sockets_from_string(node_group, f"<{nm}>(color), <{anm}>(float)",f"<{nm}>(color), <{anm}>(float)")
-        if not group_node.outputs or not group_node.inputs:
-            continue
-        links.new(group_node.outputs['Color'], output_node.inputs[nm])
-        links.new(group_node.outputs['Alpha'], output_node.inputs[anm])
-        links.new(input_node.outputs[nm], group_node.inputs['Color'])
-        links.new(input_node.outputs[anm], group_node.inputs['Alpha'])
+        graph.sockets_from_string(f"<{nm}>(color), <{anm}>(float)",f"<{nm}>(color), <{anm}>(float)")
+        if type in active:
+            lgroup = layersgroup(tex_type, name)
+            group_node = graph.node(f"{type}_Group", 'ShaderNodeGroup', (0, -200*indexgr), node_tree=lgroup.name)
+            graph.link(group_node, 'Color', output_node, nm)
+            graph.link(group_node, 'Alpha', output_node, anm)
+            graph.link(input_node, nm, group_node, 'Color')
+            graph.link(input_node, anm, group_node, 'Alpha')
+        else:
+            group_node = None
+            graph.link(input_node, nm, output_node, nm)
+            graph.link(input_node, anm, output_node, anm)
 
         if type == "ROUGHNESS":
-            set_default(node_group, "Roughness", (0.9,0.9,0.9,1.0))
+            graph.interface_default("Roughness", (0.9,0.9,0.9,1.0))
         if type == "HEIGHT":
-            hsocketout = group_node.outputs['Color']
-            set_default(node_group, "Height", (0.5,0.5,0.5,1.0))
+            hsocketout = group_node
+            graph.interface_default("Height", (0.5,0.5,0.5,1.0))
         if type == "NORMAL":
-            nrmsocketout = group_node.outputs['Color']
-            set_default(node_group, "Normal", (0.5,0.5,1.0,1.0))
+            nrmsocketout = group_node
+            graph.interface_default("Normal", (0.5,0.5,1.0,1.0))
         if type == "DIFFUSE":
-            set_default(node_group, "Diffuse", (0.0,0.0,0.0,1.0))
+            graph.interface_default("Diffuse", (0.0,0.0,0.0,1.0))
         if type == "ALPHA":
-            set_default(node_group, "Alpha", (1.0,1.0,1.0,1.0))
+            graph.interface_default("Alpha", (1.0,1.0,1.0,1.0))
         if not type == "DIFFUSE":
-            set_default(node_group, anm, 1.0)
+            graph.interface_default(anm, 1.0)
 
-    create_socket(node_group, "RawNormal", 'Color', False)
+    graph.socket("RawNormal", 'Color', False)
     if nrmsocketout:
-        links.new(nrmsocketout, output_node.inputs["RawNormal"])
+        graph.link(nrmsocketout, 'Color', output_node, "RawNormal")
     
+    outputs = {socket[0] for socket in graph.sockets if not socket[2]}
     for type in getusedmaps():
         nm = type[1]
         anm = f'{nm}Alpha'
-        if nm in output_node.inputs:
-            if not input_node.outputs[nm].is_linked:
-                links.new(input_node.outputs[nm], output_node.inputs[nm])
-                links.new(input_node.outputs[anm], output_node.inputs[anm])
+        if nm in outputs:
+            if not graph.is_linked(input_node, nm):
+                graph.link(input_node, nm, output_node, nm)
+                graph.link(input_node, anm, output_node, anm)
         
     if nrmsocketout or hsocketout:
-        bump = node_group.nodes.new(type='ShaderNodeBump')
-        set_default(bump, 0, part.height_intensity)
-        bump.location = (500,-700)
-        nrmap = node_group.nodes.new(type='ShaderNodeNormalMap')
-        nrmap.location = (200,-500)
+        bump = graph.node("Bump", 'ShaderNodeBump', (500, -700))
+        graph.default(bump, 0, part.height_intensity)
+        nrmap = graph.node("NormalMap", 'ShaderNodeNormalMap', (200, -500))
         if nrmsocketout:
-            links.new(nrmsocketout, nrmap.inputs['Color'])
-            links.new(nrmap.outputs[0], bump.inputs['Normal'])
+            graph.link(nrmsocketout, 'Color', nrmap, 'Color')
+            graph.link(nrmap, 0, bump, 'Normal')
         if hsocketout:
-            links.new(hsocketout, bump.inputs['Height'])
+            graph.link(hsocketout, 'Color', bump, 'Height')
+
+        graph.link(bump, 0, output_node, 'Normal')
 
-        links.new(bump.outputs[0], output_node.inputs['Normal'])
+    reconcile_tree(node_group, graph)
 
     return node_group 
 
+def getcompiledgroupname(part):
+    return f".HAS_{part.material.name}_Compiled"
+
+# Node props that only describe how the node looks in the editor.
+COMPILE_SKIP_PROPS = {"name", "label", "location", "width", "width_hidden", "height", "select", "show_options",
+    "show_preview", "show_texture", "hide", "mute", "parent", "use_custom_color", "color", "node_tree", "is_active_output"}
+
+compile_stats = {
+    "source_nodes": 0,
+    "source_samples": 0,
+    "groups": 0,
+    "depth": 0,
+    "nodes": 0,
+    "samples": 0,
+    "folded": 0,
+    "shared": 0,
+    "time": 0.0,
+}
+CURVE_NODES = {'ShaderNodeRGBCurve', 'ShaderNodeVectorCurve', 'ShaderNodeFloatCurve', 'ShaderNodeValToRGB'}
+compile_report = {}
+
+def node_settings(node):
+    props = {}
+    for prop in node.bl_rna.properties:
+        key = prop.identifier
+        if prop.is_readonly or key in COMPILE_SKIP_PROPS or key.startswith("bl_"):
+            continue
+        if prop.type == 'ENUM' and prop.is_enum_flag:
+            continue
+        if prop.type not in {'BOOLEAN', 'INT', 'FLOAT', 'ENUM', 'STRING', 'POINTER'}:
+            continue
+        value = getattr(node, key)
+        if prop.type == 'POINTER' and not isinstance(value, bpy.types.ID):
+            continue
+        if hasattr(value, "__len__") and not isinstance(value, str):
+            value = tuple(value)
+        props[key] = value
+    return props
+
+def copy_node_curves(source, target):
+    # Curve and ramp points are not plain props, copy them when they differ.
+    mapping = getattr(source, "mapping", None)
+    if mapping and hasattr(mapping, "curves"):
+        changed = False
+        for src, dst in zip(mapping.curves, target.mapping.curves):
+            wanted = [(tuple(p.location), p.handle_type) for p in src.points]
+            if [(tuple(p.location), p.handle_type) for p in dst.points] == wanted:
+                continue
+            while len(dst.points) > len(wanted):
+                dst.points.remove(dst.points[-1])
+            while len(dst.points) < len(wanted):
+                dst.points.new(0.5, 0.5)
+            for point, (location, handle_type) in zip(dst.points, wanted):
+                point.location = location
+                point.handle_type = handle_type
+            changed = True
+        if changed:
+            target.mapping.update()
+    ramp = getattr(source, "color_ramp", None)
+    if ramp:
+        dst = target.color_ramp
+        for key in ("interpolation", "color_mode", "hue_interpolation"):
+            if getattr(dst, key) != getattr(ramp, key):
+                setattr(dst, key, getattr(ramp, key))
+        wanted = [(e.position, tuple(e.color)) for e in ramp.elements]
+        if [(e.position, tuple(e.color)) for e in dst.elements] != wanted:
+            while len(dst.elements) > len(wanted):
+                dst.elements.remove(dst.elements[-1])
+            while len(dst.elements) < len(wanted):
+                dst.elements.new(0.5)
+            for element, (position, color) in zip(dst.elements, wanted):
+                element.position = position
+                element.color = color
+
+def socket_value(socket):
+    if not hasattr(socket, "default_value"):
+        return None
+    value = socket.default_value
+    return tuple(value) if hasattr(value, "__len__") else value
+
+def coerce_value(value, socket):
+    # Same implicit conversions Blender applies between linked sockets.
+    current = socket.default_value
+    if hasattr(current, "__len__"):
+        if not hasattr(value, "__len__"):
+            value = (value, value, value, 1.0)
+        value = tuple(value[:len(current)]) + (1.0,) * (len(current) - len(value))
+        return value
+    if hasattr(value, "__len__"):
+        if len(value) >= 4:
+            return value[0] * 0.2126 + value[1] * 0.7152 + value[2] * 0.0722
+        return sum(value) / len(value)
+    return value
+
+def fold_math(operation, a, b, c):
+    if operation == 'ADD':
+        return a + b
+    if operation == 'SUBTRACT':
+        return a - b
+    if operation == 'MULTIPLY':
+        return a * b
+    if operation == 'DIVIDE':
+        return a / b if b else 0.0
+    if operation == 'MAXIMUM':
+        return max(a, b)
+    if operation == 'MINIMUM':
+        return min(a, b)
+    if operation == 'COMPARE':
+        return 1.0 if abs(a - b) <= max(c, 1e-5) else 0.0
+    if operation == 'GREATER_THAN':
+        return 1.0 if a > b else 0.0
+    if operation == 'LESS_THAN':
+        return 1.0 if a < b else 0.0
+    return None
+
+def compiled_node_name(path, name):
+    # Node names are capped at 63 characters, the instance path goes in a hash.
+    return f"{name[:48]}.{zlib.crc32(path.encode()):08x}"
+
+class MaterialCompiler:
+    # Lowers the nested material, layer, folder and filter groups into one
+    # flat NodeGraph. Sources are resolved backwards from the outputs, so only
+    # nodes that reach an output are emitted, and type switches or mixes with
+    # a constant factor are folded into a direct connection.
+    def __init__(self):
+        self.graph = NodeGraph()
+        self.sources = {}
+        self.frames = {}
+        self.curves = []
+        self.emitted = {}
+        self.shared = {}
+        self.stats = {"source_nodes": 0, "source_samples": 0, "groups": 0, "depth": 0, "nodes": 0, "samples": 0, "folded": 0, "shared": 0}
+
+    def frame(self, node_group, path, inputs, depth):
+        links = {}
+        for link in node_group.links:
+            if link.is_valid and not link.is_muted:
+                links[link.to_socket.as_pointer()] = link
+        self.stats["groups"] += 1
+        self.stats["source_nodes"] += len(node_group.nodes)
+        self.stats["source_samples"] += sum(1 for node in node_group.nodes if node.bl_idname == 'ShaderNodeTexImage')
+        self.stats["depth"] = max(self.stats["depth"], depth)
+        return {"tree": node_group, "path": path, "inputs": inputs, "links": links, "depth": depth}
+
+    def group_frame(self, frame, node):
+        path = f"{frame['path']}/{node.name}"
+        if path not in self.frames:
+            inputs = {socket.identifier: ("lazy", frame, socket) for socket in node.inputs}
+            self.frames[path] = self.frame(node.node_tree, path, inputs, frame["depth"] + 1)
+        return self.frames[path]
+
+    def input_source(self, frame, socket):
+        link = frame["links"].get(socket.as_pointer())
+        if link:
+            return self.output_source(frame, link.from_node, link.from_socket)
+        return ("value", socket_value(socket))
+
+    def output_source(self, frame, node, socket):
+        key = (frame["path"], socket.as_pointer())
+        if key not in self.sources:
+            self.sources[key] = self.resolve(frame, node, socket)
+        return self.sources[key]
+
+    def resolve(self, frame, node, socket):
+        if node.type == 'GROUP_INPUT':
+            source = frame["inputs"].get(socket.identifier, ("value", None))
+            if source[0] == "lazy":
+                return self.input_source(source[1], source[2])
+            return source
+        if node.type == 'REROUTE':
+            return self.input_source(frame, node.inputs[0])
+        if node.mute:
+            for link in node.internal_links:
+                if link.to_socket.as_pointer() == socket.as_pointer():
+                    return self.input_source(frame, link.from_socket)
+            return ("value", None)
+        if node.type == 'GROUP':
+            if not node.node_tree:
+                return ("value", None)
+            child = self.group_frame(frame, node)
+            output = next((n for n in node.node_tree.nodes if n.type == 'GROUP_OUTPUT' and n.is_active_output), None)
+            if output:
+                for target in output.inputs:
+                    if target.identifier == socket.identifier:
+                        return self.input_source(child, target)
+            return ("value", None)
+        folded = self.fold(frame, node)
+        if folded:
+            self.stats["folded"] += 1
+            return folded
+        index = [s.as_pointer() for s in node.outputs].index(socket.as_pointer())
+        return ("socket", self.emit(frame, node), index)
+
+    def fold(self, frame, node):
+        if node.bl_idname == 'ShaderNodeMath' and len(node.outputs) == 1:
+            values = [self.input_source(frame, socket) for socket in list(node.inputs)[:3]]
+            if all(kind == "value" and isinstance(value, float) for kind, value in values):
+                result = fold_math(node.operation, *[value for kind, value in values])
+                if result is not None:
+                    return ("value", clamp(result, 0.0, 1.0) if node.use_clamp else result)
+        elif node.bl_idname == 'ShaderNodeMixRGB':
+            kind, fac = self.input_source(frame, node.inputs[0])
+            if kind != "value" or not isinstance(fac, float):
+                return None
+            if fac <= 0.0:
+                source = self.input_source(frame, node.inputs[1])
+            elif fac >= 1.0 and node.blend_type == 'MIX':
+                source = self.input_source(frame, node.inputs[2])
+            else:
+                return None
+            if source[0] == "value" and source[1] is not None:
+                value = source[1] if hasattr(source[1], "__len__") else (source[1],) * 3 + (1.0,)
+                if node.use_clamp:
+                    value = tuple(clamp(v, 0.0, 1.0) for v in value)
+                return ("value", value)
+            if source[0] == "socket" and not node.use_clamp:
+                return source
+        return None
+
+    def emit(self, frame, node):
+        key = (frame["path"], node.as_pointer())
+        if key in self.emitted:
+            return self.emitted[key]
+        settings = node_settings(node)
+        inputs = []
+        for target in node.inputs:
+            source = self.input_source(frame, target)
+            if source[0] == "value":
+                value = source[1] if hasattr(target, "default_value") else None
+                source = ("value", coerce_value(value, target) if value is not None else None)
+            inputs.append(source)
+
+        # Identical nodes fed by identical sources are emitted once, so the
+        # same texture sampled by several layers or channels is fetched once.
+        signature = (node.bl_idname, tuple(sorted((k, repr(v)) for k, v in settings.items())), repr(inputs))
+        if node.bl_idname in CURVE_NODES:
+            signature += (key,)
+        name = self.shared.get(signature)
+        if name:
+            self.stats["shared"] += 1
+        else:
+            name = compiled_node_name(frame["path"], node.name)
+            location = (node.location[0] - 1200 * frame["depth"], node.location[1])
+            self.graph.node(name, node.bl_idname, location, **settings)
+            if node.bl_idname in CURVE_NODES:
+                self.curves.append((node, name))
+            if node.bl_idname == 'ShaderNodeTexImage':
+                self.stats["samples"] += 1
+            for index, source in enumerate(inputs):
+                if source[0] == "socket":
+                    self.graph.link(source[1], source[2], name, index)
+                elif source[1] is not None:
+                    self.graph.default(name, index, source[1])
+            self.shared[signature] = name
+        self.emitted[key] = name
+        return name
+
+def group_interface_sockets(node_group):
+    socket_type_keys = {
+        'NodeSocketFloat': 'float',
+        'NodeSocketColor': 'color',
+        'NodeSocketVector': 'vector',
+        'NodeSocketShader': 'shader',
+    }
+    if is_4_0_or_newer:
+        items = [item for item in node_group.interface.items_tree if item.item_type == 'SOCKET']
+        return [(item.name, socket_type_keys.get(item.socket_type, 'color'), item.in_out == 'INPUT') for item in items]
+    sockets = [(socket.name, socket_type_keys.get(socket.bl_socket_idname, 'color'), True) for socket in node_group.inputs]
+    return sockets + [(socket.name, socket_type_keys.get(socket.bl_socket_idname, 'color'), False) for socket in node_group.outputs]
+
+def compile_material_group(part, node_group):
+    # Builds the flat counterpart of the editable material group. It is
+    # derived from the editable groups only, so any change there just needs
+    # another compile, which reconcile_tree() keeps down to what differs.
+    start = time.perf_counter()
+    name = getcompiledgroupname(part)
+    compiled = bpy.data.node_groups.get(name)
+    if not compiled:
+        compiled = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
+
+    compiler = MaterialCompiler()
+    graph = compiler.graph
+    graph.note()
+    for socket in group_interface_sockets(node_group):
+        graph.socket(*socket)
+    for socket_name, item in group_interface_inputs(node_group).items():
+        value = socket_value(item)
+        if value is not None:
+            graph.interface_default(socket_name, value)
+    graph.node("Group Input", 'NodeGroupInput', (-1500, 0))
+    graph.node("Group Output", 'NodeGroupOutput', (500, 0))
+
+    input_node = next((n for n in node_group.nodes if n.type == 'GROUP_INPUT'), None)
+    inputs = {}
+    if input_node:
+        inputs = {socket.identifier: ("socket", "Group Input", socket.name) for socket in input_node.outputs if socket.name}
+    top = compiler.frame(node_group, "", inputs, 0)
+    output_node = next((n for n in node_group.nodes if n.type == 'GROUP_OUTPUT' and n.is_active_output), None)
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 20000))
+    try:
+        for socket in (output_node.inputs if output_node else ()):
+            if not socket.name:
+                continue
+            source = compiler.input_source(top, socket)
+            if source[0] == "socket":
+                graph.link(source[1], source[2], "Group Output", socket.name)
+            elif source[1] is not None and hasattr(socket, "default_value"):
+                graph.default("Group Output", socket.name, coerce_value(source[1], socket))
+    finally:
+        sys.setrecursionlimit(limit)
+
+    curves = list(compiler.curves)
+    graph.after(lambda tree: [copy_node_curves(source, tree.nodes[target]) for source, target in curves])
+    reconcile_tree(compiled, graph)
+
+    compile_stats.update(compiler.stats)
+    compile_stats["nodes"] = len(graph.nodes)
+    compile_stats["time"] = time.perf_counter() - start
+    return compiled
+
+def compile_active_material():
+    part = get_material_collection()
+    if not part or not part.material:
+        return None
+    node_group = bpy.data.node_groups.get(getmaterialgroupname(part))
+    if not node_group:
+        return None
+    return compile_material_group(part, node_group)
+
+@persistent
+def watch_compiled_shader(scene, depsgraph):
+    # Sliders write straight into the editable groups; every update pushes
+    # the recompile back so a drag compiles once, after it stops.
+    other_props = getattr(scene, "other_props", None)
+    if not other_props or not other_props.compile_shader:
+        return
+    for update in depsgraph.updates:
+        tree = update.id
+        if isinstance(tree, bpy.types.ShaderNodeTree) and "HAS_" in tree.name and not tree.name.endswith("_Compiled"):
+            claim_pending_updates()
+            pending_updates["compile"] = True
+            schedule_updates(COMPILE_DEBOUNCE)
+            return
+
+# Paint focus: while painting, the layers under the selected one are baked
+# into one cache texture per channel and the channel chains start from it.
+paint_focus = {
+    "index": 0,
+    "caches": {},
+    "keys": {},
+    "watch": set(),
+    "versions": {},
+    "suspended": False,
+    "below": set(),
+    "pending": None,
+}
+
+def paint_focus_covers(layer):
+    # Layers baked into the focus caches only show socket edits after a rebake.
+    return bool(layer) and layer.id in paint_focus["below"]
+
+def paint_focus_layers(part):
+    # Top level layers under the selected layer, or under the folder holding it.
+    selected = get_layer_by_id(part.selected_layer)
+    if not selected:
+        return []
+    target = selected.attachedto or selected.id
+    layers = get_layers(part.base_layers)
+    for index, layer in enumerate(layers):
+        if layer.id == target:
+            return layers[:index]
+    return []
+
+def paint_focus_image_name(part, channel):
+    return f".HAS_{part.material.name}_{channel}_Focus"
+
+def paint_focus_key(part, layers, channel, images):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{channel}:{part.texture_sizeX}x{part.texture_sizeY}:{part.uvs}:{part.texture_filtering};".encode())
+    for layer in layers:
+        if layer.layer_type in {"FOLDER", "PBR"} or layer.texture_type == channel:
+            hash_properties(hasher, layer, images)
+            for sub_layer in get_layers(layer.sub_layers):
+                hash_properties(hasher, sub_layer, images)
+    return hasher.hexdigest()
+
+def bake_paint_focus(part, tex_types):
+    matnode = bpy.data.node_groups.get(getmaterialgroupname(part))
+    defaults = group_interface_inputs(matnode) if matnode else {}
+    basescene = active_scene()
+    bake_scene, material, plane, output_node, colorfix, alphasocket, camera = setup_bake_scene(basescene, part)
+    tree = material.node_tree
+    try:
+        for tex_type in tex_types:
+            nm = tex_type[1]
+            group_node = tree.nodes.new('ShaderNodeGroup')
+            group_node.node_tree = layersgroup(tex_type, getmaterialgroupname(part), below = True)
+            for socket, default in (("Color", nm), ("Alpha", f"{nm}Alpha")):
+                if default in defaults:
+                    set_default(group_node, socket, socket_value(defaults[default]))
+            tree.links.new(group_node.outputs['Color'], colorfix.inputs[1])
+            tree.links.new(group_node.outputs['Alpha'], colorfix.inputs[2])
+            tree.links.new(group_node.outputs['Alpha'], alphasocket)
+
+            name = paint_focus_image_name(part, tex_type[0])
+            # Normal and height are data; 8 bit sRGB would band them.
+            data = tex_type[0] in {"NORMAL", "HEIGHT"}
+            image = bpy.data.images.get(name)
+            if image and image.is_float != data:
+                bpy.data.images.remove(image)
+                image = None
+            if not image:
+                image = bpy.data.images.new(name, part.texture_sizeX, part.texture_sizeY, alpha=True, float_buffer=data)
+                image.alpha_mode = 'CHANNEL_PACKED'
+                image.colorspace_settings.name = 'Non-Color' if data else 'sRGB'
+            render_image(bake_scene, image, linear = data)
+            tree.nodes.remove(group_node)
+    finally:
+        cleanup_bake_scene(bake_scene, material, plane)
+        set_active_scene(basescene)
+
+def refresh_paint_focus(part):
+    # Points the chains at the caches that are current and queues a bake for
+    # the channels whose layers below changed; those read the full stack
+    # until the bake lands. Without focus the caches are dropped.
+    otps = bpy.context.scene.other_props
+    layers = paint_focus_layers(part) if otps.paint_focus and not paint_focus["suspended"] else []
+    caches = {}
+    stale = []
+    keys = {}
+    if layers:
+        images = {image.name: f"v{paint_focus['versions'].get(image.name, 0)}" for image in bpy.data.images}
+        for tex_type in getusedmaps():
+            channel = tex_type[0]
+            if not any(layer.use_layer and (layer.layer_type in {"FOLDER", "PBR"} or layer.texture_type == channel) for layer in layers):
+                continue
+            keys[channel] = paint_focus_key(part, layers, channel, images)
+            if keys[channel] != paint_focus["keys"].get(channel) or paint_focus_image_name(part, channel) not in bpy.data.images:
+                stale.append(tex_type)
+            else:
+                caches[channel] = paint_focus_image_name(part, channel)
+    paint_focus["index"] = len(layers)
+    paint_focus["pending"] = {"set": part.name, "types": stale, "keys": {tex_type[0]: keys[tex_type[0]] for tex_type in stale}} if stale else None
+    if stale and not bpy.app.timers.is_registered(bake_pending_paint_focus):
+        bpy.app.timers.register(bake_pending_paint_focus, first_interval=0.0)
+    if not paint_focus["suspended"]:
+        for channel in set(paint_focus["keys"]) - set(keys):
+            image = bpy.data.images.get(paint_focus_image_name(part, channel))
+            if image:
+                bpy.data.images.remove(image)
+        paint_focus["keys"] = {channel: key for channel, key in paint_focus["keys"].items() if channel in keys}
+    paint_focus["caches"] = caches
+
+    watch = set()
+    below = set()
+    for layer in layers:
+        for item in [layer] + get_layers(layer.sub_layers):
+            below.add(item.id)
+            if item.resource.image:
+                watch.add(item.resource.image.name)
+            for filter in item.filters:
+                if filter.resource.image:
+                    watch.add(filter.resource.image.name)
+    paint_focus["watch"] = watch
+    paint_focus["below"] = below
+
+def bake_pending_paint_focus():
+    # Runs from its own timer so the bake, and the flush setup_bake_scene
+    # does, never happen inside a shader update.
+    flush_updates()
+    pending = paint_focus["pending"]
+    paint_focus["pending"] = None
+    if not pending or paint_focus["suspended"] or not bpy.context.scene.other_props.paint_focus:
+        return None
+    part = get_material_collection()
+    if not part or part.name != pending["set"]:
+        return None
+    bake_paint_focus(part, pending["types"])
+    paint_focus["keys"].update(pending["keys"])
+    request_shader_update()
+    return None
+
+@contextmanager
+def paint_focus_suspended():
+    # Exports and combines read the full stack, not the 8 bit caches.
+    if not paint_focus["caches"]:
+        yield
+        return
+    paint_focus["suspended"] = True
+    UpdateShader(full = False)
+    try:
+        yield
+    finally:
+        paint_focus["suspended"] = False
+        request_shader_update()
+
+@persistent
+def reset_paint_focus(*args):
+    # The focus caches are generated images, a loaded file brings them back
+    # blank under the same names; forget the keys so they are baked again.
+    if bpy.app.timers.is_registered(bake_pending_paint_focus):
+        bpy.app.timers.unregister(bake_pending_paint_focus)
+    paint_focus["index"] = 0
+    paint_focus["caches"] = {}
+    paint_focus["keys"] = {}
+    paint_focus["watch"] = set()
+    paint_focus["versions"] = {}
+    paint_focus["below"] = set()
+    paint_focus["pending"] = None
+    scene = bpy.context.scene
+    if scene and scene.other_props.paint_focus and not bpy.app.timers.is_registered(request_shader_update):
+        # Chains saved against a cache read the full stack until the rebake.
+        bpy.app.timers.register(request_shader_update, first_interval=0.0)
+
+@persistent
+def watch_paint_focus(scene, depsgraph):
+    # Edits to images under the focus layer invalidate the caches.
+    if not paint_focus["watch"]:
+        return
+    changed = False
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Image) and update.id.name in paint_focus["watch"]:
+            paint_focus["versions"][update.id.name] = paint_focus["versions"].get(update.id.name, 0) + 1
+            changed = True
+    if changed:
+        request_shader_update()
+
 def update_layer_index():
     for ind, l in enumerate(get_material_collection().layers):
         l.index = ind
@@ -7004,14 +9400,10 @@ def check_mtl_used():
     return False 
 
 def mapping():
-    node_group = None
-    name = '.HAS_Mapping'
-    if name in bpy.data.node_groups:
-        node_group = bpy.data.node_groups[name]
-        return node_group
-    if not node_group:
-        node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
-        create_node_sockets_from_string(node_group, "<Offset X>(float),<Offset Y>(float),<Scale X>(float),<Scale Y>(float),<Rotation>(float)","<Mapping>(Vector)")
+    return static_node_group('.HAS_Mapping', build_mapping_group)
+
+def build_mapping_group(node_group):
+    create_node_sockets_from_string(node_group, "<Offset X>(float),<Offset Y>(float),<Scale X>(float),<Scale Y>(float),<Rotation>(float)","<Mapping>(Vector)")
     links = node_group.links
     input_node = node_group.nodes.new(type='NodeGroupInput')
     input_node.location = (-500, 0)
@@ -7040,15 +9432,9 @@ def mapping():
     links.new(combxyzr.outputs[0],mapping.inputs[2])
     links.new(combxyzs.outputs[0],mapping.inputs[3])
 
-    links.new(combxyzl.outputs[0],mapping.inputs[1])
-    links.new(combxyzr.outputs[0],mapping.inputs[2])
-    links.new(combxyzs.outputs[0],mapping.inputs[3])
-
     links.new(texcoord.outputs["UV"],mapping.inputs[0])
     links.new(mapping.outputs[0],output_node.inputs[0])
 
-    return node_group
-
 def levels(node_group, colsoc, levelref, id = ""):
 
     curve = levelref.levels_node.get_node()
@@ -7069,14 +9455,9 @@ def levels(node_group, colsoc, levelref, id = ""):
     return None
 
 def InvertNormalNode():
-    part = get_material_collection()
-    name = ".HAS_InvertNormal"
-    if name in bpy.data.node_groups:
-        node_group = bpy.data.node_groups[name]
-        clear_nodes_ignoring(node_group)
-    else:
-        node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
+    return static_node_group(".HAS_InvertNormal", build_invert_normal_group)
 
+def build_invert_normal_group(node_group):
     create_socket(node_group, "Normal", 'color', True)
     create_socket(node_group, "Normal", 'color', False)
 
@@ -7103,8 +9484,6 @@ def InvertNormalNode():
 
     tree_links.new(com.outputs[0], output_node.inputs[0])
 
-    return node_group
-
 def set_rgb_curve(node, val1, val2, val3, val4, val5, index):
     if not node:
         return
@@ -7298,36 +9677,30 @@ def newimage(texture_name):
 
     new_texture = bpy.data.textures.new(name=texture_name, type='IMAGE')
     new_image = bpy.data.images.new(texture_name, width=xs, height=ys, alpha=True)
-    pixels = [0.0] * (4 * xs * ys)
-    new_image.pixels = pixels
+    fill_pixels(new_image, 0.0)
     new_texture.image = new_image
     return new_image
 
-def blendin(node_group, sockets, value):
-    links = node_group.links
+def blendin(graph, sockets, value):
     count = -1
     lastsock = None
     for socket in sockets:
         count = count +1
-        mix= create_node(node_group,'ShaderNodeMixRGB', 0,-150*count, "mix", "MIX")
-        compare = create_node(node_group,'ShaderNodeMath', -400,-150*count, "op", 'COMPARE')
-        set_default(compare, 1, count)
-        set_default(compare, 2, 0.1)
-
-        links.new(value, compare.inputs[0])
-        links.new(compare.outputs[0], mix.inputs[0])
-        links.new(socket, mix.inputs[2])
+        mix = graph.node(f"TypeMix{count}", 'ShaderNodeMixRGB', (0, -150*count), blend_type="MIX")
+        compare = graph.node(f"TypeCompare{count}", 'ShaderNodeMath', (-400, -150*count), operation='COMPARE')
+        graph.default(compare, 1, count)
+        graph.default(compare, 2, 0.1)
+
+        graph.link(*value, compare, 0)
+        graph.link(compare, 0, mix, 0)
+        graph.link(*socket, mix, 2)
         if lastsock:
-            links.new(lastsock, mix.inputs[1])
-        lastsock = mix.outputs[0]
+            graph.link(*lastsock, mix, 1)
+        lastsock = (mix, 0)
     return lastsock
 
 def getbyid(id):
-    part = get_material_collection()
-    for l in part.layers:
-        if l.id == id:
-            return l
-    return None
+    return get_layer_by_id(id)
 
 def get_node_by_name(node_group, name):
     for node in node_group.nodes:
@@ -7380,13 +9753,9 @@ def clear_unused_layers():
             part.layers.remove(ind)
 
 def type_switch():
-    name = f".HAS_TypeSwitch"
-    if name in bpy.data.node_groups:
-        node_group = bpy.data.node_groups[name]
-        simple_clear_node(node_group)
-    else:
-        node_group = bpy.data.node_groups.new(type="ShaderNodeTree", name=name)
+    return static_node_group(".HAS_TypeSwitch", build_type_switch_group)
 
+def build_type_switch_group(node_group):
     create_socket(node_group, "Color", 'color', True)
     create_socket(node_group, "Alpha", 'float', True)
     create_socket(node_group, "PrevColor", 'color', True)
@@ -7424,7 +9793,347 @@ def type_switch():
     links.new(mix.outputs[0], output_node.inputs["Color"])
     links.new(alphamix.outputs[0], output_node.inputs["Alpha"])
     links.new(compare.outputs[0], output_node.inputs["Result"])
-    return node_group
+
+###
+### BENCHMARK
+###
+
+BENCHMARK_VERSION = 1
+BENCHMARK_MAPS = ("Diffuse", "Roughness", "Metallic", "Normal", "Height", "Emission", "Alpha", "AO")
+BENCHMARK_FILTERS = ("LEVELS", "FILL")
+
+def benchmark_layer(part, size, name, texture_type = "", layer_type = "SIMPLE", image = True):
+    layer = part.layers.add()
+    layer.suppress_update = True
+    layer.resource.suppress_update = True
+    if image:
+        layer.resource.image = bpy.data.images.new(f".HAS_Bench_{name}", size, size, alpha=True)
+    layer.layer_name = name
+    layer.layer_type = layer_type
+    if texture_type:
+        layer.texture_type = texture_type
+    layer.id = shortid()
+    layer.suppress_update = False
+    layer.resource.suppress_update = False
+    return layer
+
+def build_benchmark_set(layers, filters = 0, folders = 0, pbr = 0, maps = 3, size = 256):
+    # Synthetic material set on its own object: regular layers with M filters
+    # each, folders holding sub layers, and PBR layers with one sub layer per
+    # used map. Returns the material set, made active.
+    scene = bpy.context.scene
+    mesh = bpy.data.meshes.new(".HAS_Benchmark")
+    obj = bpy.data.objects.new(".HAS_Benchmark", mesh)
+    scene.collection.objects.link(obj)
+    scene.view_layers[0].objects.active = obj
+    material = bpy.data.materials.new(f"HASBenchmark{layers}")
+    material.use_nodes = True
+    mesh.materials.append(material)
+
+    part = scene.material_props.add()
+    part.material = material
+    part.name = get_next_set_name()
+    part.texture_sizeX = size
+    part.texture_sizeY = size
+    for index, used in enumerate(BENCHMARK_MAPS):
+        setattr(part.used_maps, used, index < maps)
+    part.used_maps.Custom = False
+    types = [type[0] for type in getusedmaps() if type[0] != "CUSTOM"]
+
+    for index in range(layers):
+        layer = benchmark_layer(part, size, f"Layer{index}", types[index % len(types)])
+        part.base_layers.add().id = layer.id
+        for findex in range(filters):
+            filter = layer.filters.add()
+            filter.suppress_update = True
+            filter.id = shortid()
+            filter.name = BENCHMARK_FILTERS[findex % len(BENCHMARK_FILTERS)]
+            filter.connection_type = "ALPHA"
+            filter.resource.grayscale = True
+            filter.suppress_update = False
+
+    for index in range(folders):
+        folder = part.layers.add()
+        folder.suppress_update = True
+        folder.layer_name = f"Folder{index}"
+        folder.layer_type = "FOLDER"
+        folder.id = shortid()
+        folder.suppress_update = False
+        part.base_layers.add().id = folder.id
+        for type in types:
+            layer = benchmark_layer(part, size, f"Folder{index}_{type}", type)
+            layer.attachedto = folder.id
+            folder.sub_layers.add().id = layer.id
+
+    for index in range(pbr):
+        base = benchmark_layer(part, size, f"PBR{index}", layer_type = "PBR")
+        part.base_layers.add().id = base.id
+        for type in types:
+            layer = benchmark_layer(part, size, f"PBR{index}_{type}", type, image = False)
+            if type == "DIFFUSE":
+                layer.resource.image = base.resource.image
+            base.sub_layers.add().id = layer.id
+    return part
+
+def discard_pending_updates():
+    pending_updates["set"] = None
+    for key in ("layers", "filters", "dirty"):
+        pending_updates[key].clear()
+    for key in ("shader", "full", "compile"):
+        pending_updates[key] = False
+    if bpy.app.timers.is_registered(flush_updates):
+        bpy.app.timers.unregister(flush_updates)
+
+def material_graph_size(node_tree):
+    # Unique groups, nodes and links reachable from the material group.
+    seen = set()
+    stack = [node_tree]
+    nodes = links = 0
+    while stack:
+        tree = stack.pop()
+        if tree is None or tree.name in seen:
+            continue
+        seen.add(tree.name)
+        nodes += len(tree.nodes)
+        links += len(tree.links)
+        stack.extend(node.node_tree for node in tree.nodes if node.type == 'GROUP')
+    return {"groups": len(seen), "nodes": nodes, "links": links}
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000.0
+
+@contextmanager
+def benchmark_set(layers, filters = 0, folders = 0, pbr = 0, maps = 3, size = 256):
+    # Builds a synthetic set with deferred updates and no compile or focus
+    # passes, and removes everything it created afterwards.
+    scene = bpy.context.scene
+    otps = scene.other_props
+    saved = (otps.defer_updates, otps.compile_shader, otps.paint_focus, scene.view_layers[0].objects.active)
+    node_groups = set(bpy.data.node_groups)
+    images = set(bpy.data.images)
+    otps.defer_updates = True
+    otps.compile_shader = False
+    otps.paint_focus = False
+    part = build_benchmark_set(layers, filters, folders, pbr, maps, size)
+    material = part.material
+    discard_pending_updates()
+    try:
+        yield part
+    finally:
+        discard_pending_updates()
+        scene.material_props.remove(list(scene.material_props).index(part))
+        obj = bpy.data.objects[".HAS_Benchmark"]
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        bpy.data.meshes.remove(mesh)
+        bpy.data.materials.remove(material)
+        for node_group in set(bpy.data.node_groups) - node_groups:
+            bpy.data.node_groups.remove(node_group)
+        for image in set(bpy.data.images) - images:
+            bpy.data.images.remove(image)
+        otps.defer_updates, otps.compile_shader, otps.paint_focus, active = saved
+        scene.view_layers[0].objects.active = active
+        discard_pending_updates()
+        clear_layer_index()
+
+def run_benchmark_case(layers, filters = 0, folders = 0, pbr = 0, maps = 3, repeat = 3):
+    with benchmark_set(layers, filters, folders, pbr, maps) as part:
+        regular = [layer for layer in part.layers if layer.layer_type not in {"FOLDER", "PBR"}]
+        filtered = [layer for layer in regular if layer.filters]
+        timings = {"update_shader_cold": time_call(UpdateShader)}
+        samples = {"update_shader": [], "update_layers": [], "hasmatnode": [], "create_layer_node": [], "layer_filter": []}
+        for run in range(repeat):
+            samples["update_shader"].append(time_call(UpdateShader))
+            if regular:
+                samples["update_layers"].append(time_call(UpdateLayers, regular[len(regular) // 2]))
+            samples["hasmatnode"].append(time_call(hasmatnode))
+            samples["create_layer_node"].append(sum(time_call(create_layer_node, layer) for layer in regular))
+            samples["layer_filter"].append(sum(time_call(layer_filter, layer) for layer in filtered))
+        for key, values in samples.items():
+            if values:
+                timings[key] = sorted(values)[len(values) // 2]
+        node_group = bpy.data.node_groups.get(getmaterialgroupname(part))
+        counts = material_graph_size(node_group) if node_group else {}
+    name = f"l{layers}_f{filters}_d{folders}_p{pbr}_m{maps}"
+    params = {"layers": layers, "filters": filters, "folders": folders, "pbr": pbr, "maps": maps, "repeat": repeat}
+    return {"name": name, "params": params, "timings_ms": {key: round(value, 3) for key, value in timings.items()}, "counts": counts}
+
+def run_benchmarks(cases, repeat = 3):
+    results = {
+        "version": BENCHMARK_VERSION,
+        "blender": bpy.app.version_string,
+        "cases": [],
+    }
+    for case in cases:
+        result = run_benchmark_case(repeat = repeat, **case)
+        results["cases"].append(result)
+        print(f"{result['name']}: " + ", ".join(f"{key} {value:.1f} ms" for key, value in result["timings_ms"].items()))
+    return results
+
+def compare_benchmarks(results, baseline, tolerance = 0.25, min_ms = 1.0):
+    # Timings more than `tolerance` slower than the baseline (and by more
+    # than min_ms, to ignore noise) and any growth in graph size regress.
+    regressions = []
+    base_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    for case in results["cases"]:
+        base = base_cases.get(case["name"])
+        if not base:
+            continue
+        for key, value in case["timings_ms"].items():
+            old = base["timings_ms"].get(key)
+            if old is not None and value > old * (1.0 + tolerance) and value - old > min_ms:
+                regressions.append(f"{case['name']} {key}: {old:.1f} -> {value:.1f} ms")
+        for key, value in case["counts"].items():
+            old = base["counts"].get(key)
+            if old is not None and value > old:
+                regressions.append(f"{case['name']} {key}: {old} -> {value}")
+    return regressions
+
+def benchmark_layer_lookup(counts = (10, 100, 1000), repeat = 3):
+    # Resolves every layer and base reference by id through the layer index
+    # and through a plain scan of the collections, which it replaced.
+    rows = []
+    for count in counts:
+        with benchmark_set(count, folders = max(1, count // 50), maps = 3, size = 8) as part:
+            ids = [layer.id for layer in part.layers]
+            refs = [ref.id for ref in part.base_layers]
+            def indexed():
+                for id in ids:
+                    get_layer_by_id(id)
+                for id in refs:
+                    get_layer_in_list(part.base_layers, id)
+                for layer in get_layers(part.base_layers):
+                    get_layers(layer.sub_layers)
+            def linear():
+                for id in ids:
+                    next((l for l in part.layers if l.id == id), None)
+                for id in refs:
+                    next((r for r in part.base_layers if r.id == id), None)
+                for ref in part.base_layers:
+                    layer = next((l for l in part.layers if l.id == ref.id), None)
+                    for sub in layer.sub_layers:
+                        next((l for l in part.layers if l.id == sub.id), None)
+            row = {"layers": len(ids)}
+            for key, function in (("indexed_ms", indexed), ("linear_ms", linear)):
+                row[key] = round(sorted(time_call(function) for run in range(repeat))[repeat // 2], 3)
+        print(f"HAS layer lookup {row['layers']} layers: indexed {row['indexed_ms']:.2f} ms, linear {row['linear_ms']:.2f} ms")
+        rows.append(row)
+    return rows
+
+class BenchmarkLayout:
+    # Stands in for UILayout so the Python side of draw() can run in the
+    # background; every call returns another layout and is otherwise ignored.
+    def __getattr__(self, name):
+        return self
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+def benchmark_panel_draw(counts = (50, 200, 500), repeat = 5):
+    # Python time of drawing the layer list of HAS_PT_LayersPanel with the
+    # rows rebuilt (a data change) and reused (a hover redraw).
+    otps = bpy.context.scene.other_props
+    rows = []
+    for count in counts:
+        with benchmark_set(count, filters = 2, folders = max(1, count // 50), size = 8) as part:
+            areas = ("expand_area_butfile", "expand_area_butmtl", "expand_area_buttools", "expand_area_butlayers")
+            saved = [getattr(otps, area) for area in areas]
+            for area in areas:
+                setattr(otps, area, area == "expand_area_butlayers")
+            panel = BenchmarkLayout()
+            panel.__dict__["layout"] = BenchmarkLayout()
+            def cold():
+                clear_panel_view()
+                HAS_PT_LayersPanel.draw(panel, bpy.context)
+            def warm():
+                HAS_PT_LayersPanel.draw(panel, bpy.context)
+            try:
+                row = {"layers": len(part.layers), "page_size": otps.layer_page_size}
+                for key, function in (("rebuild_ms", cold), ("cached_ms", warm)):
+                    row[key] = round(sorted(time_call(function) for run in range(repeat))[repeat // 2], 3)
+            finally:
+                for area, value in zip(areas, saved):
+                    setattr(otps, area, value)
+                clear_panel_view()
+        print(f"HAS panel draw {row['layers']} layers: rebuild {row['rebuild_ms']:.2f} ms, cached {row['cached_ms']:.2f} ms")
+        rows.append(row)
+    return rows
+
+def check_tiled_background_export(tile_size = 64):
+    # Exports a small set tiled with background writing on, twice: the first
+    # run has to list and record every map, the second has to skip them all.
+    # Run inside Blender, e.g. blender -b --python-expr "import HASPaintLayers as h; h.check_tiled_background_export()"
+    otps = bpy.context.scene.other_props
+    saved = (otps.export_tile_size, otps.export_background_write, otps.export_incremental, otps.export_single_pass)
+    directory = tempfile.mkdtemp(prefix="has_check_")
+    failures = []
+    try:
+        with benchmark_set(4, maps = 3, size = tile_size * 2) as part:
+            otps.export_tile_size = tile_size
+            otps.export_background_write = True
+            otps.export_incremental = True
+            otps.export_single_pass = False
+            expected = len(otps.exportprops) or 1
+            bpy.ops.haspaint.export_textures(filepath=os.path.join(directory, ""), material_set=part.name)
+            first = dict(last_export)
+            manifest = load_export_manifest(directory)
+            if len(first["written"]) != expected:
+                failures.append(f"first export listed {len(first['written'])} of {expected} maps")
+            for file_path in first["written"]:
+                if os.path.basename(file_path) not in manifest["outputs"]:
+                    failures.append(f"{os.path.basename(file_path)} missing from the manifest")
+            bpy.ops.haspaint.export_textures(filepath=os.path.join(directory, ""), material_set=part.name)
+            if last_export["written"] or len(last_export["skipped"]) != expected:
+                failures.append(f"second export wrote {len(last_export['written'])} and skipped {len(last_export['skipped'])} maps")
+    finally:
+        otps.export_tile_size, otps.export_background_write, otps.export_incremental, otps.export_single_pass = saved
+        shutil.rmtree(directory, ignore_errors=True)
+    for failure in failures:
+        print(f"HAS check failed: {failure}")
+    if not failures:
+        print("HAS tiled background export: ok")
+    return failures
+
+def run_benchmark(argv = None):
+    import argparse
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="HASPaintLayers benchmark", description="Time node graph building on synthetic layer stacks.")
+    parser.add_argument("--layers", type=int, nargs="+", default=[10, 50], help="Layer counts, one case per count")
+    parser.add_argument("--filters", type=int, default=2, help="Filters per layer")
+    parser.add_argument("--folders", type=int, default=2, help="Folders, each with one sub layer per used map")
+    parser.add_argument("--pbr", type=int, default=1, help="PBR layers")
+    parser.add_argument("--maps", type=int, default=3, help="Number of used maps")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per builder, the median is reported")
+    parser.add_argument("--output", default="", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", default="", help="Compare against results stored in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against the baseline, 0.25 is 25%%")
+    parser.add_argument("--lookup", type=int, nargs="*", default=None, help="Also time layer id lookups at these layer counts")
+    parser.add_argument("--draw", type=int, nargs="*", default=None, help="Also time drawing the layers panel at these layer counts")
+    args = parser.parse_args(argv)
+
+    cases = [{"layers": layers, "filters": args.filters, "folders": args.folders, "pbr": args.pbr, "maps": args.maps} for layers in args.layers]
+    results = run_benchmarks(cases, args.repeat)
+    if args.lookup is not None:
+        results["lookup"] = benchmark_layer_lookup(args.lookup or (10, 100, 1000), args.repeat)
+    if args.draw is not None:
+        results["draw"] = benchmark_panel_draw(args.draw or (50, 200, 500), args.repeat)
+    if args.output:
+        write_summary(args.output, results)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare_benchmarks(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+    return results
 
 ###
 ### QUICKEDIT
@@ -7631,8 +10340,11 @@ class SCREEN_OT_crop_tool(Operator):
             view_data.crop_endX= int(self.end_x * x_scale)
             view_data.crop_endY= int(self.end_y * x_scale)
 
-            pixels = np.array(image_new.pixels[:]).reshape((height, width, 4)) 
-            cropped_pixels = pixels[upper:lower, left:right, :]
+            pixels = read_pixels(image_new).reshape((height, width, image_new.channels))
+            cropped_pixels = np.zeros((cropped_height, cropped_width, 4), dtype=np.float32)
+            cropped_pixels[:, :, :pixels.shape[2]] = pixels[upper:lower, left:right, :4]
+            if pixels.shape[2] < 4:
+                cropped_pixels[:, :, 3] = 1.0
 
             bpy.data.images.remove(image_new)
 
@@ -7643,7 +10355,7 @@ class SCREEN_OT_crop_tool(Operator):
                 alpha=True 
             )
 
-            cropped_image.pixels = cropped_pixels.flatten().tolist()
+            write_pixels(cropped_image, cropped_pixels)
 
             cropped_image.filepath_raw = filepath_final
             cropped_image.file_format = 'PNG'
@@ -7966,7 +10678,8 @@ class ProjectBakeGet(Operator):
 
         image_new.filepath_raw = filepath_final
         image_new.file_format = 'PNG'
-        image_new.save()
+        with profile_section("image save"):
+            image_new.save()
 
         filepath_final = bpy.path.abspath(filepath_final)
 
@@ -8027,19 +10740,17 @@ def create_image_with_overlay(main_img_width, main_img_height, overlay_image, st
     end_x = min(end_x, main_img_width)
     end_y = min(end_y, main_img_height)
 
-    main_pixels = np.zeros((main_img_height, main_img_width, 4), dtype=np.float32)
-    overlay_pixels = np.array(overlay_image.pixels[:]).reshape((overlay_height, overlay_width, 4))
+    main_pixels = pixel_buffer(main_img_height * main_img_width * 4, key = "overlay_main").reshape((main_img_height, main_img_width, 4))
+    main_pixels.fill(0.0)
+    overlay_pixels = read_pixels(overlay_image, key = "overlay").reshape((overlay_height, overlay_width, overlay_image.channels))
 
-    for y in range(overlay_height):
-        for x in range(overlay_width):
-            target_x = offset_x + x
-            target_y = offset_y + y
-            if target_x < end_x and target_y < end_y:
-                main_pixels[target_y, target_x, :] = overlay_pixels[y, x, :]
+    copy_w = max(0, min(overlay_width, end_x - offset_x))
+    copy_h = max(0, min(overlay_height, end_y - offset_y))
+    if copy_w and copy_h:
+        channels = min(4, overlay_pixels.shape[2])
+        main_pixels[offset_y:offset_y + copy_h, offset_x:offset_x + copy_w, :channels] = overlay_pixels[:copy_h, :copy_w, :channels]
 
-    main_pixels_flat = main_pixels.flatten()
-    main_image.pixels = main_pixels_flat.tolist()
-    main_image.update()
+    write_pixels(main_image, main_pixels)
     
     return main_image
 
@@ -8195,23 +10906,59 @@ def fix_image_colors_by_alpha(image_name):
     if image.channels < 4:
         return
 
-    pixels = np.array(image.pixels[:])  
-    pixels = pixels.reshape((-1, 4)) 
+    pixels = read_pixels(image).reshape((-1, 4))
     
     rgb = pixels[:, :3] 
     alpha = pixels[:, 3]
 
-    rgb_corrected = np.where(alpha[:, None] > 0, rgb / alpha[:, None], rgb)
-    rgb_corrected[alpha == 0] = [1.0, 1.0, 1.0]
-    pixels[:, :3] = rgb_corrected
+    visible = alpha > 0
+    np.divide(rgb, alpha[:, None], out=rgb, where=visible[:, None])
+    rgb[~visible] = 1.0
     
-    image.pixels = pixels.flatten()
-    
-    image.update()
+    write_pixels(image, pixels)
+
+image_sample_stats = {
+    "created": 0,
+    "reused": 0,
+}
+
+def image_sample_mapping(resource):
+    if resource:
+        return {"Location": (resource.mapx,resource.mapy,0.0), "Rotation": (0.0,0.0,resource.maprot), "Scale": (resource.mapscalex,resource.mapscaley,1.0)}
+    return {"Location": (0.0,0.0,0.0), "Rotation": (0.0,0.0,0.0), "Scale": (1.0,1.0,1.0)}
+
+def find_image_sample(node_group, img, interpolation, extension, uvs, mapping_values):
+    # An image node already in this tree that samples the same image the same
+    # way. Checked against the live nodes, so hand edits are respected.
+    for node in node_group.nodes:
+        if node.bl_idname != 'ShaderNodeTexImage' or node.image != img:
+            continue
+        if node.interpolation != interpolation or node.extension != extension or not node.inputs[0].links:
+            continue
+        mapping = node.inputs[0].links[0].from_node
+        if mapping.bl_idname != 'ShaderNodeMapping' or not mapping.inputs[0].links:
+            continue
+        if not all(node_value_matches(mapping.inputs[key].default_value, value) for key, value in mapping_values.items()):
+            continue
+        uv = mapping.inputs[0].links[0].from_node
+        uv_name = uv.attribute_name if uv.bl_idname == 'ShaderNodeAttribute' else getattr(uv, "uv_map", None)
+        if uv_name == uvs:
+            return node, mapping
+    return None, None
 
 def create_image_node(node_group, img, resource = None):
     part = get_material_collection()
     links = node_group.links
+    if img:
+        image_node, mapping = find_image_sample(node_group, img, part.texture_filtering, 'REPEAT', part.uvs, image_sample_mapping(resource))
+        if image_node:
+            # MappingUpdate() rebuilds instead of editing a shared node.
+            mapping["has_shared"] = True
+            if resource:
+                resource.mapping_node.set_node_reference(mapping)
+            image_sample_stats["reused"] += 1
+            return image_node
+    image_sample_stats["created"] += 1
     image_node = create_node(node_group,'ShaderNodeTexImage', -600,0, "img", img)
     
     image_node.interpolation= part.texture_filtering
@@ -8233,6 +10980,24 @@ def create_image_node(node_group, img, resource = None):
         links.new(attribute.outputs[1],mapping.inputs[0])
     return image_node
 
+def graph_image_node(graph, img, resource = None, prefix = ""):
+    # NodeGraph counterpart of create_image_node().
+    part = get_material_collection()
+    image_node = graph.node(f"{prefix}Image", 'ShaderNodeTexImage', (-600, 0), image=img, interpolation=part.texture_filtering)
+    attribute = graph.node(f"{prefix}UVMap", 'ShaderNodeUVMap', (-600, 0), uv_map=part.uvs)
+    mapping = graph.node(f"{prefix}Mapping", 'ShaderNodeMapping', (-600, 0))
+    if resource:
+        graph.default(mapping, "Location", (resource.mapx,resource.mapy,0.0))
+        graph.default(mapping, "Rotation", (0.0,0.0,resource.maprot))
+        graph.default(mapping, "Scale", (resource.mapscalex,resource.mapscaley,1.0))
+        graph.after(lambda tree: resource.mapping_node.set_node_reference(tree.nodes[mapping]))
+    graph.link(attribute, 0, mapping, 0)
+    graph.link(mapping, 0, image_node, 0)
+    if part.uvs:
+        attribute = graph.node(f"{prefix}UVAttribute", 'ShaderNodeAttribute', (-600, 0), attribute_name=part.uvs)
+        graph.link(attribute, 1, mapping, 0)
+    return image_node
+
 ###
 ### EXPORT
 ###
@@ -8268,14 +11033,16 @@ class ExportORALayersOperator(Operator):
         
         for i, layer in enumerate(layers):
             if layer.resource.image:
-                texture_name = BakeLayerToImage(self,context, layer).name
+                with profile_section("ora bake layer"):
+                    texture_name = BakeLayerToImage(self,context, layer).name
                 self.report({'INFO'}, f"Processing Layer {i}: {texture_name}")
                 
                 image_name = f"layer_{i}.png"
                 image_path = os.path.join(save_dir, image_name)
                 layer.resource.image.filepath_raw = image_path
                 layer.resource.image.file_format = 'PNG'
-                layer.resource.image.save_render(image_path)
+                with profile_section("ora save layer"):
+                    layer.resource.image.save_render(image_path)
                 
                 ora_layer = {
                     "name": texture_name,
@@ -8298,7 +11065,7 @@ class ExportORALayersOperator(Operator):
         stack_xml_path = os.path.join(save_dir, "stack.xml")
         ElementTree(stack).write(stack_xml_path, encoding='utf-8', xml_declaration=True)
 
-        with zipfile.ZipFile(ora_file, 'w') as ora_zip:
+        with profile_section("ora write archive"), zipfile.ZipFile(ora_file, 'w') as ora_zip:
             ora_zip.write(stack_xml_path, "stack.xml")
             for image_file in layer_files:
                 ora_zip.write(image_file, os.path.join("data", os.path.basename(image_file)))
@@ -8328,12 +11095,13 @@ class ImportORALayersOperator(Operator):
         options={'HIDDEN'}
     )
 
+    @pooled_pixel_buffers()
     def execute(self, context):
         extract_dir = os.path.join(bpy.app.tempdir, "ora_import_temp")
         os.makedirs(extract_dir, exist_ok=True)
 
         try:
-            with zipfile.ZipFile(self.filepath, 'r') as ora_zip:
+            with profile_section("ora extract"), zipfile.ZipFile(self.filepath, 'r') as ora_zip:
                 ora_zip.extractall(extract_dir)
         except Exception as e:
             self.report({'ERROR'}, f"Failed to extract ORA file: {e}")
@@ -8371,15 +11139,16 @@ class ImportORALayersOperator(Operator):
                 continue
 
             try:
+                with profile_section("ora load layer"):
+                    src_image = bpy.data.images.load(image_path)
+                    src_image.name = layer_name
 
-                src_image = bpy.data.images.load(image_path)
-                src_image.name = layer_name
+                with profile_section("ora place layer"):
+                    new_image = bpy.data.images.new(layer_name, width=canvas_width, height=canvas_height, alpha=True)
 
-                new_image = bpy.data.images.new(layer_name, width=canvas_width, height=canvas_height)
+                    fill_pixels(new_image, 0.0)
 
-                new_image.pixels = [0.0] * (canvas_width * canvas_height * 4)
-
-                self.copy_pixels_into_canvas(src_image, new_image, layer_x, layer_y)
+                    self.copy_pixels_into_canvas(src_image, new_image, layer_x, layer_y)
 
                 new_layer = layers.add()
                 new_layer.resource.image = new_image
@@ -8406,25 +11175,25 @@ class ImportORALayersOperator(Operator):
         if not canvas_image.has_data:
             canvas_image.reload()
 
-        src_pixels = list(src_image.pixels[:])
-        canvas_pixels = list(canvas_image.pixels[:])
-
         src_width, src_height = src_image.size
         canvas_width, canvas_height = canvas_image.size
 
-        for y in range(src_height):
-            for x in range(src_width):
-                canvas_x = x + offset_x
-                canvas_y = (canvas_height - y - 1) - offset_y 
-
-                if 0 <= canvas_x < canvas_width and 0 <= canvas_y < canvas_height:
-                    src_index = ((src_height - y - 1) * src_width + x) * 4
-                    canvas_index = (canvas_y * canvas_width + canvas_x) * 4
+        src_pixels = read_pixels(src_image, key = "ora_src").reshape((src_height, src_width, src_image.channels))
+        canvas_pixels = read_pixels(canvas_image, key = "ora_canvas").reshape((canvas_height, canvas_width, canvas_image.channels))
 
-                    canvas_pixels[canvas_index:canvas_index + 4] = src_pixels[src_index:src_index + 4]
+        # ORA offsets are top-down while Blender rows are bottom-up, so the
+        # source keeps its row order and only the vertical offset flips.
+        x0 = max(0, offset_x)
+        x1 = min(canvas_width, offset_x + src_width)
+        y0 = max(0, canvas_height - offset_y - src_height)
+        y1 = min(canvas_height, canvas_height - offset_y)
+        if x0 < x1 and y0 < y1:
+            sy0 = y0 - (canvas_height - offset_y - src_height)
+            sx0 = x0 - offset_x
+            channels = min(src_pixels.shape[2], canvas_pixels.shape[2])
+            canvas_pixels[y0:y1, x0:x1, :channels] = src_pixels[sy0:sy0 + (y1 - y0), sx0:sx0 + (x1 - x0), :channels]
 
-        canvas_image.pixels = canvas_pixels
-        canvas_image.update()
+        write_pixels(canvas_image, canvas_pixels)
 
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
@@ -8857,14 +11626,43 @@ class PaintSelectionOperator(Operator):
 ### COMMON FUNCTIONS
 ###
 
+# Ids in use by the layers and filters of the current scene. The ids live on
+# the layers themselves, so the set is rebuilt from them after a scene
+# switch, undo or file load instead of being stored.
+id_registry = {"scene": 0, "ids": set()}
+
+@persistent
+def clear_id_registry(*args):
+    id_registry["scene"] = 0
+    id_registry["ids"] = set()
+
+def registered_ids():
+    scene = bpy.context.scene
+    if id_registry["scene"] != scene.as_pointer():
+        ids = set()
+        for part in scene.material_props:
+            for layer in part.layers:
+                ids.add(layer.id)
+                ids.update(filter.id for filter in layer.filters)
+        id_registry["scene"] = scene.as_pointer()
+        id_registry["ids"] = ids
+        # Older files kept every id ever made in one growing string.
+        if scene.other_props.usedids:
+            scene.other_props.usedids = ""
+    return id_registry["ids"]
+
+def shortids(count):
+    ids = registered_ids()
+    new = []
+    while len(new) < count:
+        id = uuid.uuid4().hex[:6]
+        if id not in ids:
+            ids.add(id)
+            new.append(id)
+    return new
+
 def shortid():
-    usedids = list(bpy.context.scene.other_props.usedids)
-    while True:
-        id = str(uuid.uuid4()).replace('-', '')[:6]
-        if id not in usedids:
-            usedids.append(id)
-            bpy.context.scene.other_props.usedids = ''.join(usedids)
-            return id
+    return shortids(1)[0]
 
 def newimagename(layer_name = ""):
     part = get_material_collection()
@@ -8905,6 +11703,193 @@ def newlayername(pref = ""):
 def clamp(value, min_val, max_val):
     return max(min_val, min(value, max_val))
 
+pixel_buffers = {}
+pixel_pool = {"depth": 0}
+
+@contextmanager
+def pooled_pixel_buffers():
+    # Batch jobs reuse one buffer per key; the pool is dropped when the
+    # outermost job ends so full size buffers never stay resident.
+    pixel_pool["depth"] += 1
+    try:
+        yield
+    finally:
+        pixel_pool["depth"] -= 1
+        if not pixel_pool["depth"]:
+            release_pixel_buffers()
+
+def pixel_buffer(size, key = "default"):
+    # Float32 buffers for image.pixels transfers. Inside pooled_pixel_buffers
+    # a buffer returned for a key is overwritten by the next call with the
+    # same key; outside it every call gets its own buffer.
+    if not pixel_pool["depth"]:
+        return np.empty(size, dtype=np.float32)
+    buf = pixel_buffers.get(key)
+    if buf is None or buf.size != size:
+        buf = np.empty(size, dtype=np.float32)
+        pixel_buffers[key] = buf
+    return buf
+
+@persistent
+def release_pixel_buffers(*args):
+    pixel_buffers.clear()
+
+@profiled("read_pixels")
+def read_pixels(image, key = "read"):
+    buf = pixel_buffer(image.size[0] * image.size[1] * image.channels, key)
+    image.pixels.foreach_get(buf)
+    return buf
+
+@profiled("write_pixels")
+def write_pixels(image, pixels):
+    image.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).reshape(-1))
+    image.update()
+
+def fill_pixels(image, value = 0.0, key = "fill"):
+    buf = pixel_buffer(image.size[0] * image.size[1] * image.channels, key)
+    buf.fill(value)
+    write_pixels(image, buf)
+
+def quantize_pixels(pixels):
+    # Same rounding Blender uses when float pixels land in a byte image; rows
+    # are flipped to the top-down order PNG expects.
+    return (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)[::-1]
+
+class PngStreamWriter:
+    # Writes an RGBA8 PNG from top-down row blocks as they arrive; every block
+    # becomes its own IDAT chunk so nothing but the current block is kept.
+    def __init__(self, filepath, width, height, level = 6):
+        self.filepath = filepath
+        self.width = width
+        self.temp_path = filepath + ".tmp"
+        self.file = open(self.temp_path, "wb")
+        self.compressor = zlib.compressobj(level)
+        self.size = 0
+        self.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def chunk(self, tag, body):
+        self.write(struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xffffffff))
+
+    def write_rows(self, rgba8):
+        rows = rgba8.shape[0]
+        raw = np.zeros((rows, self.width * 4 + 1), dtype=np.uint8)
+        raw[:, 1:] = rgba8.reshape((rows, self.width * 4))
+        data = self.compressor.compress(raw.tobytes())
+        if data:
+            self.chunk(b"IDAT", data)
+
+    def close(self):
+        self.chunk(b"IDAT", self.compressor.flush())
+        self.chunk(b"IEND", b"")
+        self.file.close()
+        os.replace(self.temp_path, self.filepath)
+        return self.size
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temp_path)
+
+@profiled("encode_png")
+def encode_png(filepath, rgba8, level = 6):
+    png = PngStreamWriter(filepath, rgba8.shape[1], rgba8.shape[0], level)
+    try:
+        png.write_rows(rgba8)
+        return png.close()
+    finally:
+        png.abort()
+
+class TextureWriter:
+    # Encodes and writes exported maps on worker threads so the next channel
+    # can render while earlier ones are compressed.
+    def __init__(self, workers = 0):
+        self.workers = workers if workers > 0 else max(1, min(8, (os.cpu_count() or 2) - 1))
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = []
+        self.written = []
+        self.errors = []
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def submit_pixels(self, filepath, pixels):
+        rgba8 = quantize_pixels(pixels)
+        # Bound the queue so large exports keep only a few maps in memory.
+        while len(self.pending) >= self.workers * 2:
+            self.collect(self.pending.pop(0))
+        self.pending.append((filepath, self.pool.submit(encode_png, filepath, rgba8)))
+
+    def submit_image(self, filepath, image):
+        width, height = image.size
+        pixels = read_pixels(image, key = "writer").reshape((height, width, image.channels))
+        if image.channels != 4:
+            rgba = np.ones((height, width, 4), dtype=np.float32)
+            rgba[:, :, :min(3, image.channels)] = pixels[:, :, :3]
+            pixels = rgba
+        self.submit_pixels(filepath, pixels)
+
+    def collect(self, entry):
+        filepath, future = entry
+        try:
+            self.bytes += future.result()
+            self.written.append(filepath)
+        except Exception as e:
+            self.errors.append((filepath, e))
+
+    def finish(self):
+        for entry in self.pending:
+            self.collect(entry)
+        self.pending.clear()
+        self.pool.shutdown(wait=True)
+        return self.written, self.errors
+
+    def close(self):
+        self.pending.clear()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return f"Wrote {len(self.written)} textures ({self.bytes / 1048576:.1f} MB) in {elapsed:.2f}s on {self.workers} threads"
+
+def linear_to_srgb(values):
+    values = np.clip(values, 0.0, None)
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * np.power(values, 1.0 / 2.4) - 0.055)
+
+def pixel_luma(pixels):
+    return pixels[..., 0] * 0.2126 + pixels[..., 1] * 0.7152 + pixels[..., 2] * 0.0722
+
+def benchmark_pixel_transfer(sizes = (2048, 4096, 8192), legacy_limit = 4096):
+    # Compares the old list(image.pixels) round trip with the foreach path.
+    # Run inside Blender, e.g. blender -b --python-expr "import HASPaintLayers as h; h.benchmark_pixel_transfer()"
+    import tracemalloc
+    results = []
+    for size in sizes:
+        src = bpy.data.images.new(".HAS_BenchSrc", size, size, alpha=True, float_buffer=True)
+        dst = bpy.data.images.new(".HAS_BenchDst", size, size, alpha=True, float_buffer=True)
+        row = {"size": size}
+        if size <= legacy_limit:
+            tracemalloc.start()
+            start = time.perf_counter()
+            dst.pixels = list(src.pixels)
+            row["legacy_time"] = time.perf_counter() - start
+            row["legacy_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1048576
+            tracemalloc.stop()
+        tracemalloc.start()
+        start = time.perf_counter()
+        write_pixels(dst, read_pixels(src, key = "bench"))
+        row["buffer_time"] = time.perf_counter() - start
+        row["buffer_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1048576
+        tracemalloc.stop()
+        bpy.data.images.remove(src)
+        bpy.data.images.remove(dst)
+        print(f"HAS pixel transfer {size}px: " + ", ".join(f"{k}={v:.3f}" for k, v in row.items() if k != "size"))
+        results.append(row)
+    return results
+
 def CheckForEmpty():
     part = get_material_collection()
 
@@ -8918,8 +11903,9 @@ def CheckForEmpty():
     for index, layer in enumerate(part.base_layers):
         if not layer.id in ids:
             part.base_layers.remove(index)
-        if layer.get_layer():
-            for si, sl in enumerate(get_layers(layer.get_layer().sub_layers)):
+        base = layer.get_layer()
+        if base:
+            for si, sl in enumerate(get_layers(base.sub_layers)):
                 if not sl.id in ids:
                     remove_by_id(sl.id)
                     sl.sub_layers.remove(si)
@@ -8932,32 +11918,28 @@ def remove_references(layer):
 
 def remove_by_id(id):
     part = get_material_collection()
-    for i, l in enumerate(part.layers):
-        for si, sl in enumerate(l.sub_layers):
-            if sl.id == id:
-                l.sub_layers.remove(i)
-                break
-    for i, l in enumerate(part.base_layers):
-        if l.id == id:
-            part.base_layers.remove(i)
-            break
-    for i, l in enumerate(part.layers):
-        if l.id == id:
-            part.layers.remove(i)
-            break
+    index = get_layer_index(part)
+    parent = get_layer_by_id(index["parents"].get(id, ""))
+    if parent:
+        position = get_ref_position(parent.sub_layers, id)
+        if position != -1:
+            parent.sub_layers.remove(position)
+    position = get_ref_position(part.base_layers, id)
+    if position != -1:
+        part.base_layers.remove(position)
+    position = get_layer_position(part, id)
+    if position != -1:
+        part.layers.remove(position)
+    clear_layer_index()
 
 def get_all_ids_from_layers():
     part = get_material_collection()
-    ids = []
-    for index, layer in enumerate(part.layers):
-        ids.append(layer.id)
-    return ids
+    return set(get_layer_index(part)["layers"])
 
 def remove_layer_ref(layers, id):
-    for i, l in enumerate(layers):
-        if l.id == id:
-            layers.remove(i)
-            return
+    position = get_ref_position(layers, id)
+    if position != -1:
+        layers.remove(position)
     
 def fixorder():
     part = get_material_collection()
@@ -8984,21 +11966,63 @@ def check_attach(self, context):
             layer.attachedto = ""
             lastlayer = layer
 
+# Position of the active material set. The key covers the active object, its
+# material slot and material, so changes made earlier in the same operator are
+# seen; reassigning a set's material, undo and file loads clear it.
+material_collection_cache = {"key": None, "index": -1}
+
+@persistent
+def clear_material_collection_cache(*args):
+    material_collection_cache["key"] = None
+
 def get_material_collection():
 
     curscene = bpy.context.scene
 
     target_view_layer = curscene.view_layers[0]
     active_object = target_view_layer.objects.active
+    if not active_object:
+        return None
 
-    part= None
     mtlprops = curscene.material_props
-    for ind, prop in enumerate(mtlprops):
-        if prop:
-            if prop.material == active_object.active_material:
-                return prop
+    active_material = active_object.active_material
+    key = (curscene.as_pointer(), active_object.as_pointer(), active_object.active_material_index, active_material.as_pointer() if active_material else 0, len(mtlprops))
+    if key != material_collection_cache["key"]:
+        index = -1
+        for ind, prop in enumerate(mtlprops):
+            if prop.material == active_material:
+                index = ind
+                break
+        material_collection_cache["key"] = key
+        material_collection_cache["index"] = index
+    index = material_collection_cache["index"]
+    return mtlprops[index] if index != -1 else None
+
+def find_material_collection(scene, name):
+    for prop in scene.material_props:
+        if prop.name == name or (prop.material and prop.material.name == name):
+            return prop
     return None
 
+def material_object_name(part):
+    active_object = bpy.context.active_object
+    if active_object and active_object.active_material == part.material:
+        return active_object.name
+    for obj in bpy.data.objects:
+        if part.material and part.material.name in obj.material_slots:
+            return obj.name
+    return active_object.name if active_object else ""
+
+def active_scene():
+    # Background sessions have no window, the context scene is the active one.
+    window = bpy.context.window
+    return window.scene if window else bpy.context.scene
+
+def set_active_scene(scene):
+    window = bpy.context.window
+    if window:
+        window.scene = scene
+
 def check_material_collection():
     mtlprops = bpy.context.scene.material_props
 
@@ -9091,6 +12115,8 @@ def SelectLayer(id):
     layer = get_layer_by_id(id)
     part.selected_layer = id
     part.selected_alpha = False
+    if bpy.context.scene.other_props.paint_focus:
+        request_shader_update()
 
     if layer.resource.image:
         SelectTexture(layer.resource.image.name)
@@ -9112,12 +12138,66 @@ def fraction_between(value, min_val, max_val):
         return 0
     return (value - min_val) / (max_val - min_val)
 
-def get_layer_by_id(id):
-    part = get_material_collection()
+# id -> position of every layer and layer reference, per material set. Adding
+# or removing layers and assigning ids clear it, positions are checked on
+# every hit so moves are picked up without hooks.
+layer_index = {}
+
+@persistent
+def clear_layer_index(*args):
+    layer_index.clear()
+
+def build_layer_index(part):
+    layers = {}
+    for i, l in enumerate(part.layers):
+        layers.setdefault(l.id, i)
+    refs = {}
+    parents = {}
+    for i, r in enumerate(part.base_layers):
+        refs.setdefault(r.id, i)
     for l in part.layers:
-        if l.id == id:
-            return l
-    return None
+        for i, r in enumerate(l.sub_layers):
+            refs.setdefault(r.id, i)
+            parents.setdefault(r.id, l.id)
+    index = {"owner": layer_index_owner(part), "count": len(part.layers), "layers": layers, "refs": refs, "parents": parents}
+    layer_index[part.as_pointer()] = index
+    return index
+
+def layer_index_owner(part):
+    # Adding material sets can move the others in memory.
+    return (part.name, part.material.as_pointer() if part.material else 0)
+
+def get_layer_index(part):
+    index = layer_index.get(part.as_pointer())
+    if index is None or index["count"] != len(part.layers) or index["owner"] != layer_index_owner(part):
+        index = build_layer_index(part)
+    return index
+
+def get_layer_position(part, id):
+    if not part:
+        return -1
+    position = get_layer_index(part)["layers"].get(id)
+    if position is None:
+        return -1
+    if position >= len(part.layers) or part.layers[position].id != id:
+        position = build_layer_index(part)["layers"].get(id, -1)
+    return position
+
+def get_ref_position(inlist, id):
+    part = get_material_collection()
+    position = get_layer_index(part)["refs"].get(id) if part else None
+    if position is not None and position < len(inlist) and inlist[position].id == id:
+        return position
+    # Moved, or a list that is not part of the layer tree.
+    for i, item in enumerate(inlist):
+        if item.id == id:
+            return i
+    return -1
+
+def get_layer_by_id(id, part = None):
+    part = part or get_material_collection()
+    position = get_layer_position(part, id)
+    return part.layers[position] if position != -1 else None
 
 def get_connected_nodes(node, visited=None):
     if visited is None:
@@ -9164,34 +12244,23 @@ def clear_socket_links(node, index):
         node_tree.links.remove(link)
 
 def get_layer_in_list(list, id):
-    for item in list:
-        if item.id == id:
-            return item
-    return None
+    position = get_ref_position(list, id)
+    return list[position] if position != -1 else None
 
 def get_layer_below(inlist, id):
-    lastind = -1
-    for item in inlist:
-        if item.id == id:
-            
-            foundlayer = inlist[lastind]
-            part = get_material_collection()
-            for layer in part.layers:
-                if layer.id == foundlayer.id:
-
-                    return layer
-        lastind = item.index
-    return None
+    position = get_ref_position(inlist, id)
+    if position == -1:
+        return None
+    lastind = inlist[position - 1].index if position > 0 else -1
+    return get_layer_by_id(inlist[lastind].id)
 
 def move_last_to_selected(inlist):
     part = get_material_collection()
 
     layer = get_layer_by_id(part.selected_layer)
     if layer:
-        foundind= -1
-        for i, ds in enumerate(inlist):
-            if ds.id == layer.id:
-                foundind = ds.index
+        position = get_ref_position(inlist, layer.id)
+        foundind = inlist[position].index if position != -1 else -1
         if not foundind == -1:
             inlist.move(len(inlist) - 1, foundind +1)
  
@@ -9232,9 +12301,8 @@ def get_image_histogram(image_name, num_bins=20, sample_rate=0.25):
     if image is None or not image.pixels:
         return ""
     
-    width, height = image.size
-    pixels = np.array(image.pixels[:], dtype=np.float32).reshape((height, width, 4))
-    normalized_values = (pixels.flatten() * (num_bins - 1)).astype(int)
+    pixels = read_pixels(image, key = "histogram")
+    normalized_values = (pixels * (num_bins - 1)).astype(int)
     histogram = np.bincount(normalized_values, minlength=num_bins)
     histogram = histogram / histogram.sum()
     
@@ -9369,7 +12437,8 @@ def save_modified_images(dummy):
     if bpy.context.scene.other_props.toggle_save:
         for image in bpy.data.images:
             if image.is_dirty:
-                bpy.ops.image.save_all_modified()
+                with profile_section("image save"):
+                    bpy.ops.image.save_all_modified()
                 return
 
 def getdescription(enumfrom, propfrom):
@@ -9516,6 +12585,11 @@ classes = [
     SetLayerData,
     SetQEFolder,
     ExportTextures,
+    CompareCompiledShader,
+    ToggleProfiling,
+    LayerListPage,
+    ResetProfiling,
+    ExportProfileTrace,
     ResizeTexturePopup,
 
     EraseBrush,
@@ -9544,6 +12618,8 @@ addon_keymaps = []
 
 def register():
     for cls in classes:
+            if 'UNDO' in getattr(cls, "bl_options", set()) and hasattr(cls, "execute") and not getattr(cls.execute, "flushes_updates", False):
+                cls.execute = flushing_execute(cls.execute)
             register_class(cls)
     register_properties()
     bpy.types.Scene.material_props = CollectionProperty(type=HASMaterialProperties)
@@ -9561,6 +12637,28 @@ def register():
 
     if save_modified_images not in bpy.app.handlers.save_pre:
         bpy.app.handlers.save_pre.append(save_modified_images)
+    if release_bake_geometry not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(release_bake_geometry)
+    if watch_bake_geometry not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(watch_bake_geometry)
+    if flush_before_undo not in bpy.app.handlers.undo_pre:
+        bpy.app.handlers.undo_pre.append(flush_before_undo)
+    if release_pixel_buffers not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(release_pixel_buffers)
+    if reset_paint_focus not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(reset_paint_focus)
+    if cancel_preview_refine not in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.append(cancel_preview_refine)
+    if watch_compiled_shader not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(watch_compiled_shader)
+    if watch_paint_focus not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(watch_paint_focus)
+    if watch_panel_view not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(watch_panel_view)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        for handler in (clear_layer_index, clear_material_collection_cache, clear_id_registry, clear_panel_view, reset_fold_states):
+            if handler not in handlers:
+                handlers.append(handler)
     bpy.types.Scene.view_data = CollectionProperty(type=ViewData)
     
     bpy.types.Scene.selected_texture = StringProperty(name="Selected Texture")
@@ -9586,6 +12684,37 @@ def unregister():
     del bpy.types.Scene.debugplane_props
     if save_modified_images in bpy.app.handlers.save_pre:
         bpy.app.handlers.save_pre.remove(save_modified_images)
+    if release_bake_geometry in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(release_bake_geometry)
+    if watch_bake_geometry in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(watch_bake_geometry)
+    if flush_before_undo in bpy.app.handlers.undo_pre:
+        bpy.app.handlers.undo_pre.remove(flush_before_undo)
+    if release_pixel_buffers in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(release_pixel_buffers)
+    if reset_paint_focus in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(reset_paint_focus)
+    if cancel_preview_refine in bpy.app.handlers.load_pre:
+        bpy.app.handlers.load_pre.remove(cancel_preview_refine)
+    if watch_compiled_shader in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(watch_compiled_shader)
+    if watch_paint_focus in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(watch_paint_focus)
+    if watch_panel_view in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(watch_panel_view)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        for handler in (clear_layer_index, clear_material_collection_cache, clear_id_registry, clear_panel_view, reset_fold_states):
+            if handler in handlers:
+                handlers.remove(handler)
+    if bpy.app.timers.is_registered(flush_updates):
+        bpy.app.timers.unregister(flush_updates)
+    if bpy.app.timers.is_registered(bake_pending_paint_focus):
+        bpy.app.timers.unregister(bake_pending_paint_focus)
+    if bpy.app.timers.is_registered(request_shader_update):
+        bpy.app.timers.unregister(request_shader_update)
+    cancel_preview_refine()
+    if bpy.app.timers.is_registered(poll_preview_refine):
+        bpy.app.timers.unregister(poll_preview_refine)
 
     wm = bpy.context.window_manager
     for km in addon_keymaps: